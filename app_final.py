@@ -1,38 +1,80 @@
+import json
+import os
+
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
-import joblib
-from sklearn.preprocessing import StandardScaler
-import geopandas as gpd
 import numpy as np
+from artifacts import get_encoder, load_artifacts
+from county_map import export_county_shapes, render_category_map, render_damage_map, render_folium_map
+from flat_trees import FlatEnsemble, load_flat_model
+from footprint import Footprint
+from instrumentation import Trace, metrics
+from model_registry import MODEL_FILES, get_model, registry
+from prediction_cache import cache as prediction_cache
+from scoring import (
+    BAND_QUANTILES, COUNTY_FEATURES, build_county_matrix, compare_hazards, predict_bands, predict_counties, predict_sweep,
+    sweep_points,
+)
 
 # Set up page and title
 st.set_page_config(page_icon=None, layout="wide")
 
+# Every stage of the rerun is timed in a span, see instrumentation.py
+trace = Trace()
+
 st.markdown("""
     <h1 style='text-align: center; color: black;'>🌪️ Welcome to the Natural Disaster Damage Prediction Tool! 🌪️</h1>
     <h4 style='color: black;'> 🌊 Select a disaster type and enter the relevant details to get an estimate of the property damage.</h4>
     <h4 style='color: black;'>📊 Simply input the attributes of the selected disaster and click the button to predict</h4>
     """, unsafe_allow_html=True)
 
-# Load pre-trained Random Forest models
-models = {
-    "Tornado": joblib.load("tornado_model.pkl"),
-    "Flood": joblib.load("flood_model.pkl"),
-    "Lightning": joblib.load("lightning_model.pkl"),
-    "High Wind": joblib.load("high_wind_model.pkl"),
-    "Wildfire": joblib.load("wildfire_model.pkl"),
-    "Tropical Depression": joblib.load("tropical_depression_model.pkl"),
-}
+@st.cache_resource
+def load_static_data():
+    # County table, county lookup (GDP per capita and Density by State, County and Year) and county
+    # shapes, loaded once per process from the start-up bundle (or from their files), see artifacts.py
+    artifacts = load_artifacts()
+    # Simplified shapes for the lightweight map, served as a static file
+    export_county_shapes(artifacts["geometry_store"])
+    return artifacts
+
 
-# Load datasets
-cmap = pd.read_csv("cmap.csv")  # Contains county locations
-df = pd.read_csv("merged_data_county.csv")  # Contains GDP per capita and Density for county
-geojson_file = 'counties.geojson'
-counties_geojson = gpd.read_file(geojson_file)
+with trace.span("static_data"):
+    artifacts = load_static_data()
+    county_lookup = artifacts["county_lookup"]
+    geometry_store = artifacts["geometry_store"]
+    # Read-only table shared by the sessions (memory-mapped, see county_tables.py): the predictions
+    # of a rerun are kept in their own arrays
+    cmap = artifacts["cmap"]  # Contains county locations
 
 # Disaster type selection
-disaster_type = st.sidebar.selectbox("Select a disaster type:", list(models.keys()), key="disaster_type_selector")
-model = models[disaster_type]
+disaster_type = st.sidebar.selectbox("Select a disaster type:", list(MODEL_FILES.keys()), key="disaster_type_selector")
+# The models are loaded the first time they are selected and shared by all the sessions
+with trace.span("model_load"):
+    model = get_model(disaster_type)
+
+
+def finish_rerun(status="ok", **fields):
+    # Ends the timing trace of the rerun: it is logged, written to the metrics file and optionally shown in the sidebar
+    rerun = trace.finish(status, disaster_type=disaster_type, **fields)
+    if st.sidebar.checkbox("Show timings"):
+        process_spans = metrics.summary()
+        st.sidebar.dataframe(pd.DataFrame(
+            [(name, seconds * 1000, process_spans[name][1] * 1000, process_spans[name][0])
+             for name, seconds in [*rerun["spans"].items(), ("rerun", rerun["seconds"])]],
+            columns=["Stage", "This rerun (ms)", "Mean (ms)", "Reruns"],
+        ).set_index("Stage").round(1))
+        memory = [f"peak allocations {rerun['peak_traced_mb']:.1f} MB"] if "peak_traced_mb" in rerun else []
+        memory += [f"{label} {rerun[key]:.0f} MB" for key, label in (("rss_mb", "RSS"), ("max_rss_mb", "max RSS")) if key in rerun]
+        if memory:
+            st.sidebar.caption("Memory: " + ", ".join(memory))
+
+
+def stop_rerun():
+    # Ends the timing trace of the rerun before stopping the script
+    finish_rerun("stopped")
+    st.stop()
+
 
 # Add definition of each natural disaster for enhanced clarity
 disaster_definitions = {
@@ -44,108 +86,27 @@ disaster_definitions = {
     "Tropical Depression": "A low-pressure weather system with organized thunderstorms. 🌀"
 }
 
+# Colour of each disaster type on the dominant hazard map
+HAZARD_COLORS = ["#7b3294", "#2c7bb6", "#fdae61", "#abd9e9", "#d7191c", "#1a9641"]
+
 # Display definitions
 st.sidebar.write(f"**Definition:** {disaster_definitions[disaster_type]}")
 
 # State selection
-state_options = sorted(df["State"].dropna().unique())
-selected_state = st.sidebar.selectbox("Select a state:", state_options)
+selected_state = st.sidebar.selectbox("Select a state:", county_lookup.state_options)
 
-# Filter counties based on selected state
-state_counties = df[df["State"] == selected_state]["County"].dropna().astype(str).unique()
-selected_county = st.sidebar.selectbox("Select a county:", sorted(state_counties))
+# Counties of the selected state
+state_counties = county_lookup.counties(selected_state)
+selected_county = st.sidebar.selectbox("Select a county:", state_counties)
 
 if len(state_counties) == 0:
     st.error(f"No counties found for the selected state: {selected_state}")
-    st.stop()
+    stop_rerun()
+
+# The features of each model, in training column order, are compiled from its *_features.txt file
+encoder = get_encoder(disaster_type)
 
-# Tornado state list
-state_list_tor = [
-    "State_Arizona", "State_Arkansas", "State_California", "State_Colorado",
-    "State_Delaware", "State_District Of Columbia", "State_Florida", "State_Georgia",
-    "State_Hawaii", "State_Idaho", "State_Illinois", "State_Indiana", "State_Iowa",
-    "State_Kansas", "State_Kentucky", "State_Louisiana", "State_Maine", "State_Maryland",
-    "State_Massachusetts", "State_Michigan", "State_Minnesota", "State_Mississippi",
-    "State_Missouri", "State_Montana", "State_Nebraska", "State_Nevada",
-    "State_New Hampshire", "State_New Jersey", "State_New Mexico", "State_New York",
-    "State_North Carolina", "State_North Dakota", "State_Ohio", "State_Oklahoma",
-    "State_Oregon", "State_Pennsylvania", "State_Rhode Island", "State_South Carolina",
-    "State_South Dakota", "State_Tennessee", "State_Texas", "State_Utah", "State_Vermont",
-    "State_Virginia", "State_Washington", "State_West Virginia", "State_Wisconsin", "State_Wyoming"
-]
-
-# High Wind state list
-state_list_wind =[
-    "State_Alaska", "State_Arizona", "State_Arkansas", "State_California", "State_Colorado",
-    "State_Delaware", "State_District Of Columbia", "State_Florida", "State_Georgia",
-    "State_Hawaii", "State_Idaho", "State_Illinois", "State_Indiana", "State_Iowa",
-    "State_Kansas", "State_Kentucky", "State_Louisiana", "State_Maine", "State_Maryland",
-    "State_Massachusetts", "State_Michigan", "State_Minnesota", "State_Mississippi",
-    "State_Missouri", "State_Montana", "State_Nebraska", "State_Nevada",
-    "State_New Hampshire", "State_New Jersey", "State_New Mexico", "State_New York",
-    "State_North Carolina", "State_North Dakota", "State_Ohio", "State_Oklahoma",
-    "State_Oregon", "State_Pennsylvania", "State_Rhode Island", "State_South Carolina",
-    "State_South Dakota", "State_Tennessee", "State_Texas", "State_Utah", "State_Vermont",
-    "State_Virginia", "State_Washington", "State_West Virginia", "State_Wisconsin", "State_Wyoming"
-]
-
-# Wildfire state list
-state_list_fire = [
-    "State_Alaska", "State_Arizona", "State_Arkansas", "State_California", "State_Colorado",
-    "State_Delaware", "State_Florida", "State_Georgia", "State_Hawaii", "State_Idaho",
-    "State_Illinois", "State_Indiana", "State_Iowa", "State_Kansas", "State_Kentucky",
-    "State_Louisiana", "State_Maryland", "State_Massachusetts", "State_Michigan",
-    "State_Minnesota", "State_Missouri", "State_Montana", "State_Nebraska", 
-    "State_Nevada", "State_New Jersey", "State_New Mexico", "State_New York",
-    "State_North Carolina", "State_North Dakota", "State_Oklahoma", "State_Oregon",
-    "State_Pennsylvania", "State_South Carolina", "State_South Dakota", "State_Tennessee",
-    "State_Texas", "State_Utah", "State_Virginia", "State_Washington", 
-    "State_West Virginia", "State_Wisconsin", "State_Wyoming"
-]
-
-# Lightining state list
-state_list_light = [
-    "State_Arizona", "State_Arkansas", "State_California", "State_Colorado", "State_Delaware",
-    "State_District Of Columbia", "State_Florida", "State_Georgia", "State_Hawaii", "State_Idaho",
-    "State_Illinois", "State_Indiana", "State_Iowa", "State_Kansas", "State_Kentucky",
-    "State_Louisiana", "State_Maine", "State_Maryland", "State_Massachusetts", "State_Michigan",
-    "State_Minnesota", "State_Mississippi", "State_Missouri", "State_Montana", "State_Nebraska",
-    "State_Nevada", "State_New Hampshire", "State_New Jersey", "State_New Mexico", "State_New York",
-    "State_North Carolina", "State_North Dakota", "State_Ohio", "State_Oklahoma", "State_Oregon",
-    "State_Pennsylvania", "State_Rhode Island", "State_South Carolina", "State_South Dakota", "State_Tennessee",
-    "State_Texas", "State_Utah", "State_Vermont", "State_Virginia", "State_Washington",
-    "State_West Virginia", "State_Wisconsin", "State_Wyoming"
-]
-
-# Flood state list
-state_list_flood = [
-    "State_Alaska", "State_Arizona", "State_Arkansas", "State_California", "State_Colorado", 
-    "State_Delaware", "State_District Of Columbia", "State_Florida", "State_Georgia", "State_Hawaii",
-    "State_Idaho", "State_Illinois", "State_Indiana", "State_Iowa", "State_Kansas",
-    "State_Kentucky", "State_Louisiana", "State_Maine", "State_Maryland", "State_Massachusetts",
-    "State_Michigan", "State_Minnesota", "State_Mississippi", "State_Missouri", "State_Montana",
-    "State_Nebraska", "State_Nevada", "State_New Hampshire", "State_New Jersey", "State_New Mexico",
-    "State_New York", "State_North Carolina", "State_North Dakota", "State_Ohio", "State_Oklahoma",
-    "State_Oregon", "State_Pennsylvania", "State_Rhode Island", "State_South Carolina", "State_South Dakota",
-    "State_Tennessee", "State_Texas", "State_Utah", "State_Vermont", "State_Virginia",
-    "State_Washington", "State_West Virginia", "State_Wisconsin", "State_Wyoming"
-]
-
-# Tropical Depression state list
-state_list_trop = ["State_Arkansas", "State_Florida", "State_Georgia", "State_Louisiana", "State_Mississippi", "State_South Carolina", "State_Tennessee", "State_Texas"
-]
-
-# Initialize all state columns with 0
-state_data_tor = {col: 0 for col in state_list_tor}
-state_data_wind = {col: 0 for col in state_list_wind}
-state_data_fire = {col: 0 for col in state_list_fire}
-state_data_light = {col: 0 for col in state_list_light}
-state_data_flood = {col: 0 for col in state_list_flood}
-state_data_trop = {col: 0 for col in state_list_trop}
-
-# Set the selected state's column to 1
 selected_state_cap = selected_state.title()
-state_column = f"State_{selected_state_cap}"
 
 # Year selection
 year = st.sidebar.number_input("Year:", min_value=2007, max_value=2030, value=2022)
@@ -166,400 +127,376 @@ if year > 2022:
         density = st.sidebar.number_input("Enter population density for the county (people per sq. km):", min_value=0.0, step=10.0)
     else:
         # Fetch latest data from the dataset
-        county_data = df[(df["State"] == selected_state) & (df["County"] == selected_county) & (df["Year"] == 2022)]
+        with trace.span("county_lookup"):
+            county_data = county_lookup.lookup(selected_state, selected_county, 2022)
         
-        if county_data.empty:
+        if county_data is None:
             st.error(f"No GDP or Density data found for {selected_county}, {selected_state} in the year 2022.")
-            st.stop()
+            stop_rerun()
         
         # Extract GDP per capita and Density from the dataset
-        gdp_per_capita = county_data["GDP_per_capita"].values[0]
-        density = county_data["Density"].values[0]
+        gdp_per_capita, density = county_data
 else:
     # Fetch GDP per capita and Density for the selected county and year
-    county_data = df[(df["State"] == selected_state) & 
-                     (df["County"] == selected_county) & 
-                     (df["Year"] == year)]
+    with trace.span("county_lookup"):
+        county_data = county_lookup.lookup(selected_state, selected_county, year)
     
-    if county_data.empty:
+    if county_data is None:
         st.error(f"No GDP or Density data found for {selected_county}, {selected_state} in the year {year}.")
-        st.stop()
+        stop_rerun()
     
     # Extract GDP per capita and Density values
-    gdp_per_capita = county_data["GDP_per_capita"].values[0]
-    density = county_data["Density"].values[0]
+    gdp_per_capita, density = county_data
 
 
 # Sidebar Inputs - Common inputs across all disasters
-injuries_direct = st.sidebar.number_input("Number of direct injuries:", min_value=0, value=0)
-injuries_indirect = st.sidebar.number_input("Number of indirect injuries:", min_value=0, value=0)
-deaths_direct = st.sidebar.number_input("Number of direct deaths:", min_value=0, value=0)
-deaths_indirect = st.sidebar.number_input("Number of indirect deaths:", min_value=0, value=0)
-duration_hours = st.sidebar.slider("Disaster Duration (hours):", min_value=1, max_value=100, value=10)
+scenario = {
+    "Year": year,
+    "State": selected_state_cap,
+    "GDP_per_capita": gdp_per_capita,
+    "Density": density,
+    "INJURIES_DIRECT": st.sidebar.number_input("Number of direct injuries:", min_value=0, value=0),
+    "INJURIES_INDIRECT": st.sidebar.number_input("Number of indirect injuries:", min_value=0, value=0),
+    "DEATHS_DIRECT": st.sidebar.number_input("Number of direct deaths:", min_value=0, value=0),
+    "DEATHS_INDIRECT": st.sidebar.number_input("Number of indirect deaths:", min_value=0, value=0),
+    "DURATION_HOURS": st.sidebar.slider("Disaster Duration (hours):", min_value=1, max_value=100, value=10),
+}
 
 # Dynamic Inputs by Disaster Type
+if disaster_type in ("Tornado", "Flood", "Lightning"):
+    scenario["Distance_km"] = st.sidebar.number_input("Distance from the affected area (km):", min_value=0.0, step=0.1)
+
 if disaster_type == "Tornado":
-    distance_tor = st.sidebar.number_input("Distance from the affected area (km):", min_value=0.0, step=0.1)
-    tor_length = st.sidebar.number_input("Tornado Length (in km):", min_value=0.0, step=0.1)
-    tor_width = st.sidebar.number_input("Tornado Width (in km):", min_value=0.0, step=0.1)
-    tor_f_scale = st.sidebar.selectbox("Tornado F-Scale Rating:", 
-                                        ["F0", "F1", "F2", "F3", "F4", "EF1", "EF2", "EF3", "EF4", "EF5", "EFU"])
-                                        
-    if state_column in state_data_tor:
-        state_data_tor[state_column] = 1
-    else:
-        st.error(f"There have not been any recorded tornado in the State of {selected_state} since 2007")
-        st.stop()
-
-    # Set one-hot encoding for the F-Scale data
-    tor_f_scale_data = {
-        "TOR_F_SCALE_EF1": 1 if tor_f_scale == "EF1" else 0,
-        "TOR_F_SCALE_EF2": 1 if tor_f_scale == "EF2" else 0,
-        "TOR_F_SCALE_EF3": 1 if tor_f_scale == "EF3" else 0,
-        "TOR_F_SCALE_EF4": 1 if tor_f_scale == "EF4" else 0,
-        "TOR_F_SCALE_EF5": 1 if tor_f_scale == "EF5" else 0,
-        "TOR_F_SCALE_EFU": 1 if tor_f_scale == "EFU" else 0,
-        "TOR_F_SCALE_F0": 1 if tor_f_scale == "F0" else 0,
-        "TOR_F_SCALE_F1": 1 if tor_f_scale == "F1" else 0,
-        "TOR_F_SCALE_F2": 1 if tor_f_scale == "F2" else 0,
-        "TOR_F_SCALE_F3": 1 if tor_f_scale == "F3" else 0,
-        "TOR_F_SCALE_F4": 1 if tor_f_scale == "F4" else 0,  
-    }
-
-    # Input Data dictionary structure for Tornado
-    input_data = pd.DataFrame({
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "TOR_LENGTH": [tor_length],
-        "TOR_WIDTH": [tor_width],
-        "DURATION_HOURS": [duration_hours], 
-        "Distance_km": [distance_tor],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_tor,  # Ensure state encoding
-        **tor_f_scale_data  
-    })
+    scenario["TOR_LENGTH"] = st.sidebar.number_input("Tornado Length (in km):", min_value=0.0, step=0.1)
+    scenario["TOR_WIDTH"] = st.sidebar.number_input("Tornado Width (in km):", min_value=0.0, step=0.1)
+    # F-Scale ratings first, then the Enhanced F-Scale ones
+    f_scales = sorted(encoder.categories("TOR_F_SCALE"), key=lambda rating: (rating.startswith("EF"), rating))
+    scenario["TOR_F_SCALE"] = st.sidebar.selectbox("Tornado F-Scale Rating:", f_scales)
 
 if disaster_type == "Flood":
-    distance_km_flood = st.sidebar.number_input("Distance from the affected area (km):", min_value=0.0, step=0.1)
-    flood_cause = st.sidebar.selectbox("Flood Cause:", 
-                                        ["Heavy Rain", "Heavy Rain / Burn Area", "Heavy Rain / Snow Melt", "Heavy Rain / Tropical System", "Ice Jam", "Dam Release"])
-    flood_cause_data = {
-       "FLOOD_CAUSE_Heavy Rain": 1 if flood_cause == "Heavy Rain" else 0,
-       "FLOOD_CAUSE_Heavy Rain / Burn Area": 1 if flood_cause == "Heavy Rain / Burn Area" else 0,
-       "FLOOD_CAUSE_Heavy Rain / Snow Melt": 1 if flood_cause == "Heavy Rain / Snow Melt" else 0,
-       "FLOOD_CAUSE_Heavy Rain / Tropical System": 1 if flood_cause == "Heavy Rain / Tropical System" else 0,
-       "FLOOD_CAUSE_Ice Jam": 1 if flood_cause == "Ice Jam" else 0,
-       "FLOOD_CAUSE_Planned Dam Release": 1 if flood_cause == "Dam Release" else 0,     
-     }
-     
-    if state_column in state_data_flood:
-       state_data_flood[state_column] = 1
-    else:
-        st.error(f"There have not been any recorded flood in the State of {selected_state} since 2007")
-        st.stop()                       
-
-    input_data = pd.DataFrame({
-        **state_data_flood,
-        "Year": [year],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        "DURATION_HOURS": [duration_hours],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "Distance_km": [distance_km_flood],
-        **flood_cause_data
-    })
-
-if disaster_type == "High Wind":
-    magnitude = st.sidebar.number_input("Magnitude:", min_value=0.0, step=0.1)
-    
-    if state_column in state_data_wind:
-        state_data_wind[state_column] = 1
-    else:
-        st.error(f"There have not been any recorded high wind in the State of {selected_state} since 2007")
-        st.stop()
-    
-    input_data = pd.DataFrame({
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "MAGNITUDE": [magnitude],
-        "DURATION_HOURS": [duration_hours],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_wind,
-    })
-
-if disaster_type == "Wildfire":
-    magnitude = st.sidebar.number_input("Magnitude:", min_value=0.0, step=0.1)
-    
-    if state_column in state_data_fire:
-        state_data_fire[state_column] = 1
-    else:
-        st.error(f"There have not been any recorded wildfire in the State of {selected_state} since 2007")
-        st.stop()
-    
-    input_data = pd.DataFrame({
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "DURATION_HOURS": [duration_hours],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_fire,
-    })
-
-if disaster_type == "Lightning":
-    distance_light = st.sidebar.number_input("Distance from the affected area (km):", min_value=0.0, step=0.1)
-    
-    if state_column in state_data_light:
-        state_data_light[state_column] = 1
-    else:
-        st.error(f"There have not been any recorded lightning in the State of {selected_state} since 2007")
-        st.stop()
-    
-    input_data = pd.DataFrame({
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "DURATION_HOURS": [duration_hours],
-        "Distance_km": [distance_light],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_light,
-    })
-
-if disaster_type == "Tropical Depression":
-     
-    if state_column in state_data_trop:
-        state_data_trop[state_column] = 1
-    else:
-        st.error(f"There have not been any recorded tropical depression in the State of {selected_state} since 2007")
-        st.stop()
-    
-    input_data = pd.DataFrame({
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "DURATION_HOURS": [duration_hours],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_trop,
-    })
+    scenario["FLOOD_CAUSE"] = st.sidebar.selectbox("Flood Cause:", encoder.categories("FLOOD_CAUSE"))
+
+if disaster_type in ("High Wind", "Wildfire"):
+    scenario["MAGNITUDE"] = st.sidebar.number_input("Magnitude:", min_value=0.0, step=0.1)
+
+
+def draw_footprint(center):
+    # Map of streamlit-folium on which the footprint is drawn, returns the drawn shapes as GeoJSON features
+    import folium
+    from folium.plugins import Draw
+    from streamlit_folium import st_folium
+
+    st.subheader("Event footprint:")
+    st.caption("Draw the track of the event (line), its area (polygon or rectangle) or a circle around it.")
+    m = folium.Map(location=center, zoom_start=8)
+    Draw(draw_options={"polyline": True, "polygon": True, "rectangle": True, "circle": True,
+                       "marker": False, "circlemarker": False}).add_to(m)
+    output = st_folium(m, width=1200, height=500, returned_objects=["all_drawings"], key="footprint_map")
+    return (output or {}).get("all_drawings")
+
+
+# Event footprint: every county gets its own distance to a drawn or uploaded track, area or point,
+# found with the spatial index of the county shapes, instead of the single distance entered above
+footprint = None
+county_distance = None
+if "Distance_km" in scenario and st.sidebar.checkbox(
+    "Event footprint", help="Draw or upload the track or the area of the event to compute the distance of every county"
+):
+    footprint_input = st.sidebar.radio("Footprint:", ("Draw on the map", "Upload GeoJSON", "Point and radius"))
+    max_distance = st.sidebar.slider("Counties within (km of the footprint):", min_value=0.0, max_value=200.0,
+                                     value=50.0, step=5.0)
+    selected_geoid = county_lookup.geoid_by_name.get((selected_state, selected_county), -1)
+    selected_row = geometry_store.rows([selected_geoid])
+    footprint_center = geometry_store.center(selected_row) if selected_row[0] >= 0 else geometry_store.center()
+    try:
+        if footprint_input == "Point and radius":
+            lat = st.sidebar.number_input("Latitude:", min_value=-90.0, max_value=90.0,
+                                          value=round(float(footprint_center[0]), 4), format="%.4f")
+            lon = st.sidebar.number_input("Longitude:", min_value=-180.0, max_value=180.0,
+                                          value=round(float(footprint_center[1]), 4), format="%.4f")
+            radius = st.sidebar.number_input("Radius (km):", min_value=0.0, value=10.0, step=1.0)
+            footprint = Footprint.from_point(lat, lon, radius)
+        elif footprint_input == "Upload GeoJSON":
+            upload = st.sidebar.file_uploader("Footprint (GeoJSON):", type=["geojson", "json"])
+            if upload is not None:
+                footprint = Footprint.from_geojson(upload.getvalue())
+        else:
+            drawings = draw_footprint(footprint_center)
+            if drawings:
+                footprint = Footprint.from_geojson({"type": "FeatureCollection", "features": drawings})
+    except Exception as e:
+        st.error(f"Could not read the footprint: {e}")
+
+    if footprint is not None:
+        with trace.span("footprint"):
+            county_distance = footprint.county_distances(geometry_store, cmap["GEOID"], max_distance)
+            if selected_row[0] >= 0:
+                # The selected county is scored with its own distance, even beyond the map distance
+                scenario["Distance_km"] = float(footprint.distances_km(geometry_store.geometries()[selected_row])[0])
+        st.sidebar.caption(f"{np.isfinite(county_distance).sum()} counties within {max_distance:g} km of the footprint, "
+                           f"{selected_county} at {scenario['Distance_km']:.1f} km")
+
+# Comparison of every hazard for the same scenario, instead of the prediction of the selected one
+if st.sidebar.checkbox("Compare all hazards", help="Score every county with the model of every disaster type"):
+    st.subheader("Multi-hazard comparison:")
+    st.caption("The inputs that only exist for other disaster types (e.g. the tornado size or the magnitude) "
+               "keep their default values. Counties in states without any recorded event of a type are left out for that type.")
+    compared_types = [name for name, path in MODEL_FILES.items() if os.path.exists(path)]
+    compare_key = ("All hazards", int(year), json.dumps(
+        {k: v for k, v in scenario.items() if k not in ("State", *COUNTY_FEATURES)}, sort_keys=True, default=str
+    ), None if county_distance is None else county_distance.tobytes())
+    hazards = prediction_cache.get(compare_key, "county_damage")
+    if hazards is None:
+        with st.spinner("Scoring every hazard... Please wait."):
+            with trace.span("model_load"):
+                models = registry.get_many(compared_types)
+            # Every county is scored with its own state, the models run concurrently
+            counties = cmap[COUNTY_FEATURES].assign(State=county_lookup.states(cmap["GEOID"]))
+            if county_distance is not None:
+                # Only the counties within reach of the footprint, each with its own distance
+                counties = counties.assign(Distance_km=county_distance)
+            with trace.span("compare_hazards"):
+                hazards = compare_hazards(models, {t: get_encoder(t) for t in compared_types}, scenario, counties)
+        prediction_cache.put(compare_key, "county_damage", hazards)
+
+    # Dominant hazard of every county, blank where no model covers the state
+    scored = hazards.notna().any(axis=1).to_numpy()
+    dominant = np.where(scored, np.argmax(hazards.fillna(-np.inf).to_numpy(), axis=1), -1)
+    rows = geometry_store.rows(cmap["GEOID"])
+    with trace.span("map_lightweight"):
+        map_html = render_category_map(cmap["GEOID"], dominant, compared_types, HAZARD_COLORS[:len(compared_types)],
+                                       geometry_store.center(rows[rows >= 0]), legend_name="Dominant hazard")
+    components.html(map_html, width=1200, height=1010)
+
+    # Per-county breakdown, the selected state first
+    breakdown = hazards.assign(County=cmap["NAME"], State=county_lookup.states(cmap["GEOID"]))
+    breakdown["Dominant hazard"] = np.where(scored, np.array(compared_types, dtype=object)[np.maximum(dominant, 0)], None)
+    breakdown = breakdown[["County", "State", *compared_types, "Dominant hazard"]]
+    breakdown = breakdown.assign(other_state=breakdown["State"] != selected_state)
+    breakdown = breakdown.sort_values(["other_state", "State", "County"]).drop(columns="other_state")
+    st.dataframe(breakdown.set_index(["County", "State"]).round(2), height=400)
+    st.write("Counties where each hazard dominates:", breakdown["Dominant hazard"].value_counts())
+    finish_rerun(mode="compare")
+    st.stop()
+
+# The models only know the states in which the disaster was recorded
+if not encoder.covers("State", selected_state_cap):
+    st.error(f"There have not been any recorded {disaster_type.lower()} in the State of {selected_state} since 2007")
+    stop_rerun()
+
+# The scenario is encoded straight into the model's feature vector (scaled like the training data)
+with trace.span("feature_build"):
+    input_data = encoder.encode(scenario)[np.newaxis, :]
+
+
+# Results of the scenarios that were already computed are taken from the shared prediction cache
+prediction_key = prediction_cache.key(disaster_type, input_data[0], year)
+
+# Uncertainty bands come from the outputs of every tree, computed with the flat arrays of the model
+show_bands = st.sidebar.checkbox("Show uncertainty bands", help="10th to 90th percentile of the trees of the model")
+
+
+@st.cache_resource
+def load_tree_arrays(disaster_type):
+    # Exported flat arrays of the model, or converted from the pickle the first time
+    flat = load_flat_model(disaster_type)
+    return flat if flat is not None else FlatEnsemble.from_model(get_model(disaster_type))
 
 
 # Prediction logic
 if st.sidebar.button("Predict Property Damage 📊"):
     try:
         with st.spinner("Calculating predictions... Please wait."):
-            predicted_damage = model.predict(input_data)
+            predicted_damage = prediction_cache.get(prediction_key, "prediction")
+            if predicted_damage is None:
+                with trace.span("predict"):
+                    predicted_damage = model.predict(input_data)
+                prediction_cache.put(prediction_key, "prediction", predicted_damage)
             transformed_damage = np.exp(predicted_damage[0])
         st.subheader("Predicted Damage:")
         st.markdown(f"<h3>${transformed_damage:,.2f}</h3>", unsafe_allow_html=True)
+        if show_bands:
+            bands = prediction_cache.get(prediction_key, "bands")
+            if bands is None:
+                with trace.span("bands"):
+                    bands = predict_bands(load_tree_arrays(disaster_type), input_data)
+                prediction_cache.put(prediction_key, "bands", bands)
+            low, high = np.exp(bands[:, 0])
+            st.caption(f"Uncertainty band ({BAND_QUANTILES[0]:.0%} to {BAND_QUANTILES[1]:.0%}): ${low:,.2f} to ${high:,.2f}")
     except Exception as e:
         st.error(f"Error making prediction: {e}")
 else:
     st.write("Adjust the inputs on the sidebar and click the button to make predictions.")
 
 
-#County predictions for interactive map
-import folium
-from folium.plugins import MarkerCluster
-from streamlit_folium import folium_static
-import geopandas as gpd
-if disaster_type=='Tornado':
-    tornado_data = {
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "TOR_LENGTH": [tor_length],
-        "TOR_WIDTH": [tor_width],
-        "DURATION_HOURS": [duration_hours], 
-        "Distance_km": [distance_tor],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_tor,
-        **tor_f_scale_data}
-    
-if disaster_type=='Flood':
-    flood_data = {
-        **state_data_flood,
-        "Year": [year],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        "DURATION_HOURS": [duration_hours],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "Distance_km": [distance_km_flood],
-        **flood_cause_data
-    }
-if disaster_type=='High Wind':
-    high_wind_data = {
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "MAGNITUDE": [magnitude],
-        "DURATION_HOURS": [duration_hours],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_wind,
-    }
-if disaster_type=='Wildfire':
-    wildfire_data = {
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "DURATION_HOURS": [duration_hours],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_fire,
-    }
-if disaster_type=='Lightning':
-    lightning_data ={
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "DURATION_HOURS": [duration_hours],
-        "Distance_km": [distance_light],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_light,
-    }
-
-if disaster_type == "Tropical Depression":
-    tropical_data ={
-        "Year": [year],
-        "INJURIES_DIRECT": [injuries_direct],
-        "INJURIES_INDIRECT": [injuries_indirect],
-        "DEATHS_DIRECT": [deaths_direct],
-        "DEATHS_INDIRECT": [deaths_indirect],
-        "DURATION_HOURS": [duration_hours],
-        "GDP_per_capita": [gdp_per_capita],
-        "Density": [density],
-        **state_data_trop,
-    }
-
-import streamlit as st
-from streamlit_folium import folium_static
-from shapely import wkt
-import folium
-
-# Input data based on the selected disaster type
-if disaster_type == "Tornado":
-    input_data = tornado_data
-elif disaster_type == "Flood":
-    input_data = flood_data
-elif disaster_type == "High Wind":
-    input_data = high_wind_data
-elif disaster_type == "Wildfire":
-    input_data = wildfire_data
-elif disaster_type == "Lightning":
-    input_data = lightning_data
-elif disaster_type == "Tropical Depression":
-    input_data = tropical_data
-
-# Now we insert the user inputs in the cmap dataframe, which contains the Geo JSON information and features for each county.
-# The GDP per capita and Density must not change based on user inputs as they depend on the county
-predicted_damages = []
-
-for key in input_data.keys():
-    if key not in cmap.columns and key not in ['Density', 'GDP_per_capita']:
-        cmap[key] = None  # Add missing dummy encoded columns
-
-# Loop for cmap rows
-for index, row in cmap.iterrows():
-    model_input = {}
-
-    for key, value in input_data.items():
-        # Skip Density and GDP per capita
-        if key in ['Density', 'GDP_per_capita']:
-            model_input[key] = row[key] 
+# What-if sweep: the damage of every county for a range of values of one or two inputs
+SWEEP_INPUTS = {
+    "DURATION_HOURS": ("Disaster Duration (hours)", 1.0, 100.0),
+    "Distance_km": ("Distance from the affected area (km)", 0.0, 50.0),
+    "TOR_LENGTH": ("Tornado Length (in km)", 0.0, 50.0),
+    "TOR_WIDTH": ("Tornado Width (in km)", 0.0, 5.0),
+    "MAGNITUDE": ("Magnitude", 0.0, 100.0),
+    "INJURIES_DIRECT": ("Number of direct injuries", 0.0, 50.0),
+    "DEATHS_DIRECT": ("Number of direct deaths", 0.0, 20.0),
+}
+sweep_inputs = [feature for feature in SWEEP_INPUTS if feature in scenario and feature in encoder.index]
+
+# The map shows the current scenario, or the selected point of the sweep
+map_scenario = scenario
+
+# With a footprint the counties have their own distances, which the sweep does not vary
+sweep = st.sidebar.checkbox("What-if sweep", disabled=footprint is not None,
+                            help="Not available with an event footprint" if footprint is not None else None)
+if sweep and footprint is None and sweep_inputs:
+    swept = st.sidebar.multiselect(
+        "Inputs to sweep (one or two):", sweep_inputs, default=sweep_inputs[:1], max_selections=2,
+        format_func=lambda feature: SWEEP_INPUTS[feature][0],
+    )
+    grid = {}
+    for feature in swept:
+        label, low, high = SWEEP_INPUTS[feature]
+        low, high = st.sidebar.slider(f"{label} range:", min_value=low, max_value=high, value=(low, high))
+        # 2D sweeps score steps x steps scenarios for every county, so they get fewer steps
+        steps = st.sidebar.number_input(f"{label} steps:", min_value=2, max_value=50 if len(swept) == 1 else 15,
+                                        value=20 if len(swept) == 1 else 8)
+        grid[feature] = np.linspace(low, high, int(steps))
+
+    if grid:
+        # Every county plus the selected county (last column) for every grid point, scored in one batched pass
+        sweep_counties = pd.concat(
+            [cmap[COUNTY_FEATURES], pd.DataFrame({"GDP_per_capita": [gdp_per_capita], "Density": [density]})],
+            ignore_index=True,
+        )
+        sweep_name = "sweep " + " ".join(f"{f}={v[0]:g}:{v[-1]:g}:{len(v)}" for f, v in grid.items())
+        sweep_damage = prediction_cache.get(prediction_key, sweep_name)
+        if sweep_damage is None:
+            with st.spinner("Scoring the sweep... Please wait."), trace.span("sweep"):
+                _, sweep_damage = predict_sweep(model, encoder, scenario, sweep_counties, grid)
+            prediction_cache.put(prediction_key, sweep_name, sweep_damage)
+        points = sweep_points(grid)
+        county_sweep, selected_sweep = sweep_damage[:, :-1], sweep_damage[:, -1]
+
+        # Response curves of the selected county and of the median county
+        st.subheader("What-if sweep:")
+        first, *second = swept
+        index = pd.Index(grid[first], name=SWEEP_INPUTS[first][0])
+        if second:
+            # One curve of the selected county per value of the second input
+            curves = pd.DataFrame(
+                selected_sweep.reshape(len(grid[first]), -1), index=index,
+                columns=[f"{SWEEP_INPUTS[second[0]][0]} = {v:g}" for v in grid[second[0]]],
+            )
         else:
-            # Else we use the input data
-            model_input[key] = value[0] if isinstance(value, list) else value
-            cmap.at[index, key] = model_input[key]  # Update cmap to ensure consistent DataFrame
-
-    # Convert to DataFrame
-    model_input_df = pd.DataFrame([model_input])
-
-    prediction = model.predict(model_input_df)
-
-    prediction = np.expm1(prediction)
-
-    predicted_damages.append(prediction[0])  # Store prediction in the predicted damages list
-
-# Add to predicted damage column in cmap
-cmap["predicted_damage"] = predicted_damages
+            curves = pd.DataFrame({
+                f"{selected_county}, {selected_state}": selected_sweep,
+                "Median county": np.median(county_sweep, axis=1),
+            }, index=index)
+        st.line_chart(curves)
+
+        # The map shows the grid point picked here
+        point = {
+            feature: st.select_slider(f"Map at {SWEEP_INPUTS[feature][0].lower()}:", options=list(grid[feature]),
+                                      format_func=lambda v: f"{v:g}")
+            for feature in swept
+        }
+        point_index = int(np.flatnonzero((points == [point[feature] for feature in swept]).all(axis=1))[0])
+        map_scenario = {**scenario, **point}
+        st.caption(f"Predicted damage in {selected_county}, {selected_state} at this point: "
+                   f"${selected_sweep[point_index]:,.2f}")
 
-# Convert to GeoDataFrame
-cmap['geometry'] = cmap['geometry'].apply(wkt.loads)
-cmap_gdf = gpd.GeoDataFrame(cmap, geometry='geometry', crs="EPSG:4326")
 
+#County predictions for interactive map
 
+# The county map does not depend on the selected county, so its cache key leaves out the county values
+map_features = encoder.encode({k: v for k, v in map_scenario.items() if k not in COUNTY_FEATURES})
+if county_distance is not None:
+    # ... but it depends on the distance of every county to the footprint
+    map_features = np.concatenate([map_features, np.nan_to_num(county_distance, nan=-1)])
+map_key = prediction_cache.key(disaster_type, map_features, year)
+# Looked up once per rerun, so that a cold render counts a single miss
+county_damage = prediction_cache.get(map_key, "county_damage")
+if county_damage is None and map_scenario is not scenario:
+    # The damage of the counties at the selected grid point was already scored by the sweep
+    county_damage = county_sweep[point_index].copy()
+    prediction_cache.put(map_key, "county_damage", county_damage)
+
+
+
+def score_map_counties(score):
+    # Runs score(counties, varying) on the counties of the map. With a footprint only the counties
+    # within its reach are scored, with their distances, and the others are NaN (blank on the map)
+    if county_distance is None:
+        return score(cmap, None)
+    affected = np.isfinite(county_distance)
+    scores = score(cmap[affected], {"Distance_km": county_distance[affected]})
+    values = np.full(scores.shape[:-1] + (len(cmap),), np.nan)
+    values[..., affected] = scores
+    return values
+
+
+# Now we score every county in one batch: the user inputs are shared by all the counties,
+# while the GDP per capita and Density are taken from each county in the cmap dataframe
+if county_damage is None:
+    with trace.span("county_predict"):
+        county_damage = score_map_counties(
+            lambda counties, varying: predict_counties(model, encoder, map_scenario, counties, varying)
+        )
+    prediction_cache.put(map_key, "county_damage", county_damage)
+
+# With the uncertainty bands, the map can show the low or the high end of the band of every county
+map_band = "Prediction"
+if show_bands:
+    map_band = st.sidebar.radio("Map values:", ("Prediction", "Low end of the band", "High end of the band"))
+if map_band != "Prediction":
+    county_bands = prediction_cache.get(map_key, "county_bands")
+    if county_bands is None:
+        # All the counties in one batched pass over the trees
+        with st.spinner("Computing the uncertainty bands... Please wait."), trace.span("county_bands"):
+            county_bands = np.expm1(score_map_counties(lambda counties, varying: predict_bands(
+                load_tree_arrays(disaster_type), build_county_matrix(encoder, map_scenario, counties, varying)
+            )))
+        prediction_cache.put(map_key, "county_bands", county_bands)
+    county_damage = county_bands[0 if map_band.startswith("Low") else 1]
+
+# Lightweight maps only send the damage of each county, the simplified shapes are a static file
+map_mode = st.sidebar.radio("Map rendering:", ("Lightweight", "Full detail"))
+
+rows = geometry_store.rows(cmap["GEOID"])
+known = rows >= 0
+# The map is centred on the counties that have a value (the ones around the footprint)
+centered = known & np.isfinite(county_damage)
+if not centered.any():
+    centered = known
 
 # Interactive map with spinner
+legend_name = "Predicted Damage" if map_band == "Prediction" else f"Predicted Damage ({map_band.lower()})"
 with st.spinner("Loading the map..."):
-    # Create interactive map
-    m = folium.Map(location=[cmap_gdf.geometry.centroid.y.mean(), cmap_gdf.geometry.centroid.x.mean()], zoom_start=7)
-
-    # Choropleth counties layer
-    folium.Choropleth(
-        geo_data=cmap_gdf.__geo_interface__,
-        name="Predicted Damage",
-        data=cmap,
-        columns=["NAME", "predicted_damage"],
-        key_on="feature.properties.NAME",
-        fill_color="Spectral",
-        fill_opacity=0.8,
-        line_opacity=0.1,
-        legend_name="Predicted Damage",
-        reset=True
-    ).add_to(m)
-
-    # Add tooltips for interactivity
-    folium.GeoJson(
-        cmap_gdf.__geo_interface__,
-        style_function=lambda feature: {
-            'fillColor': 'transparent',  # No fill colour
-            'color': 'black',
-            'weight': 0.1,
-            'fillOpacity': 0
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=["NAME", "predicted_damage"],
-            aliases=["County:", "Predicted Damage:"],
-            localize=True
-        )
-    ).add_to(m)
-
-    # Render the map with folium_static
-    folium_static(m, width=1200, height=1000)
+    if map_mode == "Lightweight":
+        with trace.span("map_lightweight"):
+            map_html = render_damage_map(cmap["GEOID"], county_damage, geometry_store.center(rows[centered]), legend_name=legend_name)
+    else:
+        map_html = prediction_cache.get(map_key, f"map_html {map_band}")
+    if map_html is None:
+        # Full folium map, taking the county shapes from the geometry store instead of parsing the WKT of cmap
+        with trace.span("map_full"):
+            map_html = render_folium_map(
+                cmap["NAME"], county_damage, known, geometry_store.geometries()[rows[known]], geometry_store.center(rows[centered]),
+                legend_name=legend_name
+            )
+        prediction_cache.put(map_key, f"map_html {map_band}", map_html)
+
+    # Render the map
+    with trace.span("map_display"):
+        components.html(map_html, width=1200, height=1010)
 
 st.success("Map successfully loaded!")
 
+# Cache usage, to size the prediction cache
+cache_stats = prediction_cache.stats()
+st.sidebar.caption(
+    f"Prediction cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+    f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['entries']} scenarios, "
+    f"{cache_stats['bytes'] / 1024 ** 2:.1f} MB"
+)
 
-
+finish_rerun(map_mode=map_mode)
@@ -0,0 +1,209 @@
+"""
+Prebuilt bundle of everything the app loads at start-up, read in one go.
+
+Without the bundle a new worker reads the geometry store, one scaler pickle (which imports
+sklearn) and one model pickle per disaster type. The bundle holds the geometry store (the shapes
+stay WKB until a map needs them), the feature encoders and the pickled models in a single joblib
+file. The models are only unpickled when the model registry requests them, so the registry
+keeps its bound and its eviction (see model_registry.py).
+It is ignored, and the files are read one by one as before, when any of its sources is newer
+than the bundle. The county table and the county lookup are not in the bundle: they are
+memory-mapped from their compact Arrow files (see county_tables.py), so that all the workers
+share one copy.
+
+warm_up loads the artifacts, runs the models once and renders a map once, so that the first
+user does not pay for the imports and the lazy initialisation of the libraries; it is the
+readiness hook of a worker. It only runs as many models as the registry keeps (the first ones of
+the app's list by default, or the ones given with --models), since the others would be evicted
+again. The serve command warms the process up and then starts Streamlit in the same process, so
+the health endpoint only answers once the worker is hot.
+
+Example:
+    python artifacts.py build
+    python artifacts.py warm-up --ready-file /tmp/app-ready --models Tornado Flood
+    python artifacts.py serve --server.port 8501
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+from functools import lru_cache, partial
+
+import joblib
+import numpy as np
+
+from county_tables import build_county_tables, load_county_lookup, load_county_table
+from features import FEATURE_FILES, SCALER_FILES, FeatureEncoder, load_encoder
+from geometry_store import GEOJSON_FILE, STORE_FILE, load_geometry_store
+from model_registry import MODEL_FILES, registry
+
+BUNDLE_FILE = "app_bundle.joblib"
+APP_FILE = "app_final.py"
+
+# Encoders of the loaded bundle, by disaster type
+_encoders = {}
+
+
+def source_files():
+    """The files the bundle is built from (the ones that exist)."""
+    files = [STORE_FILE, GEOJSON_FILE, *FEATURE_FILES.values(), *SCALER_FILES.values(), *MODEL_FILES.values()]
+    return [path for path in files if os.path.exists(path)]
+
+
+def is_fresh(bundle_file=BUNDLE_FILE):
+    """True when the bundle exists and is newer than all its sources."""
+    if not os.path.exists(bundle_file):
+        return False
+    built = os.path.getmtime(bundle_file)
+    return all(os.path.getmtime(path) <= built for path in source_files())
+
+
+def build_bundle(bundle_file=BUNDLE_FILE, with_models=True):
+    """
+    Writes the bundle, and the compact county tables next to it.
+
+    Parameters:
+    - with_models: bool, include the models; they make the bundle larger and keep the pickled
+      bytes of every model in memory, but a new worker does not read any model file anymore
+    """
+    build_county_tables()
+    bundle = {
+        "geometry_store": load_geometry_store(),
+        "encoders": {
+            disaster_type: FeatureEncoder.from_schema(features_file, SCALER_FILES[disaster_type])
+            for disaster_type, features_file in FEATURE_FILES.items() if os.path.exists(features_file)
+        },
+        # Pickled, so that a worker only unpickles the models it uses
+        "models": {
+            disaster_type: pickle.dumps(joblib.load(model_file), protocol=pickle.HIGHEST_PROTOCOL)
+            for disaster_type, model_file in MODEL_FILES.items() if with_models and os.path.exists(model_file)
+        },
+    }
+    joblib.dump(bundle, bundle_file + ".tmp")
+    os.replace(bundle_file + ".tmp", bundle_file)
+    return bundle_file
+
+
+def load_artifacts(bundle_file=BUNDLE_FILE):
+    """
+    Returns the county table, the county lookup and the geometry store. Loaded once per process:
+    the county tables are memory-mapped, the geometry store comes from the bundle when it is
+    fresh and from its own files otherwise.
+
+    The encoders of the bundle are used by get_encoder, and its models become the sources of
+    the model registry, which unpickles them when they are first requested.
+
+    Returns:
+    A dict with "cmap", "county_lookup", "geometry_store" and "bundled" (bool).
+    """
+    return _load_artifacts(bundle_file)
+
+
+@lru_cache(maxsize=None)
+def _load_artifacts(bundle_file):
+    county_tables = {"cmap": load_county_table(), "county_lookup": load_county_lookup()}
+    if not is_fresh(bundle_file):
+        return dict(county_tables, geometry_store=load_geometry_store(), bundled=False)
+    bundle = joblib.load(bundle_file)
+    _encoders.update(bundle.pop("encoders"))
+    for disaster_type, pickled in bundle.pop("models").items():
+        if not isinstance(pickled, bytes):
+            # Bundle built before the models were stored pickled
+            pickled = pickle.dumps(pickled, protocol=pickle.HIGHEST_PROTOCOL)
+        registry.add_source(disaster_type, partial(pickle.loads, pickled))
+    return dict(bundle, **county_tables, bundled=True)
+
+
+def get_encoder(disaster_type):
+    """The feature encoder of a disaster type, from the bundle when it was loaded."""
+    encoder = _encoders.get(disaster_type)
+    return encoder if encoder is not None else load_encoder(disaster_type)
+
+
+def warm_up(bundle_file=BUNDLE_FILE, ready_file=None, disaster_types=None):
+    """
+    Loads the artifacts and runs every stage of a rerun once: the models score every county
+    and a map is rendered, which imports the libraries and initialises their lazy state.
+
+    Parameters:
+    - ready_file: path written (with the timings, as JSON) when the worker is ready
+    - disaster_types: the models to warm up, at most registry.max_models of them; by default the
+      first ones of MODEL_FILES that have a model file
+
+    Returns:
+    A dict with the seconds spent on each step.
+    """
+    from county_map import export_county_shapes, render_damage_map
+    from scoring import predict_counties
+
+    timings = {}
+    start = time.perf_counter()
+    artifacts = load_artifacts(bundle_file)
+    timings["artifacts"] = time.perf_counter() - start
+
+    step = time.perf_counter()
+    store = artifacts["geometry_store"]
+    export_county_shapes(store)
+    store.tree()  # spatial index of the event footprints
+    timings["county_shapes"] = time.perf_counter() - step
+
+    if disaster_types is None:
+        disaster_types = [disaster_type for disaster_type, model_file in MODEL_FILES.items() if os.path.exists(model_file)]
+    # Loading more models than the registry keeps would only evict the first ones again
+    disaster_types = list(disaster_types)[:registry.max_models]
+
+    cmap = artifacts["cmap"]
+    damage = np.zeros(len(cmap))  # the map is rendered even when there is no model file
+    for disaster_type in disaster_types:
+        step = time.perf_counter()
+        encoder = get_encoder(disaster_type)
+        damage = predict_counties(registry.get(disaster_type), encoder, {"Year": 2022, "DURATION_HOURS": 1}, cmap)
+        timings[disaster_type] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    rows = store.rows(cmap["GEOID"])
+    render_damage_map(cmap["GEOID"], damage, store.center(rows[rows >= 0]))
+    timings["map"] = time.perf_counter() - step
+    timings["total"] = time.perf_counter() - start
+    timings["bundled"] = artifacts["bundled"]
+
+    if ready_file:
+        with open(ready_file, "w") as f:
+            json.dump(timings, f, indent=2)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the start-up bundle of the app and warm workers up.")
+    parser.add_argument("command", choices=("build", "warm-up", "serve"),
+                        help="build the bundle, warm this process up, or warm up and serve the app")
+    parser.add_argument("--bundle", default=BUNDLE_FILE)
+    parser.add_argument("--no-models", action="store_true", help="build the bundle without the models")
+    parser.add_argument("--ready-file", help="file written once the worker is warm")
+    parser.add_argument("--models", nargs="+", metavar="DISASTER_TYPE", choices=list(MODEL_FILES),
+                        help="models to warm up (default: the first ones the model registry keeps)")
+    args, streamlit_args = parser.parse_known_args(argv)
+
+    if args.command == "build":
+        print(f"Bundle saved as {build_bundle(args.bundle, not args.no_models)}")
+        return 0
+    if not is_fresh(args.bundle):
+        print(f"{args.bundle} is missing or older than its sources, the files are read one by one", file=sys.stderr)
+    timings = warm_up(args.bundle, args.ready_file, args.models)
+    print(json.dumps(timings), file=sys.stderr)
+    if args.command == "serve":
+        # Streamlit runs the app in this process, so it finds the artifacts and the models already loaded
+        from streamlit.web import cli
+
+        return cli.main(["run", APP_FILE, *streamlit_args], prog_name="streamlit")
+    return 0
+
+
+if __name__ == "__main__":
+    # Run as the imported module: the app imports "artifacts", and would not see the state warmed
+    # up in this __main__ module (the cached artifacts, the encoders, the spatial index)
+    import artifacts
+
+    sys.exit(artifacts.main())
@@ -0,0 +1,187 @@
+"""
+Backtest of the damage models over every recorded event of the training tables.
+
+The per-type tables (flood, tornado, wildfire, ...) are the ones written by ingest.py
+(<cache-dir>/tables/<table>.parquet) or the CSV files of the notebook (flood.csv, tornado.csv,
+...). They are streamed in chunks and the chunks are scored across a process pool with one
+batched model call each, like batch_predict.py. Every chunk is reduced to running sums of the
+errors by disaster type, state and year, so only those sums and a few chunks are ever in memory,
+whatever the size of the tables.
+
+The errors are reported in log space (the target of the models, log1p of the damage) and in
+dollars: MAE, RMSE and R2 (log) by disaster type, by state, by year and by state and year. The
+rows are the ones a model can score (see retrain.usable_rows); they include the rows the models
+were trained on, so the backtest measures the fit over the whole history, not the error on new
+events.
+
+Example:
+    python backtest.py --tables-dir ingest_cache/tables --output-dir backtest --workers 4
+    python backtest.py Tornado Flood --tables-dir notebook_tables --chunksize 50000 --flat-models
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import ingest
+from batch_predict import init_worker, read_chunks
+from features import load_encoder
+from model_registry import MODEL_FILES, get_model
+from retrain import TABLE_TYPES, usable_rows
+
+# Running sums of every (disaster type, state, year) group
+SUMS = ["rows", "abs_log", "sq_log", "abs_dollars", "sq_dollars", "log_damage", "sq_log_damage"]
+GROUPS = ["disaster_type", "State", "Year"]
+
+# Reports written by the backtest: file name -> grouping columns
+REPORTS = {
+    "by_type": ["disaster_type"],
+    "by_state": ["disaster_type", "State"],
+    "by_year": ["disaster_type", "Year"],
+    "by_state_year": ["disaster_type", "State", "Year"],
+}
+
+
+def table_path(name, tables_dir):
+    """The Parquet table of ingest.py or the CSV file of the notebook, whichever exists."""
+    for extension in (".parquet", ".csv"):
+        path = os.path.join(tables_dir, name + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def score_chunk(disaster_type, chunk):
+    """
+    Scores the events of one chunk of a table and sums their errors by state and year.
+
+    Returns:
+    (DataFrame of the SUMS indexed by GROUPS, number of rows the model cannot score)
+    """
+    encoder = load_encoder(disaster_type)
+    rows = usable_rows(chunk, encoder)
+    skipped = len(chunk) - len(rows)
+    if rows.empty:
+        return pd.DataFrame(columns=SUMS, index=pd.MultiIndex.from_arrays([[], [], []], names=GROUPS)), skipped
+
+    X = encoder.encode_frame(rows.drop(columns=["DAMAGE_PROPERTY", "GEOID"]))
+    predicted_log = get_model(disaster_type).predict(X).astype(np.float64)
+    damage = rows["DAMAGE_PROPERTY"].to_numpy(dtype=np.float64)
+    log_damage = np.log1p(damage)
+    log_errors = predicted_log - log_damage
+    dollar_errors = np.expm1(predicted_log) - damage
+
+    errors = pd.DataFrame({
+        "disaster_type": disaster_type,
+        "State": rows["State"].astype(str).to_numpy(),
+        "Year": rows["Year"].to_numpy(dtype=np.int64),
+        "rows": 1,
+        "abs_log": np.abs(log_errors),
+        "sq_log": log_errors ** 2,
+        "abs_dollars": np.abs(dollar_errors),
+        "sq_dollars": dollar_errors ** 2,
+        "log_damage": log_damage,
+        "sq_log_damage": log_damage ** 2,
+    })
+    return errors.groupby(GROUPS, sort=False).sum(), skipped
+
+
+def metrics(sums):
+    """Turns running sums (grouped or not) into the error metrics."""
+    rows = sums["rows"]
+    total_log = sums["sq_log_damage"] - sums["log_damage"] ** 2 / rows
+    return pd.DataFrame({
+        "events": rows.astype(np.int64),
+        "mae_log": sums["abs_log"] / rows,
+        "rmse_log": np.sqrt(sums["sq_log"] / rows),
+        "r2_log": 1 - sums["sq_log"] / total_log.where(total_log > 0),
+        "mae_dollars": sums["abs_dollars"] / rows,
+        "rmse_dollars": np.sqrt(sums["sq_dollars"] / rows),
+    })
+
+
+def reports(totals):
+    """Returns {report name: DataFrame of the metrics} from the sums of every group."""
+    return {name: metrics(totals.groupby(level=columns).sum()) for name, columns in REPORTS.items()}
+
+
+def run(disaster_types=None, tables_dir=os.path.join(ingest.CACHE_DIR, "tables"), chunksize=50000, workers=None,
+        flat_models=False):
+    """
+    Streams and scores every table across a process pool.
+
+    At most two chunks per worker are in flight, and each one comes back as the sums of its
+    groups, which are added to the running totals.
+
+    Returns:
+    (DataFrame of the SUMS of every (disaster type, state, year), {disaster type: skipped rows})
+    """
+    workers = workers or os.cpu_count()
+    totals = None
+    skipped = {}
+    pending = deque()
+    n_rows = 0
+    start = time.perf_counter()
+
+    def add_oldest():
+        nonlocal totals, n_rows
+        disaster_type, size, future = pending.popleft()
+        sums, chunk_skipped = future.result()
+        totals = sums if totals is None else totals.add(sums, fill_value=0)
+        skipped[disaster_type] = skipped.get(disaster_type, 0) + chunk_skipped
+        n_rows += size
+        elapsed = time.perf_counter() - start
+        print(f"{n_rows} events scored, {n_rows / elapsed:,.0f} events/sec", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(flat_models,)) as pool:
+        for name, disaster_type in TABLE_TYPES.items():
+            if disaster_types and disaster_type not in disaster_types:
+                continue
+            path = table_path(name, tables_dir)
+            if path is None or not os.path.exists(MODEL_FILES[disaster_type]):
+                print(f"{disaster_type}: {'no table in ' + tables_dir if path is None else 'no model'}, skipped",
+                      file=sys.stderr)
+                continue
+            for chunk in read_chunks(path, chunksize):
+                pending.append((disaster_type, len(chunk), pool.submit(score_chunk, disaster_type, chunk)))
+                if len(pending) >= 2 * workers:
+                    add_oldest()
+        while pending:
+            add_oldest()
+
+    if totals is None:
+        raise ValueError(f"No table to backtest in {tables_dir}")
+    return totals.sort_index(), skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest the damage models on every event of the training tables.")
+    parser.add_argument("disaster_types", nargs="*", help="disaster types to backtest (default: all)")
+    parser.add_argument("--tables-dir", default=os.path.join(ingest.CACHE_DIR, "tables"),
+                        help="directory of the <table>.parquet files of ingest.py or the <table>.csv files of the notebook")
+    parser.add_argument("--output-dir", default="backtest", help="directory of the report CSV files")
+    parser.add_argument("--chunksize", type=int, default=50000, help="events read and scored at a time")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--flat-models", action="store_true", help="score the groups of a few rows with the .npz models exported by flat_trees.py")
+    args = parser.parse_args(argv)
+    unknown = [disaster_type for disaster_type in args.disaster_types if disaster_type not in MODEL_FILES]
+    if unknown:
+        parser.error(f"unknown disaster types: {', '.join(unknown)} (choose from {', '.join(MODEL_FILES)})")
+
+    totals, skipped = run(args.disaster_types, args.tables_dir, args.chunksize, args.workers, args.flat_models)
+    os.makedirs(args.output_dir, exist_ok=True)
+    results = reports(totals)
+    for name, report in results.items():
+        report.to_csv(os.path.join(args.output_dir, f"{name}.csv"))
+    summary = results["by_type"].assign(skipped=pd.Series(skipped))
+    print(summary.round(4).to_string())
+    print(f"Reports saved in {args.output_dir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
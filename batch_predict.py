@@ -0,0 +1,232 @@
+"""
+Scores a file of disaster scenarios without the Streamlit app.
+
+Each row of the input (JSONL, CSV or Parquet) is one scenario with a "disaster_type" column, the
+"State", the "Year" and the inputs of the model by feature name (e.g. "DURATION_HOURS",
+"TOR_F_SCALE"). When "GDP_per_capita" or "Density" are missing they are taken from
+merged_data_county.csv with the "County" column, like in the app.
+
+A scenario that cannot be scored (unknown disaster type or missing model, state not covered by
+the model, missing Year, no county data) gets a NaN prediction and the reason in the "reason"
+column, and the other rows are scored as usual.
+
+Example:
+    python batch_predict.py scenarios.jsonl predictions.csv --chunksize 20000 --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from county_lookup import COUNTY_FILE
+from county_tables import load_county_lookup
+from features import load_encoder
+from model_registry import MODEL_FILES, get_model, registry
+
+
+def read_chunks(path, chunksize):
+    """Yields the scenarios of the input file as DataFrames of at most chunksize rows."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".json"):
+        yield from pd.read_json(path, lines=True, chunksize=chunksize)
+    elif extension == ".csv":
+        yield from pd.read_csv(path, chunksize=chunksize)
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported scenario file: {path}")
+
+
+class ResultWriter:
+    """Appends the scored chunks to a CSV, JSONL or Parquet file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.extension = os.path.splitext(path)[1].lower()
+        self._parquet = None
+        self._first = True
+
+    def write(self, chunk):
+        if self.extension == ".parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        elif self.extension in (".jsonl", ".json"):
+            with open(self.path, "w" if self._first else "a") as f:
+                chunk.to_json(f, orient="records", lines=True)
+        else:
+            chunk.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+# Reasons why a scenario cannot be scored
+INVALID_YEAR = "missing or invalid Year"
+NO_COUNTY_DATA = "no GDP per capita and Density for this County, State and Year"
+
+
+@lru_cache(maxsize=None)
+def get_county_lookup(county_file=COUNTY_FILE):
+    """
+    The county lookup of a county file, loaded once per process: the compact county values are
+    memory-mapped, so the worker processes share the pages of the file.
+    """
+    return load_county_lookup(county_file)
+
+
+def prepare_scenarios(records, county_file=COUNTY_FILE):
+    """
+    Turns input records into scenarios for the feature encoder.
+
+    Empty values are dropped, the missing GDP per capita and Density are taken from the county
+    dataset, and the state is written like the State_ columns of the models.
+
+    Returns:
+    (list of scenarios, list of the reason why each scenario cannot be scored, None when it can)
+    """
+    scenarios, reasons = [], []
+    for record in records:
+        scenario = {feature: value for feature, value in record.items() if not pd.isna(value)}
+        scenario["State"] = str(scenario.get("State", ""))
+        reason = None
+        try:
+            scenario["Year"] = int(scenario["Year"])
+        except (KeyError, TypeError, ValueError):
+            reason = INVALID_YEAR
+        if reason is None and ("GDP_per_capita" not in scenario or "Density" not in scenario):
+            # The encoder would leave them at 0, which gives a confident but wrong prediction
+            values = get_county_lookup(county_file).lookup(scenario["State"], str(scenario.get("County")), scenario["Year"])
+            if values is None:
+                reason = NO_COUNTY_DATA
+            else:
+                scenario.setdefault("GDP_per_capita", values[0])
+                scenario.setdefault("Density", values[1])
+        scenario["State"] = scenario["State"].title()
+        scenarios.append(scenario)
+        reasons.append(reason)
+    return scenarios, reasons
+
+
+def score_chunk(chunk, county_file=COUNTY_FILE):
+    """
+    Scores one chunk of scenarios, with one model call per disaster type.
+
+    Returns:
+    A DataFrame with the row number, the disaster type, the predicted damage in dollars and the
+    reason why a scenario was not scored (its predicted damage is then NaN): unknown disaster
+    type or missing model, state that the model does not cover, invalid Year or no county data.
+    """
+    predictions = np.full(len(chunk), np.nan)
+    reasons = np.full(len(chunk), None, dtype=object)
+    for disaster_type, group in chunk.groupby("disaster_type", sort=False, dropna=False):
+        positions = chunk.index.get_indexer(group.index)
+        try:
+            encoder = load_encoder(disaster_type)
+            model = get_model(disaster_type)
+        except (KeyError, OSError):
+            reason = "unknown disaster type" if disaster_type not in MODEL_FILES else "no model file"
+            reasons[positions] = reason
+            print(f"{disaster_type}: {reason}, {len(group)} rows not scored", file=sys.stderr)
+            continue
+
+        scenarios, group_reasons = prepare_scenarios(group.to_dict("records"), county_file)
+        for i, scenario in enumerate(scenarios):
+            if group_reasons[i] is None and not encoder.covers("State", scenario["State"]):
+                group_reasons[i] = f"no recorded {disaster_type} in this State"
+        scored = np.array([reason is None for reason in group_reasons])
+        reasons[positions] = group_reasons
+        if not scored.any():
+            continue
+        X = encoder.encode_batch([scenario for scenario, ok in zip(scenarios, scored) if ok])
+        predictions[positions[scored]] = np.expm1(model.predict(X))
+
+    return pd.DataFrame({
+        "row": chunk.index.to_numpy(),
+        "disaster_type": chunk["disaster_type"].to_numpy(),
+        "predicted_damage": predictions,
+        "reason": pd.array(reasons, dtype="string"),
+    })
+
+
+def init_worker(flat_models=False):
+    """
+    Prepares the model registry of a worker process: it keeps every model, since a chunk can
+    mix all the disaster types and the default bound would reload models on every chunk, and
+    optionally serves the flat .npz models exported by flat_trees.py. These only score the groups
+    of at most FLAT_MAX_ROWS rows; the larger groups are still scored by the original models.
+    """
+    registry.max_models = len(MODEL_FILES)
+    registry.prefer_flat = flat_models
+
+
+def run(input_file, output_file, chunksize=10000, workers=None, county_file=COUNTY_FILE, flat_models=False):
+    """
+    Scores the input file chunk by chunk across a process pool and streams the results.
+
+    At most two chunks per worker are in memory at the same time, and the results are written
+    in the order of the input file.
+    """
+    workers = workers or os.cpu_count()
+    writer = ResultWriter(output_file)
+    pending = deque()
+    n_rows = 0
+    start = time.perf_counter()
+
+    def write_oldest():
+        nonlocal n_rows
+        result = pending.popleft().result()
+        writer.write(result)
+        n_rows += len(result)
+        elapsed = time.perf_counter() - start
+        print(f"{n_rows} rows scored, {n_rows / elapsed:,.0f} rows/sec", file=sys.stderr)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(flat_models,)) as pool:
+            row_offset = 0
+            for chunk in read_chunks(input_file, chunksize):
+                chunk.index = pd.RangeIndex(row_offset, row_offset + len(chunk))
+                row_offset += len(chunk)
+                pending.append(pool.submit(score_chunk, chunk, county_file))
+                if len(pending) >= 2 * workers:
+                    write_oldest()
+            while pending:
+                write_oldest()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {n_rows} rows in {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):,.0f} rows/sec)", file=sys.stderr)
+    return n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a file of disaster scenarios with the damage models.")
+    parser.add_argument("input", help="scenarios as .jsonl, .csv or .parquet")
+    parser.add_argument("output", help="predictions as .csv, .jsonl or .parquet")
+    parser.add_argument("--chunksize", type=int, default=10000, help="rows read and scored at a time")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--county-file", default=COUNTY_FILE, help="GDP per capita and Density per county and year")
+    parser.add_argument("--flat-models", action="store_true",
+                        help="score the groups of a few rows with the .npz models exported by flat_trees.py")
+    args = parser.parse_args(argv)
+    run(args.input, args.output, args.chunksize, args.workers, args.county_file, args.flat_models)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+End-to-end benchmark of the prediction pipeline of app_final.py, without a browser or a network.
+
+Every stage of a page run is timed on its own, with the same code as the app:
+- common stages: county tables load (memory-mapped), county lookups and geometry preparation,
+- per disaster type: model load, feature build, single predict, all-county predict and map
+  serialization (lightweight and full folium maps).
+
+The scenarios come from a generator that draws realistic inputs for each disaster type, using
+the feature columns and the state one-hot lists of its model. Each stage is run several times
+and reports its median and fastest time, and the peak of the memory it allocated (tracemalloc).
+
+The results are written to a JSON file and, with --baseline, compared with the results of an
+earlier run: a stage fails when it is slower (or allocates more memory) than the baseline by
+more than the tolerance, or when it is missing from the results, and the exit code is 1, so the
+benchmark can gate a deploy. The timings depend on the machine, so no baseline is shipped: it is
+saved (--save-baseline) on the machine that runs the gate, and the comparison fails when the
+baseline was recorded on another machine (CPU count, platform, Python version) or with other
+benchmark settings.
+
+Example:
+    python benchmark.py --output bench.json --save-baseline gate_baseline.json
+    python benchmark.py --output bench.json --baseline gate_baseline.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from county_map import render_damage_map, render_folium_map
+from county_tables import load_county_lookup, load_county_table
+from features import load_encoder
+from geometry_store import load_geometry_store
+from model_registry import MODEL_FILES, ModelRegistry
+from scoring import predict_counties
+
+# Fields of the meta of the results that must be the same in the baseline: the machine, and the
+# settings that change the timings
+COMPARABLE_META = ("python", "platform", "cpus", "scenarios", "repeats", "flat_models")
+
+# Keys of the results that are not groups of stages
+NOT_STAGES = ("meta", "max_rss_mb", "regressions")
+
+# Magnitude of the events of each disaster type that records one (wind speed in knots, fire size)
+MAGNITUDE_RANGES = {"High Wind": (35.0, 80.0), "Wildfire": (0.0, 100.0)}
+
+
+def generate_scenarios(disaster_type, encoder, county_lookup, n, seed=0):
+    """
+    Random scenarios of a disaster type, like the ones entered in the sidebar of the app.
+
+    The states are drawn among the ones the model has a column for (title-cased like the
+    State_ columns, as in the app), the counties and years among the ones with county data (the
+    app stops on the others), and the numeric inputs from skewed distributions (most events
+    have no injuries, last a few hours and are close to the county).
+
+    Returns:
+    A list of (scenario, state, county name) triples, with the state as in the county dataset;
+    the GDP per capita and Density are looked up by the county_lookup stage.
+    """
+    rng = np.random.default_rng(seed)
+    states = [state for state in county_lookup.state_options
+              if encoder.covers("State", state.title()) and county_lookup.counties(state)]
+    if not states:
+        raise ValueError(f"No state of the county dataset is covered by the {disaster_type} model")
+    scenarios = []
+    for _ in range(100 * n):
+        if len(scenarios) == n:
+            break
+        state = states[rng.integers(len(states))]
+        counties = county_lookup.counties(state)
+        county = counties[rng.integers(len(counties))]
+        year = int(rng.integers(2007, 2023))
+        if county_lookup.lookup(state, county, year) is None:
+            continue
+        scenario = {
+            "Year": year,
+            "State": state.title(),
+            "INJURIES_DIRECT": int(rng.poisson(0.1)),
+            "INJURIES_INDIRECT": int(rng.poisson(0.02)),
+            "DEATHS_DIRECT": int(rng.poisson(0.01)),
+            "DEATHS_INDIRECT": int(rng.poisson(0.005)),
+            "DURATION_HOURS": int(np.clip(np.round(rng.lognormal(np.log(3), 1.0)), 1, 100)),
+        }
+        if disaster_type in ("Tornado", "Flood", "Lightning"):
+            scenario["Distance_km"] = round(float(rng.exponential(2.0)), 1)
+        if disaster_type == "Tornado":
+            scenario["TOR_LENGTH"] = round(float(rng.exponential(5.0)), 1)
+            scenario["TOR_WIDTH"] = round(float(rng.exponential(0.1)), 2)
+        for feature in ("TOR_F_SCALE", "FLOOD_CAUSE"):
+            categories = encoder.categories(feature)
+            if categories:
+                scenario[feature] = categories[rng.integers(len(categories))]
+        if disaster_type in MAGNITUDE_RANGES:
+            scenario["MAGNITUDE"] = round(float(rng.uniform(*MAGNITUDE_RANGES[disaster_type])), 1)
+        scenarios.append((scenario, state, county))
+    if len(scenarios) < n:
+        raise ValueError(f"Not enough counties with GDP per capita and Density for the {disaster_type} scenarios")
+    return scenarios
+
+
+def measure(stage, repeats, memory=True):
+    """
+    Runs a stage repeats times and returns its timings (the first run includes the one-off costs,
+    such as imports); one more run measures the peak of the memory allocated by the stage.
+
+    Parameters:
+    - stage: function without arguments
+
+    Returns:
+    (dict with the timings, the result of the last run)
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = stage()
+        times.append(time.perf_counter() - start)
+    timings = {"seconds": float(np.median(times)), "min_seconds": float(np.min(times)),
+               "first_seconds": times[0], "repeats": repeats}
+    if memory:
+        tracemalloc.start()
+        result = stage()
+        timings["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return timings, result
+
+
+def run_benchmark(disaster_types=None, n_scenarios=200, repeats=5, memory=True, flat_models=False, seed=0):
+    """
+    Runs every stage and returns the results as a JSON-serializable dict.
+
+    The per-scenario stages (county lookup, feature build, single predict) run over all the
+    generated scenarios, and also report the time per scenario.
+    """
+    disaster_types = disaster_types or [name for name, path in MODEL_FILES.items() if os.path.exists(path)]
+    results = {"common": {}}
+
+    def load_tables():
+        return load_county_table(), load_county_lookup()
+
+    results["common"]["county_tables"], (cmap, county_lookup) = measure(load_tables, repeats, memory)
+
+    def prepare_geometry():
+        store = load_geometry_store()
+        rows = store.rows(cmap["GEOID"])
+        known = rows >= 0
+        return store.geometries()[rows[known]], known, store.center(rows[known])
+
+    results["common"]["geometry_prep"], (geometries, known, center) = measure(prepare_geometry, repeats, memory)
+
+    for i, disaster_type in enumerate(disaster_types):
+        encoder = load_encoder(disaster_type)
+        scenarios = generate_scenarios(disaster_type, encoder, county_lookup, n_scenarios, seed + i)
+        stages = results[disaster_type] = {}
+
+        def load_model():
+            return ModelRegistry(prefer_flat=flat_models)._load(MODEL_FILES[disaster_type])
+
+        stages["model_load"], model = measure(load_model, repeats, memory)
+
+        def look_up():
+            return [county_lookup.lookup(state, county, scenario["Year"]) for scenario, state, county in scenarios]
+
+        stages["county_lookup"], values = measure(look_up, repeats, memory)
+        for (scenario, _, _), (gdp_per_capita, density) in zip(scenarios, values):
+            scenario["GDP_per_capita"], scenario["Density"] = gdp_per_capita, density
+
+        def build_features():
+            return [encoder.encode(scenario)[np.newaxis, :] for scenario, _, _ in scenarios]
+
+        stages["feature_build"], inputs = measure(build_features, repeats, memory)
+
+        def predict_single():
+            return [model.predict(input_data) for input_data in inputs]
+
+        stages["single_predict"], _ = measure(predict_single, repeats, memory)
+        for stage in ("county_lookup", "feature_build", "single_predict"):
+            stages[stage]["seconds_per_scenario"] = stages[stage]["seconds"] / n_scenarios
+
+        scenario = scenarios[0][0]
+        stages["county_predict"], county_damage = measure(
+            lambda: predict_counties(model, encoder, scenario, cmap), repeats, memory
+        )
+        stages["map_lightweight"], _ = measure(lambda: render_damage_map(cmap["GEOID"], county_damage, center),
+                                               repeats, memory)
+        stages["map_full"], _ = measure(lambda: render_folium_map(cmap["NAME"], county_damage, known, geometries, center),
+                                        repeats, memory)
+
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results["meta"] = {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scenarios": n_scenarios,
+        "repeats": repeats,
+        "flat_models": flat_models,
+    }
+    return results
+
+
+def meta_mismatches(results, baseline):
+    """Returns the fields of COMPARABLE_META that differ between the results and the baseline, as strings."""
+    actual, expected = results["meta"], baseline.get("meta", {})
+    return [f"{name} is {actual.get(name)!r}, the baseline was recorded with {expected.get(name)!r}"
+            for name in COMPARABLE_META if actual.get(name) != expected.get(name)]
+
+
+def compare(results, baseline, tolerance=0.25, memory_tolerance=0.25, min_seconds=0.002):
+    """
+    Compares results with a baseline.
+
+    The comparison fails straight away when the baseline was recorded on another machine or
+    with other settings (see meta_mismatches), since its timings say nothing about this run.
+    A stage regresses when its median time is more than tolerance (a fraction) above the
+    baseline and more than min_seconds slower, so that the noise of the fastest stages does not
+    fail the comparison; its memory peak likewise with memory_tolerance. A stage of the baseline
+    that is missing from the results (removed, or crashed) is a regression too.
+
+    Returns:
+    A list of the regressions, as strings.
+    """
+    mismatches = meta_mismatches(results, baseline)
+    if mismatches:
+        return [f"baseline not comparable: {mismatch}" for mismatch in mismatches]
+    regressions = []
+    for group, stages in baseline.items():
+        if group in NOT_STAGES:
+            continue
+        for stage, expected in stages.items():
+            actual = results.get(group, {}).get(stage)
+            if actual is None:
+                regressions.append(f"{group} {stage}: missing from the results")
+                continue
+            slower = actual["seconds"] - expected["seconds"]
+            if actual["seconds"] > expected["seconds"] * (1 + tolerance) and slower > min_seconds:
+                regressions.append(f"{group} {stage}: {actual['seconds']:.4f}s, baseline {expected['seconds']:.4f}s")
+            if "peak_mb" in actual and "peak_mb" in expected and \
+                    actual["peak_mb"] > expected["peak_mb"] * (1 + memory_tolerance) and actual["peak_mb"] - expected["peak_mb"] > 1:
+                regressions.append(f"{group} {stage}: {actual['peak_mb']:.1f} MB, baseline {expected['peak_mb']:.1f} MB")
+    if "max_rss_mb" in baseline and results["max_rss_mb"] > baseline["max_rss_mb"] * (1 + memory_tolerance):
+        regressions.append(f"max RSS: {results['max_rss_mb']:.0f} MB, baseline {baseline['max_rss_mb']:.0f} MB")
+    return regressions
+
+
+def print_results(results, baseline=None):
+    for group, stages in results.items():
+        if group in NOT_STAGES:
+            continue
+        for stage, timings in stages.items():
+            line = f"{group:<20} {stage:<16} {timings['seconds'] * 1000:10.2f} ms"
+            if "peak_mb" in timings:
+                line += f" {timings['peak_mb']:8.1f} MB"
+            expected = (baseline or {}).get(group, {}).get(stage)
+            if expected:
+                line += f"   ({timings['seconds'] / max(expected['seconds'], 1e-9) - 1:+.0%} vs baseline)"
+            print(line, file=sys.stderr)
+    print(f"max RSS: {results['max_rss_mb']:.0f} MB", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the prediction pipeline.")
+    parser.add_argument("disaster_types", nargs="*", help="disaster types to benchmark (default: every model found)")
+    parser.add_argument("--scenarios", type=int, default=200, help="generated scenarios per disaster type")
+    parser.add_argument("--repeats", type=int, default=5, help="runs of every stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flat-models", action="store_true", help="load the exported flat models (see flat_trees.py)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--output", default="-", help="JSON results file, '-' for stdout")
+    parser.add_argument("--baseline", help="JSON results saved on this machine to compare with")
+    parser.add_argument("--save-baseline", help="also write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, as a fraction of the baseline")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="allowed memory growth, as a fraction")
+    parser.add_argument("--min-seconds", type=float, default=0.002, help="slowdowns below this are never regressions")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.disaster_types, args.scenarios, args.repeats, not args.no_memory,
+                            args.flat_models, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results["regressions"] = compare(results, baseline, args.tolerance, args.memory_tolerance, args.min_seconds)
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(text)
+
+    print_results(results, baseline)
+    for regression in results.get("regressions", []):
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+COUNTY_FILE = "merged_data_county.csv"
+
+# Values stored for every county and year, in this order
+VALUES = ["GDP_per_capita", "Density"]
+
+
+class CountyLookup:
+    """
+    GDP per capita and Density of every county, indexed by GEOID and Year.
+
+    The values are kept in a dense GEOID x Year array, and the (State, County) names are
+    hashed to their GEOID, so a lookup does not scan the dataset. The sorted list of states
+    and the sorted counties of each state are computed once for the dropdowns.
+    """
+
+    def __init__(self, df):
+        df = df.dropna(subset=["GEOID", "Year", "State", "County"])
+        geoid = df["GEOID"].astype("int64").to_numpy()
+        year = df["Year"].astype("int64").to_numpy()
+
+        self.geoids, geoid_row = np.unique(geoid, return_inverse=True)
+        self.first_year = int(year.min())
+        self.last_year = int(year.max())
+        # float32, like the columns of the compact county tables (see county_tables.py) and the model inputs
+        self.values = np.full((len(self.geoids), self.last_year - self.first_year + 1, len(VALUES)), np.nan, dtype=np.float32)
+        self.values[geoid_row, year - self.first_year] = df[VALUES].to_numpy(dtype=np.float32)
+
+        self._row = pd.Series(np.arange(len(self.geoids)), index=self.geoids)
+        # The names may be categorical (compact county tables), they are used as plain strings
+        names = df.drop_duplicates(subset=["State", "County"])[["GEOID", "State", "County"]].astype({"State": str, "County": str})
+        self.geoid_by_name = dict(zip(zip(names["State"], names["County"]), names["GEOID"].astype("int64")))
+
+        self.state_by_geoid = pd.Series(names["State"].to_numpy(), index=names["GEOID"].astype("int64").to_numpy())
+        self.state_by_geoid = self.state_by_geoid[~self.state_by_geoid.index.duplicated()]
+
+        self.state_options = sorted(names["State"].unique())
+        self.counties_by_state = {
+            state: sorted(counties["County"].unique()) for state, counties in names.groupby("State")
+        }
+
+    @classmethod
+    def from_csv(cls, county_file=COUNTY_FILE):
+        return cls(pd.read_csv(county_file, usecols=["GEOID", "Year", "State", "County"] + VALUES))
+
+    def counties(self, state):
+        return self.counties_by_state.get(state, [])
+
+    def lookup(self, state, county, year):
+        """Returns (GDP per capita, Density) of a county in a year, or None when there is no data."""
+        geoid = self.geoid_by_name.get((state, county))
+        if geoid is None or not self.first_year <= year <= self.last_year:
+            return None
+        gdp_per_capita, density = self.values[self._row[geoid], year - self.first_year]
+        if np.isnan(gdp_per_capita) or np.isnan(density):
+            return None
+        return float(gdp_per_capita), float(density)
+
+    def states(self, geoids):
+        """Returns the state of every GEOID, NaN when the GEOID is unknown."""
+        return self.state_by_geoid.reindex(np.asarray(geoids, dtype=np.int64)).to_numpy()
+
+    def year_values(self, year, geoids=None):
+        """
+        Returns the GDP per capita and Density of many counties in one year.
+
+        Parameters:
+        - year: int
+        - geoids: array of GEOIDs, or None for all the counties of the lookup
+
+        Returns:
+        Two float arrays (GDP per capita, Density), NaN where there is no data.
+        """
+        if geoids is None:
+            rows = np.arange(len(self.geoids))
+        else:
+            rows = self._row.reindex(np.asarray(geoids, dtype=np.int64)).fillna(-1).to_numpy(dtype=np.int64)
+        values = np.full((len(rows), len(VALUES)), np.nan)
+        if self.first_year <= year <= self.last_year:
+            known = rows >= 0
+            values[known] = self.values[rows[known], year - self.first_year]
+        return values[:, 0], values[:, 1]
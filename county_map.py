@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import threading
+from string import Template
+
+import numpy as np
+
+from geometry_store import _geometry_column
+
+# Simplified county shapes, served once by Streamlit's static file serving (see .streamlit/config.toml)
+SHAPES_FILE = os.path.join("static", "county_shapes.geojson")
+SHAPES_URL = "app/static/county_shapes.geojson"
+
+# Same colour scale as the folium choropleth ("Spectral", 6 classes)
+SPECTRAL = ["#d53e4f", "#fc8d59", "#fee08b", "#e6f598", "#99d594", "#3288bd"]
+
+LEAFLET_CSS = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"
+LEAFLET_JS = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"
+
+
+def shapes_fingerprint(geometry_store, tolerance, decimals):
+    """SHA-256 of the shapes, names and export options, to tell when the exported file is stale."""
+    digest = hashlib.sha256(f"{tolerance} {decimals}".encode())
+    digest.update(np.ascontiguousarray(geometry_store.geoid, dtype=np.int64).tobytes())
+    for name, wkb in zip(geometry_store.names, geometry_store.table[_geometry_column(tolerance)]):
+        digest.update(str(name).encode())
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def export_county_shapes(geometry_store, tolerance=0.01, shapes_file=SHAPES_FILE, decimals=4):
+    """
+    Writes the simplified county shapes as a static GeoJSON file, when they changed.
+
+    Only the GEOID and the NAME are kept as properties: the damage values are sent separately on
+    every rerun and joined to the shapes in the browser. The fingerprint of the shapes is kept in
+    <shapes_file>.sha256, so the file is written again after the geometry store is rebuilt; both
+    files are written atomically, so a session never fetches half a file.
+    """
+    fingerprint = shapes_fingerprint(geometry_store, tolerance, decimals)
+    fingerprint_file = shapes_file + ".sha256"
+    if os.path.exists(shapes_file) and os.path.exists(fingerprint_file):
+        with open(fingerprint_file) as f:
+            if f.read().strip() == fingerprint:
+                return shapes_file
+    import shapely
+
+    os.makedirs(os.path.dirname(shapes_file), exist_ok=True)
+
+    geometries = shapely.transform(geometry_store.geometries(tolerance), lambda coords: np.round(coords, decimals))
+    features = [
+        '{"type":"Feature","properties":%s,"geometry":%s}' % (json.dumps({"GEOID": int(geoid), "NAME": name}), geometry)
+        for geoid, name, geometry in zip(geometry_store.geoid, geometry_store.names, shapely.to_geojson(geometries))
+    ]
+    # Unique temporary names: several worker processes may export at the same time
+    tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(shapes_file + tmp_suffix, "w") as f:
+        f.write('{"type":"FeatureCollection","features":[%s]}' % ",".join(features))
+    os.replace(shapes_file + tmp_suffix, shapes_file)
+    with open(fingerprint_file + tmp_suffix, "w") as f:
+        f.write(fingerprint)
+    os.replace(fingerprint_file + tmp_suffix, fingerprint_file)
+    return shapes_file
+
+
+def color_breaks(values, n_colors=len(SPECTRAL)):
+    """Equal-width class breaks between the smallest and the largest value, like folium.Choropleth."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return [0.0] * (n_colors + 1)
+    return np.linspace(values.min(), values.max(), n_colors + 1).tolist()
+
+
+_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+<link rel="stylesheet" href="$leaflet_css"/>
+<script src="$leaflet_js"></script>
+<style>
+  html, body, #map {height: 100%; margin: 0;}
+  .legend {background: white; padding: 6px 8px; font: 12px sans-serif; line-height: 18px;}
+  .legend i {width: 18px; height: 18px; float: left; margin-right: 6px; opacity: 0.8;}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+  const damage = $damage;
+  const breaks = $breaks;
+  const colors = $colors;
+  const labels = $labels;  // null for a damage map, the names of the classes for a category map
+  const map = L.map("map").setView($center, $zoom);
+  L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+    attribution: "&copy; OpenStreetMap contributors"
+  }).addTo(map);
+
+  function color(value) {
+    if (value === undefined || value === null) return "transparent";
+    if (labels) return colors[value];
+    for (let i = 1; i < breaks.length - 1; i++) {
+      if (value < breaks[i]) return colors[i - 1];
+    }
+    return colors[colors.length - 1];
+  }
+
+  fetch(new URL("$shapes_url", document.baseURI)).then(r => r.json()).then(shapes => {
+    L.geoJSON(shapes, {
+      style: f => ({fillColor: color(damage[f.properties.GEOID]), fillOpacity: 0.8, color: "black", weight: 0.1}),
+      onEachFeature: (f, layer) => {
+        const value = damage[f.properties.GEOID];
+        if (value === undefined) return;
+        const text = labels ? labels[value] : value.toLocaleString(undefined, {maximumFractionDigits: 2});
+        layer.bindTooltip("<b>County:</b> " + f.properties.NAME + "<br><b>$legend_name:</b> " + text);
+      }
+    }).addTo(map);
+  });
+
+  const legend = L.control({position: "topright"});
+  legend.onAdd = () => {
+    const div = L.DomUtil.create("div", "legend");
+    div.innerHTML = "<b>$legend_name</b><br>" + colors.map((c, i) =>
+      '<i style="background:' + c + '"></i>' + (labels ? labels[i] :
+      breaks[i].toLocaleString(undefined, {maximumFractionDigits: 0}) +
+      " &ndash; " + breaks[i + 1].toLocaleString(undefined, {maximumFractionDigits: 0}))).join("<br>");
+    return div;
+  };
+  legend.addTo(map);
+</script>
+</body>
+</html>
+""")
+
+
+def render_damage_map(geoids, damage, center, zoom_start=7, legend_name="Predicted Damage", shapes_url=SHAPES_URL):
+    """
+    Returns the HTML of a choropleth that only embeds the damage of each GEOID and the colour breaks.
+
+    The county shapes are fetched by the browser from the static GeoJSON file (and cached by it),
+    and the styling and tooltips are done in the browser.
+    """
+    damage = np.asarray(damage, dtype=np.float64)
+    finite = np.isfinite(damage)
+    values = {int(geoid): round(float(value), 2) for geoid, value in zip(np.asarray(geoids)[finite], damage[finite])}
+    return _TEMPLATE.substitute(
+        leaflet_css=LEAFLET_CSS,
+        leaflet_js=LEAFLET_JS,
+        damage=json.dumps(values, separators=(",", ":")),
+        breaks=json.dumps(color_breaks(damage)),
+        colors=json.dumps(SPECTRAL),
+        center=json.dumps([float(c) for c in center]),
+        zoom=int(zoom_start),
+        shapes_url=shapes_url,
+        legend_name=legend_name,
+        labels="null",
+    )
+
+
+def render_category_map(geoids, codes, labels, colors, center, zoom_start=7, legend_name="Category", shapes_url=SHAPES_URL):
+    """
+    Returns the HTML of a lightweight map that colours every county by a class, e.g. its dominant hazard.
+
+    Parameters:
+    - codes: index of the class of every GEOID in labels, -1 for no class (left blank)
+    - labels, colors: name and colour of every class
+    """
+    values = {int(geoid): int(code) for geoid, code in zip(geoids, codes) if code >= 0}
+    return _TEMPLATE.substitute(
+        leaflet_css=LEAFLET_CSS,
+        leaflet_js=LEAFLET_JS,
+        damage=json.dumps(values, separators=(",", ":")),
+        breaks="[]",
+        colors=json.dumps(list(colors)),
+        center=json.dumps([float(c) for c in center]),
+        zoom=int(zoom_start),
+        shapes_url=shapes_url,
+        legend_name=legend_name,
+        labels=json.dumps(list(labels)),
+    )
+
+
+def render_folium_map(names, damage, known, geometries, center, zoom_start=7, legend_name="Predicted Damage"):
+    """
+    Returns the HTML of the full folium choropleth, with the shapes and the tooltips of every county.
+
+    Parameters:
+    - names: NAME of every county
+    - damage: predicted damage of every county
+    - known: boolean array, the counties that have a shape
+    - geometries: shapely geometries of the known counties
+    - center: (lat, lon) of the map
+    """
+    import folium
+    import geopandas as gpd
+    import pandas as pd
+
+    # Frame of this map only: the shared county table is never modified
+    cmap = pd.DataFrame({"NAME": np.asarray(names, dtype=object), "predicted_damage": damage})
+    cmap_gdf = gpd.GeoDataFrame(cmap.loc[known], geometry=geometries, crs="EPSG:4326")
+
+    # Create interactive map
+    m = folium.Map(location=center, zoom_start=zoom_start)
+
+    # Choropleth counties layer
+    folium.Choropleth(
+        geo_data=cmap_gdf.__geo_interface__,
+        name="Predicted Damage",
+        data=cmap,
+        columns=["NAME", "predicted_damage"],
+        key_on="feature.properties.NAME",
+        fill_color="Spectral",
+        fill_opacity=0.8,
+        line_opacity=0.1,
+        legend_name=legend_name,
+        reset=True
+    ).add_to(m)
+
+    # Add tooltips for interactivity
+    folium.GeoJson(
+        cmap_gdf.__geo_interface__,
+        style_function=lambda feature: {
+            'fillColor': 'transparent',  # No fill colour
+            'color': 'black',
+            'weight': 0.1,
+            'fillOpacity': 0
+        },
+        tooltip=folium.GeoJsonTooltip(
+            fields=["NAME", "predicted_damage"],
+            aliases=["County:", "Predicted Damage:"],
+            localize=True
+        )
+    ).add_to(m)
+
+    # Serialize the map once (like folium_static does)
+    return folium.Figure().add_child(m).render()
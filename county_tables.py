@@ -0,0 +1,135 @@
+"""
+Compact, memory-mapped copies of the county tables (cmap.csv and merged_data_county.csv).
+
+The CSV files are converted once into Arrow IPC (Feather) files with small column types: int32
+GEOIDs, int16 years, float32 values and dictionary-encoded (categorical) names. The files are not
+compressed, so they are memory-mapped instead of read: the numeric columns are used in place and
+all the sessions and worker processes of a node share the same pages of the OS cache.
+
+The tables are read-only: the predictions of a request are kept in their own arrays and are
+never written into the shared county table.
+
+Example:
+    python county_tables.py
+"""
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from county_lookup import COUNTY_FILE, CountyLookup
+
+CMAP_FILE = "cmap.csv"
+COUNTY_TABLE_FILE = "county_table.arrow"
+COUNTY_VALUES_FILE = "county_values.arrow"
+
+# Column types of the county table (one row per county, from cmap.csv; the WKT shapes are left
+# out, the maps take them from the geometry store)
+COUNTY_TABLE_TYPES = {
+    "GEOID": pa.int32(),
+    "NAME": pa.dictionary(pa.int16(), pa.string()),
+    "STATEFP": pa.int8(),
+    "GDP_per_capita": pa.float32(),
+    "Density": pa.float32(),
+}
+
+# Column types of the county values (one row per county and year, from merged_data_county.csv)
+COUNTY_VALUES_TYPES = {
+    "GEOID": pa.int32(),
+    "Year": pa.int16(),
+    "State": pa.dictionary(pa.int8(), pa.string()),
+    "County": pa.dictionary(pa.int16(), pa.string()),
+    "GDP_per_capita": pa.float32(),
+    "Density": pa.float32(),
+}
+
+
+def compact_table(df, types):
+    """Converts the columns of a DataFrame to the given Arrow types."""
+    columns = {}
+    for name, arrow_type in types.items():
+        if pa.types.is_dictionary(arrow_type):
+            columns[name] = pa.array(df[name].astype(str).to_numpy()).dictionary_encode().cast(arrow_type)
+        else:
+            columns[name] = pa.array(df[name].to_numpy(dtype=arrow_type.to_pandas_dtype()), type=arrow_type)
+    return pa.table(columns)
+
+
+def write_table(table, path):
+    # Uncompressed, so that the file can be memory-mapped; written atomically for the other workers,
+    # through a temporary file of its own since several processes may rebuild the table at once
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    feather.write_feather(table, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_csv(path, types):
+    df = pd.read_csv(path, usecols=list(types))
+    # Rows without a key cannot be looked up, like in CountyLookup
+    return df.dropna(subset=[name for name in ("GEOID", "Year", "State", "County") if name in types])
+
+
+def build_county_tables(cmap_file=CMAP_FILE, county_file=COUNTY_FILE, table_file=COUNTY_TABLE_FILE,
+                        values_file=COUNTY_VALUES_FILE):
+    """Converts cmap.csv and merged_data_county.csv into their compact Arrow files."""
+    write_table(compact_table(_read_csv(cmap_file, COUNTY_TABLE_TYPES), COUNTY_TABLE_TYPES), table_file)
+    write_table(compact_table(_read_csv(county_file, COUNTY_VALUES_TYPES), COUNTY_VALUES_TYPES), values_file)
+    return table_file, values_file
+
+
+def _is_fresh(target, source):
+    return os.path.exists(target) and (not os.path.exists(source) or os.path.getmtime(target) >= os.path.getmtime(source))
+
+
+def compact_file(source_file, default_source, default_target):
+    """
+    The Arrow file of a CSV file: the default Arrow file for the default CSV file, and
+    <CSV name>.arrow next to any other CSV file, so that each source has its own copy.
+    """
+    if os.path.abspath(source_file) == os.path.abspath(default_source):
+        return default_target
+    return os.path.splitext(source_file)[0] + ".arrow"
+
+
+def read_table(path):
+    """Memory-maps an Arrow file and returns it as a DataFrame (categorical names, float32 values)."""
+    # split_blocks keeps every column in its own block, so that the numeric columns are not
+    # copied into consolidated pandas blocks
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def _load(source_file, target_file, types):
+    # Converted again when the Arrow file is missing or older than the CSV file
+    if not _is_fresh(target_file, source_file):
+        write_table(compact_table(_read_csv(source_file, types), types), target_file)
+    return read_table(target_file)
+
+
+def load_county_table(cmap_file=CMAP_FILE, table_file=None):
+    """
+    Returns the county table (GEOID, NAME, STATEFP, GDP_per_capita, Density of every county).
+
+    Parameters:
+    - table_file: compact copy of cmap_file, by default the one of compact_file
+    """
+    table_file = table_file or compact_file(cmap_file, CMAP_FILE, COUNTY_TABLE_FILE)
+    return _load(cmap_file, table_file, COUNTY_TABLE_TYPES)
+
+
+def load_county_lookup(county_file=COUNTY_FILE, values_file=None):
+    """
+    Returns the CountyLookup of the compact county values.
+
+    Parameters:
+    - values_file: compact copy of county_file, by default the one of compact_file
+    """
+    values_file = values_file or compact_file(county_file, COUNTY_FILE, COUNTY_VALUES_FILE)
+    return CountyLookup(_load(county_file, values_file, COUNTY_VALUES_TYPES))
+
+
+if __name__ == "__main__":
+    for path in build_county_tables():
+        print(f"{path}: {os.path.getsize(path) / 1024 ** 2:.1f} MB")
@@ -0,0 +1,136 @@
+import os
+from functools import lru_cache
+
+import joblib
+import numpy as np
+
+# Training column order written by the notebook for each disaster type
+FEATURE_FILES = {
+    "Tornado": "tornado_features.txt",
+    "Flood": "flood_features.txt",
+    "Lightning": "lightning_features.txt",
+    "High Wind": "high_wind_features.txt",
+    "Wildfire": "wildfire_features.txt",
+    "Tropical Depression": "tropical_depression_features.txt",
+}
+
+# StandardScaler fitted on the training data of each disaster type
+SCALER_FILES = {
+    "Tornado": "tornado_scaler.pkl",
+    "Flood": "flood_scaler.pkl",
+    "Lightning": "lightning_scaler.pkl",
+    "High Wind": "high_wind_scaler.pkl",
+    "Wildfire": "wildfire_scaler.pkl",
+    "Tropical Depression": "tropical_depression_scaler.pkl",
+}
+
+# Columns that were one-hot encoded by pd.get_dummies in the notebook
+CATEGORICAL = ("State", "TOR_F_SCALE", "FLOOD_CAUSE")
+
+
+class FeatureEncoder:
+    """
+    Turns a scenario into the feature vector of a model, in training column order.
+
+    A scenario is a dict with the numeric features by name (e.g. "Year", "DURATION_HOURS") and
+    the categorical features by value (e.g. "State": "Texas", "TOR_F_SCALE": "EF2"). Features that
+    the model was not trained on are ignored and the missing ones are left at 0, so the output
+    is always aligned with the columns of the model.
+
+    Parameters:
+    - columns: list, training column order
+    - mean, scale: arrays of the fitted StandardScaler, or None when the model was trained on raw values
+    """
+
+    def __init__(self, columns, mean=None, scale=None):
+        self.columns = list(columns)
+        self.index = {column: i for i, column in enumerate(self.columns)}
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def from_schema(cls, features_file, scaler_file=None):
+        with open(features_file) as f:
+            columns = [line.rstrip("\n") for line in f if line.strip()]
+        if scaler_file is not None and os.path.exists(scaler_file):
+            scaler = joblib.load(scaler_file)
+            return cls(columns, scaler.mean_, scaler.scale_)
+        return cls(columns)
+
+    @property
+    def n_features(self):
+        return len(self.columns)
+
+    def categories(self, feature):
+        """Returns the values of a categorical feature that have their own column."""
+        prefix = f"{feature}_"
+        return [column[len(prefix):] for column in self.columns if column.startswith(prefix)]
+
+    def covers(self, feature, value):
+        return f"{feature}_{value}" in self.index
+
+    def encode(self, scenario, out=None):
+        """Encodes one scenario into a float32 vector (written into out when given)."""
+        if out is None:
+            out = np.empty(self.n_features, dtype=np.float32)
+        self._fill(scenario, out)
+        return self._scale(out)
+
+    def encode_rows(self, scenario, n_rows, varying=None, out=None):
+        """
+        Encodes a scenario for n_rows rows at once, e.g. one row per county.
+
+        The scenario values are broadcast to every row, while the features in varying
+        (dict, feature name -> array of n_rows values) take a different value in each row.
+        """
+        if out is None:
+            out = np.empty((n_rows, self.n_features), dtype=np.float32)
+        self._fill(scenario, out)
+        for feature, values in (varying or {}).items():
+            if feature in self.index:
+                out[:, self.index[feature]] = values
+        return self._scale(out)
+
+    def encode_batch(self, scenarios, out=None):
+        """Encodes a list of scenarios into a float32 matrix with one row per scenario."""
+        if out is None:
+            out = np.empty((len(scenarios), self.n_features), dtype=np.float32)
+        for i, scenario in enumerate(scenarios):
+            self._fill(scenario, out[i])
+        return self._scale(out)
+
+    def encode_frame(self, df, out=None):
+        """
+        Encodes the rows of a DataFrame with one column per feature, like the training tables
+        (categorical features by value, e.g. a "State" column).
+        """
+        if out is None:
+            out = np.empty((len(df), self.n_features), dtype=np.float32)
+        out[...] = 0
+        for feature in df.columns:
+            if feature in CATEGORICAL:
+                values = df[feature].astype(str).to_numpy()
+                for category in self.categories(feature):
+                    out[:, self.index[f"{feature}_{category}"]] = values == category
+            elif feature in self.index:
+                out[:, self.index[feature]] = df[feature].to_numpy(dtype=np.float32)
+        return self._scale(out)
+
+    def _fill(self, scenario, out):
+        out[...] = 0
+        for feature, value in scenario.items():
+            column = f"{feature}_{value}" if feature in CATEGORICAL else feature
+            if column in self.index:
+                out[..., self.index[column]] = 1 if feature in CATEGORICAL else value
+
+    def _scale(self, out):
+        if self.mean is not None:
+            out -= self.mean
+            out /= self.scale
+        return out
+
+
+@lru_cache(maxsize=None)
+def load_encoder(disaster_type):
+    """Returns the feature encoder of a disaster type, compiled once per process."""
+    return FeatureEncoder.from_schema(FEATURE_FILES[disaster_type], SCALER_FILES[disaster_type])
@@ -0,0 +1,386 @@
+"""
+Flat array version of the tree ensembles, which loads fast and predicts small requests without
+xgboost or sklearn.
+
+Every tree of a model is written into the same set of NumPy arrays (split feature, threshold,
+child, default direction of missing values and leaf value of every node), stored in one
+<stem>_model.npz file next to the pickle. A whole batch is evaluated on all the trees at once,
+one tree level per step.
+
+The flat arrays load several times faster and take less memory than the pickles, and predict a
+single row two to four times faster than the native predict of xgboost, but the native predict
+is faster from about 10 rows on: FlatModel (the model served by the registry with prefer_flat,
+see model_registry.py) evaluates the requests of up to FLAT_MAX_ROWS rows on the flat arrays
+and hands the larger batches to the original model. The prediction service (service.py), which
+scores single scenarios, serves the flat models by default; batch scoring gains nothing from them.
+
+The export checks that the flat model predicts the same values as the pickled model before
+writing the .npz file.
+
+Example:
+    python flat_trees.py                   # exports every model found
+    python flat_trees.py "High Wind" --check-rows 50000
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+
+from model_registry import MODEL_FILES
+
+# Rows evaluated at a time, so that the (rows x trees) node indices stay in the CPU cache
+CHUNK_ROWS = 256
+
+# Largest batch evaluated on the flat arrays; the native predict is faster from about 10 rows on
+FLAT_MAX_ROWS = 8
+
+ARRAYS = ("feature", "threshold", "child", "default_left", "value", "roots")
+
+
+def flat_file(model_file):
+    """tornado_model.pkl -> tornado_model.npz"""
+    return os.path.splitext(model_file)[0] + ".npz"
+
+
+class FlatEnsemble:
+    """
+    Tree ensemble stored as flat arrays.
+
+    All the nodes of all the trees are concatenated, and the two children of a split are stored
+    next to each other: a row goes to child[node] when its value is lower than the threshold and
+    to child[node] + 1 otherwise. Missing values go to the left child when default_left is set.
+    The leaves have child -1 and their value in value.
+
+    Parameters:
+    - feature, threshold, child, default_left, value: one entry per node
+    - roots: node index of the root of every tree
+    - base_score: float, added to the sum of the trees
+    - average: bool, True to average the trees (random forest) instead of summing them (boosting)
+    """
+
+    def __init__(self, feature, threshold, child, default_left, value, roots, base_score=0.0, average=False):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.child = np.asarray(child, dtype=np.int32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.base_score = float(base_score)
+        self.average = bool(average)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    @classmethod
+    def from_xgboost(cls, model):
+        """Converts an XGBRegressor (gbtree booster, numerical splits) into flat arrays."""
+        learner = json.loads(model.get_booster().save_raw("json"))["learner"]
+        booster = learner["gradient_booster"]
+        if booster["name"] != "gbtree":
+            raise ValueError(f"Unsupported booster: {booster['name']}")
+        base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+
+        trees = []
+        for tree in booster["model"]["trees"]:
+            # xgboost goes left when value < threshold, both in float32; for the leaves,
+            # split_conditions holds the leaf value
+            conditions = np.array(tree["split_conditions"], dtype=np.float32)
+            trees.append({
+                "left": np.array(tree["left_children"]),
+                "right": np.array(tree["right_children"]),
+                "feature": np.array(tree["split_indices"]),
+                "threshold": conditions,
+                "default_left": np.array(tree["default_left"], dtype=bool),
+                "value": conditions.astype(np.float64),
+            })
+        return cls._concatenate(trees, base_score=base_score, average=False)
+
+    @classmethod
+    def from_random_forest(cls, model):
+        """Converts a fitted sklearn RandomForestRegressor into flat arrays."""
+        trees = []
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            missing_left = getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8))
+            trees.append({
+                "left": tree.children_left,
+                "right": tree.children_right,
+                "feature": tree.feature,
+                "threshold": _strict_float32(tree.threshold),
+                "default_left": missing_left.astype(bool),
+                "value": tree.value[:, 0, 0],
+            })
+        return cls._concatenate(trees, base_score=0.0, average=True)
+
+    @classmethod
+    def from_model(cls, model):
+        if hasattr(model, "get_booster"):
+            return cls.from_xgboost(model)
+        if hasattr(model, "estimators_"):
+            return cls.from_random_forest(model)
+        raise TypeError(f"Unsupported model: {type(model).__name__}")
+
+    @classmethod
+    def _concatenate(cls, trees, base_score, average):
+        """
+        Numbers the nodes of all the trees breadth first: the roots first, then the two children
+        of every split next to each other.
+        """
+        nodes = [(t, 0) for t in range(len(trees))]  # (tree, node in the tree), in the new order
+        new_id = [{0: t} for t in range(len(trees))]
+        queue = deque(nodes)
+        while queue:
+            t, node = queue.popleft()
+            left = trees[t]["left"][node]
+            if left == -1:
+                continue
+            right = trees[t]["right"][node]
+            new_id[t][left], new_id[t][right] = len(nodes), len(nodes) + 1
+            nodes += [(t, left), (t, right)]
+            queue += [(t, left), (t, right)]
+
+        n_nodes = len(nodes)
+        feature = np.zeros(n_nodes, dtype=np.int32)
+        threshold = np.full(n_nodes, np.nan, dtype=np.float32)
+        child = np.full(n_nodes, -1, dtype=np.int32)
+        default_left = np.zeros(n_nodes, dtype=bool)
+        value = np.zeros(n_nodes)
+        for i, (t, node) in enumerate(nodes):
+            tree = trees[t]
+            left = tree["left"][node]
+            if left == -1:
+                value[i] = tree["value"][node]
+            else:
+                feature[i] = tree["feature"][node]
+                threshold[i] = tree["threshold"][node]
+                child[i] = new_id[t][left]
+                default_left[i] = tree["default_left"][node]
+        return cls(feature, threshold, child, default_left, value, np.arange(len(trees)), base_score, average)
+
+    def save(self, path):
+        # Through a file object, so that np.savez does not add .npz to a temporary file name
+        with open(path, "wb") as f:
+            np.savez(f, **{name: getattr(self, name) for name in ARRAYS},
+                     meta=np.array([self.base_score, float(self.average)]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            base_score, average = data["meta"]
+            return cls(*(data[name] for name in ARRAYS), base_score=base_score, average=average > 0)
+
+    def tree_outputs(self, X):
+        """
+        Returns the leaf value reached by every row in every tree.
+
+        Parameters:
+        - X: 2D array in training column order
+
+        Returns:
+        A float64 array of shape (rows, trees).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        outputs = np.empty((len(X), self.n_trees))
+        for start in range(0, len(X), CHUNK_ROWS):
+            outputs[start:start + CHUNK_ROWS] = self._leaf_values(X[start:start + CHUNK_ROWS])
+        return outputs
+
+    def _leaf_values(self, X):
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        # One (row, tree) pair per entry; the pairs that reached a leaf are dropped after each level
+        node = np.tile(self.roots, n_rows)
+        position = np.arange(len(node))
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.int32) * n_features, self.n_trees)
+        outputs = np.empty(len(node))
+        while len(node):
+            child = self.child.take(node)
+            done = child < 0
+            if done.any():
+                outputs[position[done]] = self.value.take(node[done])
+                active = ~done
+                node, child, position, row_offset = node[active], child[active], position[active], row_offset[active]
+            x = flat_X.take(row_offset + self.feature.take(node))
+            go_right = x >= self.threshold.take(node)
+            missing = np.isnan(x)
+            if missing.any():
+                go_right |= missing & ~self.default_left.take(node)
+            node = child + go_right
+        return outputs.reshape(n_rows, self.n_trees)
+
+    def aggregate(self, outputs):
+        """Combines per-tree outputs (rows x trees, or any subset of the trees) into predictions."""
+        if self.average:
+            return outputs.mean(axis=1) + self.base_score
+        return outputs.sum(axis=1) + self.base_score
+
+    def predict(self, X):
+        return self.aggregate(self.tree_outputs(X)).astype(np.float32)
+
+
+class FlatModel:
+    """
+    Flat model that hands the batches to the original model.
+
+    The pickle is only loaded (memory-mapped) the first time a batch of more than FLAT_MAX_ROWS
+    rows is predicted, so a process that only scores single scenarios never loads it. The
+    per-tree outputs (see scoring.predict_bands) always come from the flat arrays.
+
+    Parameters:
+    - flat: FlatEnsemble
+    - model_file: str, pickle of the original model
+    - max_rows: int, largest batch evaluated on the flat arrays
+    """
+
+    def __init__(self, flat, model_file, max_rows=FLAT_MAX_ROWS):
+        self.flat = flat
+        self.model_file = model_file
+        self.max_rows = max_rows
+        self._native = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, model_file, max_rows=FLAT_MAX_ROWS):
+        return cls(FlatEnsemble.load(flat_file(model_file)), model_file, max_rows)
+
+    def native(self):
+        """The original model, loaded on first use."""
+        with self._lock:
+            if self._native is None:
+                import joblib
+
+                self._native = joblib.load(self.model_file, mmap_mode="r")
+            return self._native
+
+    def predict(self, X):
+        if len(X) <= self.max_rows:
+            return self.flat.predict(X)
+        return self.native().predict(X)
+
+    @property
+    def n_trees(self):
+        return self.flat.n_trees
+
+    def tree_outputs(self, X):
+        return self.flat.tree_outputs(X)
+
+    def aggregate(self, outputs):
+        return self.flat.aggregate(outputs)
+
+
+def _strict_float32(threshold):
+    """
+    float32 thresholds t such that, for any float32 value x, x < t exactly when x <= threshold
+    (sklearn compares the float32 inputs with float64 thresholds).
+    """
+    rounded = threshold.astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return np.nextafter(rounded, np.float32(np.inf))
+
+
+@lru_cache(maxsize=None)
+def load_flat_model(disaster_type):
+    """Loads the exported flat model of a disaster type, or returns None when it was not exported."""
+    path = flat_file(MODEL_FILES[disaster_type])
+    if not os.path.exists(path):
+        return None
+    return FlatEnsemble.load(path)
+
+
+def parity_inputs(flat, n_features, n_rows=10000, seed=0):
+    """
+    Random rows whose values sit on, just below and just above the thresholds of the model.
+
+    Values exactly on a threshold check that both models send ties the same way, and a few
+    missing values check the default directions.
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features)).astype(np.float32)
+    splits = flat.child >= 0
+    for feature in range(n_features):
+        thresholds = flat.threshold[splits & (flat.feature == feature)]
+        if len(thresholds) == 0:
+            continue
+        picked = rng.choice(thresholds, n_rows)
+        shift = rng.integers(-1, 2, n_rows)
+        X[:, feature] = np.where(shift < 0, np.nextafter(picked, np.float32(-np.inf)),
+                                 np.where(shift > 0, np.nextafter(picked, np.float32(np.inf)), picked))
+    X[rng.random(X.shape) < 0.01] = np.nan
+    return X
+
+
+def model_inputs(model, X):
+    """X, with the missing values replaced by 0 for the models that do not accept them."""
+    if hasattr(model, "estimators_") and not hasattr(model.estimators_[0].tree_, "missing_go_to_left"):
+        return np.nan_to_num(X)  # forests of sklearn < 1.4
+    return X
+
+
+def check_parity(model, flat, X, rtol=1e-5, atol=1e-4):
+    """Raises an AssertionError when the flat model does not predict like the original model."""
+    X = model_inputs(model, X)
+    expected = np.asarray(model.predict(X), dtype=np.float64)
+    actual = flat.predict(X).astype(np.float64)
+    np.testing.assert_allclose(actual, expected, rtol=rtol, atol=atol)
+
+
+def export_flat(model, path, check_rows=10000):
+    """
+    Converts a fitted model to flat arrays and writes them to path, after checking that they
+    predict like the model (AssertionError otherwise, and nothing is written).
+
+    Returns:
+    The FlatEnsemble.
+    """
+    flat = FlatEnsemble.from_model(model)
+    X = parity_inputs(flat, model.n_features_in_, check_rows)
+    check_parity(model, flat, X)
+    flat.save(path)
+    return flat
+
+
+def export_model(model_file, check_rows=10000):
+    """
+    Exports one pickled model to its .npz file, after checking the predictions of the flat model.
+
+    Returns:
+    The path of the .npz file.
+    """
+    import joblib
+
+    path = flat_file(model_file)
+    flat = export_flat(joblib.load(model_file), path, check_rows)
+    print(f"{model_file} -> {path}: {flat.n_trees} trees, {len(flat.child)} nodes, {flat.nbytes / 1024 ** 2:.1f} MB")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the pickled models to flat .npz tree arrays.")
+    parser.add_argument("disaster_types", nargs="*", help="models to export (default: every model found)")
+    parser.add_argument("--check-rows", type=int, default=10000, help="rows compared with the original model")
+    args = parser.parse_args(argv)
+
+    disaster_types = args.disaster_types or [name for name, path in MODEL_FILES.items() if os.path.exists(path)]
+    for disaster_type in disaster_types:
+        try:
+            export_model(MODEL_FILES[disaster_type], args.check_rows)
+        except AssertionError as e:
+            print(f"{disaster_type}: the flat model does not match the original model, not exported\n{e}",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
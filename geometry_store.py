@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+GEOJSON_FILE = "counties.geojson"
+STORE_FILE = "county_geometry.parquet"
+
+# Simplification tolerances (in degrees) stored next to the full resolution geometry
+TOLERANCES = (0.005, 0.01, 0.05)
+
+
+def _geometry_column(tolerance):
+    return "geometry" if tolerance is None else f"geometry_{tolerance}"
+
+
+def build_geometry_store(geojson_file=GEOJSON_FILE, store_file=STORE_FILE, tolerances=TOLERANCES):
+    """
+    Parses the county shapes once and saves them as WKB in a Parquet file keyed by GEOID.
+
+    Next to the full resolution geometry the file holds a simplified copy for each tolerance,
+    the centroid and the bounding box of every county.
+    """
+    import geopandas as gpd
+    import shapely
+
+    counties = gpd.read_file(geojson_file)
+    geometry = counties.geometry.values
+    centroids = shapely.centroid(geometry)
+    bounds = shapely.bounds(geometry)
+
+    table = pd.DataFrame({
+        "GEOID": counties["GEOID"].astype(int),
+        "NAME": counties["NAME"],
+        "STATEFP": counties["STATEFP"].astype(int),
+        "centroid_x": shapely.get_x(centroids),
+        "centroid_y": shapely.get_y(centroids),
+        "minx": bounds[:, 0],
+        "miny": bounds[:, 1],
+        "maxx": bounds[:, 2],
+        "maxy": bounds[:, 3],
+        "geometry": shapely.to_wkb(geometry),
+    })
+    for tolerance in tolerances:
+        simplified = shapely.simplify(geometry, tolerance, preserve_topology=True)
+        table[_geometry_column(tolerance)] = shapely.to_wkb(simplified)
+
+    table.to_parquet(store_file, index=False)
+    return store_file
+
+
+class GeometryStore:
+    """
+    County shapes, centroids and bounding boxes loaded from the Parquet store.
+
+    The WKB geometries are only decoded the first time a resolution is requested and are then
+    kept, like the spatial index, so the store should be loaded once per process and reused by
+    every rerun.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.geoid = table["GEOID"].to_numpy()
+        self.names = table["NAME"].to_numpy()
+        self.centroids = table[["centroid_x", "centroid_y"]].to_numpy()
+        self.bounds = table[["minx", "miny", "maxx", "maxy"]].to_numpy()
+        self.tolerances = tuple(
+            float(column.split("_", 1)[1]) for column in table.columns if column.startswith("geometry_")
+        )
+        self._row = pd.Series(np.arange(len(table)), index=self.geoid)
+        self._geometries = {}
+        self._tree = None
+
+        # Bounding box of each state, from the bounding boxes of its counties
+        state_bounds = table.groupby("STATEFP").agg(minx=("minx", "min"), miny=("miny", "min"),
+                                                    maxx=("maxx", "max"), maxy=("maxy", "max"))
+        self.state_bounds = {statefp: tuple(row) for statefp, row in state_bounds.iterrows()}
+
+    @classmethod
+    def load(cls, store_file=STORE_FILE):
+        return cls(pd.read_parquet(store_file))
+
+    def geometries(self, tolerance=None):
+        """Returns the shapely geometries of all the counties, simplified with the given tolerance."""
+        if tolerance not in self._geometries:
+            import shapely
+
+            self._geometries[tolerance] = shapely.from_wkb(self.table[_geometry_column(tolerance)].to_numpy())
+        return self._geometries[tolerance]
+
+    def tree(self):
+        """Returns the STRtree of the full resolution shapes; its query results are rows of the store."""
+        # getattr: stores pickled in an older start-up bundle have no _tree
+        if getattr(self, "_tree", None) is None:
+            import shapely
+
+            self._tree = shapely.STRtree(self.geometries())
+        return self._tree
+
+    def rows(self, geoids):
+        """Returns the row of each GEOID in the store (-1 if the county is unknown)."""
+        return self._row.reindex(np.asarray(geoids, dtype=np.int64)).fillna(-1).to_numpy(dtype=np.int64)
+
+    def center(self, rows=None):
+        """Returns the (lat, lon) mean of the county centroids (of the given rows), used to centre the map."""
+        centroids = self.centroids if rows is None else self.centroids[rows]
+        return [centroids[:, 1].mean(), centroids[:, 0].mean()]
+
+
+def load_geometry_store(store_file=STORE_FILE, geojson_file=GEOJSON_FILE):
+    """Loads the geometry store, building it first if it is missing or older than the GeoJSON."""
+    if not os.path.exists(store_file) or os.path.getmtime(store_file) < os.path.getmtime(geojson_file):
+        build_geometry_store(geojson_file, store_file)
+    return GeometryStore.load(store_file)
+
+
+if __name__ == "__main__":
+    print(f"Geometry store saved as {build_geometry_store()}")
@@ -0,0 +1,456 @@
+"""
+Builds the cached inputs of the training pipeline from the raw files used by Code.ipynb.
+
+The yearly storm event files (Events_2002.csv ... Events_2024.csv) are parsed in parallel, with
+explicit dtypes and only the columns the models need, and each year is written once to a Parquet
+file of the cache. The GDP, population and land area files are turned into GDP per capita and
+Density per county and per state, and the per-disaster training tables (flood, tornado, ...) are
+built from the cache like in the notebook. A later run only parses the files that changed.
+
+Cache layout:
+    <cache-dir>/events/events_<year>.parquet
+    <cache-dir>/county_values.parquet, <cache-dir>/state_values.parquet
+    <cache-dir>/tables/<table>.parquet
+
+Example:
+    python ingest.py --events-dir data --cache-dir ingest_cache --workers 8 --county-csv merged_data_county.csv
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = "ingest_cache"
+GDP_FILE = "GDP_county.csv"
+POPULATION_FILES = ("Pop_2000_2010.csv", "Pop_2010_2020.csv", "Pop_2020_2023.csv")
+SIZE_FILE = "size_county.txt"
+
+# Columns read from the yearly event files, with their dtypes (the narratives and the other
+# columns dropped by the notebook are never parsed)
+EVENT_DTYPES = {
+    "BEGIN_YEARMONTH": "int32",
+    "BEGIN_DAY": "int8",
+    "BEGIN_TIME": "int16",
+    "END_YEARMONTH": "int32",
+    "END_DAY": "int8",
+    "END_TIME": "int16",
+    "STATE": "category",
+    "STATE_FIPS": "int16",
+    "YEAR": "int16",
+    "EVENT_TYPE": "category",
+    "CZ_FIPS": "int16",
+    "INJURIES_DIRECT": "int32",
+    "INJURIES_INDIRECT": "int32",
+    "DEATHS_DIRECT": "int32",
+    "DEATHS_INDIRECT": "int32",
+    "DAMAGE_PROPERTY": "string",
+    "MAGNITUDE": "float64",
+    "MAGNITUDE_TYPE": "category",
+    "FLOOD_CAUSE": "category",
+    "TOR_F_SCALE": "category",
+    "TOR_LENGTH": "float64",
+    "TOR_WIDTH": "float64",
+    "BEGIN_LAT": "float64",
+    "BEGIN_LON": "float64",
+    "END_LAT": "float64",
+    "END_LON": "float64",
+}
+
+# Training tables: event type, level of the GDP per capita and Density (county or state), and
+# columns kept, in the order of the notebook
+TABLES = {
+    "flood": ("Flood", "county", [
+        "State", "Year", "INJURIES_DIRECT", "INJURIES_INDIRECT", "DEATHS_DIRECT", "DEATHS_INDIRECT",
+        "DAMAGE_PROPERTY", "FLOOD_CAUSE", "DURATION_HOURS", "Distance_km", "GEOID", "County",
+        "GDP_per_capita", "Density",
+    ]),
+    "high_wind": ("High Wind", "state", [
+        "State", "Year", "INJURIES_DIRECT", "INJURIES_INDIRECT", "DEATHS_DIRECT", "DEATHS_INDIRECT",
+        "DAMAGE_PROPERTY", "MAGNITUDE", "MAGNITUDE_TYPE", "DURATION_HOURS", "GEOID", "GDP_per_capita", "Density",
+    ]),
+    "lightning": ("Lightning", "county", [
+        "State", "Year", "INJURIES_DIRECT", "INJURIES_INDIRECT", "DEATHS_DIRECT", "DEATHS_INDIRECT",
+        "DAMAGE_PROPERTY", "DURATION_HOURS", "Distance_km", "GEOID", "County", "GDP_per_capita", "Density",
+    ]),
+    "tornado": ("Tornado", "county", [
+        "State", "Year", "INJURIES_DIRECT", "INJURIES_INDIRECT", "DEATHS_DIRECT", "DEATHS_INDIRECT",
+        "DAMAGE_PROPERTY", "TOR_F_SCALE", "TOR_LENGTH", "TOR_WIDTH", "DURATION_HOURS", "Distance_km", "GEOID",
+        "County", "GDP_per_capita", "Density",
+    ]),
+    "wildfire": ("Wildfire", "state", [
+        "State", "Year", "INJURIES_DIRECT", "INJURIES_INDIRECT", "DEATHS_DIRECT", "DEATHS_INDIRECT",
+        "DAMAGE_PROPERTY", "DURATION_HOURS", "GEOID", "GDP_per_capita", "Density",
+    ]),
+    "tropical_depression": ("Tropical Depression", "state", [
+        "State", "STATE_FIPS", "Year", "INJURIES_DIRECT", "INJURIES_INDIRECT", "DEATHS_DIRECT", "DEATHS_INDIRECT",
+        "DAMAGE_PROPERTY", "DURATION_HOURS", "GEOID", "GDP_per_capita", "Density",
+    ]),
+}
+
+STATE_NAMES = [
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut", "Delaware", "Florida",
+    "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa", "Kansas", "Kentucky", "Louisiana", "Maine",
+    "Maryland", "Massachusetts", "Michigan", "Minnesota", "Mississippi", "Missouri", "Montana", "Nebraska",
+    "Nevada", "New Hampshire", "New Jersey", "New Mexico", "New York", "North Carolina", "North Dakota", "Ohio",
+    "Oklahoma", "Oregon", "Pennsylvania", "Rhode Island", "South Carolina", "South Dakota", "Tennessee", "Texas",
+    "Utah", "Vermont", "Virginia", "Washington", "West Virginia", "Wisconsin", "Wyoming",
+]
+# Rows of the GDP file that are neither a county nor a state
+REGIONS = ["United States *", "New England", "Mideast", "Great Lakes", "Plains", "Southeast", "Southwest",
+           "Rocky Mountain", "Far West"]
+
+STATE_ABBREVIATIONS = {
+    "AK": "Alaska", "AL": "Alabama", "AR": "Arkansas", "AZ": "Arizona", "CA": "California", "CO": "Colorado",
+    "CT": "Connecticut", "DC": "District of Columbia", "DE": "Delaware", "FL": "Florida", "GA": "Georgia",
+    "HI": "Hawaii", "IA": "Iowa", "ID": "Idaho", "IL": "Illinois", "IN": "Indiana", "KS": "Kansas",
+    "KY": "Kentucky", "LA": "Louisiana", "MA": "Massachusetts", "MD": "Maryland", "ME": "Maine", "MI": "Michigan",
+    "MN": "Minnesota", "MO": "Missouri", "MS": "Mississippi", "MT": "Montana", "NC": "North Carolina",
+    "ND": "North Dakota", "NE": "Nebraska", "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico",
+    "NV": "Nevada", "NY": "New York", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon", "PA": "Pennsylvania",
+    "PR": "Puerto Rico", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota", "TN": "Tennessee",
+    "TX": "Texas", "UT": "Utah", "VA": "Virginia", "VT": "Vermont", "WA": "Washington", "WI": "Wisconsin",
+    "WV": "West Virginia", "WY": "Wyoming",
+}
+
+# Years with a GDP per capita and a Density
+FIRST_YEAR = 2001
+LAST_YEAR = 2022
+
+
+def _is_fresh(target, sources):
+    """True when target exists and is newer than all the source files."""
+    if not os.path.exists(target):
+        return False
+    mtime = os.path.getmtime(target)
+    return all(os.path.getmtime(source) <= mtime for source in sources)
+
+
+def event_files(events_dir):
+    """Returns {year: path} of the Events_<year>.csv files (optionally gzipped) of a directory."""
+    files = {}
+    for name in os.listdir(events_dir):
+        match = re.fullmatch(r"Events_(\d{4})\.csv(\.gz)?", name)
+        if match:
+            files[int(match.group(1))] = os.path.join(events_dir, name)
+    return dict(sorted(files.items()))
+
+
+def convert_damage(values):
+    """
+    Converts the damage strings ("10.00K", "1.5M", "250") to dollars; invalid values become NaN.
+    """
+    values = values.str.lower()
+    number = pd.to_numeric(values.str.replace("k", "", regex=False).str.replace("m", "", regex=False),
+                           errors="coerce")
+    multiplier = np.where(values.str.contains("k", regex=False), 1e3,
+                          np.where(values.str.contains("m", regex=False), 1e6, 1.0))
+    return (number * multiplier).astype("float64")
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between arrays of points."""
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(a)) * 6371
+
+
+def _datetime(yearmonth, day, hhmm):
+    return pd.to_datetime(pd.DataFrame({
+        "year": yearmonth // 100, "month": yearmonth % 100, "day": day, "hour": hhmm // 100, "minute": hhmm % 100,
+    }))
+
+
+def read_events(path):
+    """
+    Reads one yearly event file and derives the columns used by the models.
+
+    The events without a property damage are dropped, like in the notebook.
+
+    Returns:
+    A DataFrame with State (title case), Year, EVENT_TYPE, GEOID, STATE_FIPS, DURATION_HOURS,
+    Distance_km, DAMAGE_PROPERTY in dollars and the inputs of the models.
+    """
+    df = pd.read_csv(path, usecols=list(EVENT_DTYPES), dtype=EVENT_DTYPES)
+    df = df[df["DAMAGE_PROPERTY"].notna()].reset_index(drop=True)
+
+    begin = _datetime(df["BEGIN_YEARMONTH"], df["BEGIN_DAY"], df["BEGIN_TIME"])
+    end = _datetime(df["END_YEARMONTH"], df["END_DAY"], df["END_TIME"])
+    return pd.DataFrame({
+        "State": df["STATE"].map(str.title),
+        "STATE_FIPS": df["STATE_FIPS"],
+        "Year": df["YEAR"],
+        "EVENT_TYPE": df["EVENT_TYPE"],
+        "GEOID": df["STATE_FIPS"].astype("int64") * 1000 + df["CZ_FIPS"],
+        "INJURIES_DIRECT": df["INJURIES_DIRECT"],
+        "INJURIES_INDIRECT": df["INJURIES_INDIRECT"],
+        "DEATHS_DIRECT": df["DEATHS_DIRECT"],
+        "DEATHS_INDIRECT": df["DEATHS_INDIRECT"],
+        "DAMAGE_PROPERTY": convert_damage(df["DAMAGE_PROPERTY"]),
+        "MAGNITUDE": df["MAGNITUDE"],
+        "MAGNITUDE_TYPE": df["MAGNITUDE_TYPE"],
+        "FLOOD_CAUSE": df["FLOOD_CAUSE"],
+        "TOR_F_SCALE": df["TOR_F_SCALE"],
+        "TOR_LENGTH": df["TOR_LENGTH"],
+        "TOR_WIDTH": df["TOR_WIDTH"],
+        "DURATION_HOURS": (end - begin).dt.total_seconds() / 3600,
+        "Distance_km": haversine(df["BEGIN_LAT"], df["BEGIN_LON"], df["END_LAT"], df["END_LON"]),
+    })
+
+
+def events_cache_file(cache_dir, year):
+    return os.path.join(cache_dir, "events", f"events_{year}.parquet")
+
+
+def cache_events(path, cache_file):
+    """Parses one yearly file into its Parquet cache file, unless the cache is up to date."""
+    if _is_fresh(cache_file, [path]):
+        return cache_file, False
+    df = read_events(path)
+    tmp_file = cache_file + ".tmp"
+    df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, cache_file)
+    return cache_file, True
+
+
+def ingest_events(events_dir, cache_dir=CACHE_DIR, workers=None, years=None):
+    """
+    Caches the yearly event files in parallel, one process per file.
+
+    Parameters:
+    - years: iterable of years to cache, or None for every file of events_dir
+
+    Returns:
+    {year: (Parquet file, True when it was parsed in this run)}
+    """
+    files = event_files(events_dir)
+    if years is not None:
+        files = {year: files[year] for year in years}
+    os.makedirs(os.path.join(cache_dir, "events"), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {year: pool.submit(cache_events, path, events_cache_file(cache_dir, year))
+                   for year, path in files.items()}
+        return {year: future.result() for year, future in futures.items()}
+
+
+def load_events(cache_dir=CACHE_DIR, years=None, event_types=None):
+    """
+    Reads the cached events of some years (all the cached years by default) and event types.
+    """
+    import pyarrow.dataset as ds
+
+    events_dir = os.path.join(cache_dir, "events")
+    files = sorted(os.path.join(events_dir, name) for name in os.listdir(events_dir) if name.endswith(".parquet"))
+    if years is not None:
+        years = {int(year) for year in years}
+        files = [path for path in files if int(re.search(r"(\d{4})", os.path.basename(path)).group(1)) in years]
+    dataset = ds.dataset(files, format="parquet")
+    event_filter = ds.field("EVENT_TYPE").isin(list(event_types)) if event_types is not None else None
+    return dataset.to_table(filter=event_filter).to_pandas()
+
+
+def _read_population(population_files):
+    """Merges the three population estimate files into one POPESTIMATE<year> column per year."""
+    first, second, third = population_files
+    keys = ["STATE", "COUNTY", "CTYNAME"]
+    population = pd.read_csv(first, usecols=keys + [f"POPESTIMATE{year}" for year in range(2000, 2010)]
+                             + ["CENSUS2010POP"], encoding_errors="replace")
+    population = population.rename(columns={"CENSUS2010POP": "POPESTIMATE2010"})
+    population = population.merge(
+        pd.read_csv(second, usecols=keys + [f"POPESTIMATE{year}" for year in range(2011, 2021)],
+                    encoding_errors="replace"), on=keys, how="inner")
+    population = population.merge(
+        pd.read_csv(third, usecols=keys + [f"POPESTIMATE{year}" for year in range(2021, 2024)],
+                    encoding_errors="replace"), on=keys, how="inner")
+    return population
+
+
+def _melt_years(df, id_vars, prefix, value_name, first_year, last_year):
+    columns = [f"{prefix}{year}" for year in range(first_year, last_year + 1)]
+    long = df.melt(id_vars=id_vars, value_vars=columns, var_name="Year", value_name=value_name)
+    long["Year"] = long["Year"].str[-4:].astype("int16")
+    return long
+
+
+def build_socioeconomic(gdp_file=GDP_FILE, population_files=POPULATION_FILES, size_file=SIZE_FILE):
+    """
+    Computes the GDP per capita and the Density of every county and state, like the notebook.
+
+    Returns:
+    - county: DataFrame with GEOID, Year, STATE, County, GDP_per_capita and Density (2002-2022)
+    - state: DataFrame with STATE, State, Year, GDP_per_capita and Density (2001-2022)
+    """
+    years = [str(year) for year in range(FIRST_YEAR, LAST_YEAR + 1)]
+    gdp = pd.read_csv(gdp_file, usecols=["GeoFIPS", "GeoName", "Description"] + years, dtype=str)
+    gdp = gdp[gdp["Description"].str.strip() == "All industry total"]
+    gdp[years] = gdp[years].apply(pd.to_numeric, errors="coerce")
+    gdp["GEOID"] = pd.to_numeric(gdp["GeoFIPS"].str.strip(' "'), errors="coerce").astype("Int64")
+
+    population = _read_population(population_files)
+    population_years = [f"POPESTIMATE{year}" for year in range(FIRST_YEAR, LAST_YEAR + 1)]
+
+    size = pd.read_csv(size_file, delimiter="\t", usecols=["USPS", "GEOID", "ALAND"])
+    size = size[size["USPS"] != "PR"]
+
+    # Counties
+    county_population = population[population["COUNTY"] != 0].copy()
+    county_population["GEOID"] = (county_population["STATE"] * 1000 + county_population["COUNTY"]).astype("Int64")
+    county_gdp = gdp[~gdp["GeoName"].isin(STATE_NAMES + REGIONS)]
+    county = county_population.merge(county_gdp[["GEOID"] + years], on="GEOID", how="inner")
+    gdp_per_capita = county[years].to_numpy() * 1000 / county[population_years].to_numpy()
+    county[[f"GDP_capita{year}" for year in years]] = gdp_per_capita
+    county_gdp = _melt_years(county.rename(columns={"CTYNAME": "County"}), ["STATE", "County", "GEOID"], "GDP_capita",
+                             "GDP_per_capita", FIRST_YEAR + 1, LAST_YEAR)
+
+    county = county_population.merge(size[["GEOID", "ALAND"]], on="GEOID", how="inner")
+    density = county[population_years].to_numpy() / (county[["ALAND"]].to_numpy() / 1e6)
+    county[[f"Density{year}" for year in years]] = density
+    county_density = _melt_years(county, ["GEOID"], "Density", "Density", FIRST_YEAR, LAST_YEAR)
+    county = county_gdp.merge(county_density, on=["GEOID", "Year"], how="inner")
+
+    # States
+    state_population = population[population["COUNTY"] == 0].rename(columns={"CTYNAME": "State"})
+    state_population = state_population[state_population["State"] != "Puerto Rico"]
+    state_gdp = gdp[gdp["GeoName"].isin(STATE_NAMES)].rename(columns={"GeoName": "State"})
+    state = state_population.merge(state_gdp[["State"] + years], on="State", how="inner")
+    state[[f"GDP_capita{year}" for year in years]] = state[years].to_numpy() * 1000 / state[population_years].to_numpy()
+    state_gdp = _melt_years(state, ["STATE", "State"], "GDP_capita", "GDP_per_capita", FIRST_YEAR, LAST_YEAR)
+
+    state_size = size.groupby("USPS")["ALAND"].sum().rename(index=STATE_ABBREVIATIONS)
+    state = state_population[state_population["State"].isin(state_size.index)].copy()
+    density = state[population_years].to_numpy() / (state_size.loc[state["State"]].to_numpy()[:, np.newaxis] / 1e6)
+    state[[f"Density{year}" for year in years]] = density
+    state_density = _melt_years(state, ["State"], "Density", "Density", FIRST_YEAR, LAST_YEAR)
+    state = state_gdp.merge(state_density, on=["State", "Year"], how="inner")
+
+    return county, state
+
+
+def project_county_values(county, last_year=LAST_YEAR, until=2030):
+    """
+    Extends the county values after last_year with the average yearly change of 2002-2019, like
+    the table of merged_data_county.csv used by the app.
+    """
+    county = county.sort_values(["GEOID", "Year"], kind="stable")
+    pre_covid = county[county["Year"].between(2002, 2019)]
+    columns = ["GDP_per_capita", "Density"]
+    drift = pre_covid.groupby("GEOID")[columns].diff().groupby(pre_covid["GEOID"]).mean()
+    start = county[county["Year"] == last_year].set_index("GEOID")[columns].reindex(drift.index).fillna(0)
+
+    steps = np.arange(1, until - last_year + 1)
+    future = pd.DataFrame({
+        "Year": np.tile(last_year + steps, len(drift)),
+        "GEOID": np.repeat(drift.index.to_numpy(), len(steps)),
+    })
+    for column in columns:
+        future[column] = (start[column].to_numpy()[:, np.newaxis]
+                          + steps[np.newaxis, :] * drift[column].to_numpy()[:, np.newaxis]).ravel()
+    projected = pd.concat([county, future], ignore_index=True).sort_values(["GEOID", "Year"], kind="stable")
+    # The projected rows take the names of the county, like the forward fill of the notebook
+    return projected.ffill().reset_index(drop=True)
+
+
+def build_tables(events, county, state, tables=None):
+    """
+    Builds the training tables of the disaster types from the cached events.
+
+    Parameters:
+    - events: DataFrame returned by load_events
+    - county, state: DataFrames returned by build_socioeconomic
+    - tables: names of the tables to build (default: all of TABLES)
+
+    Returns:
+    {table name: DataFrame}
+    """
+    county = county.rename(columns={"STATE": "STATE_county"})
+    state = state.drop(columns="STATE")
+    built = {}
+    for name in tables or TABLES:
+        event_type, level, columns = TABLES[name]
+        df = events[events["EVENT_TYPE"] == event_type]
+        # Categories of other event types must not become dummy columns during training
+        df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+        df = df.astype({"Year": "int64", "GEOID": "int64"})
+        if level == "county":
+            df = df.merge(county.astype({"GEOID": "int64", "Year": "int64"}), on=["GEOID", "Year"], how="inner")
+        else:
+            df = df.merge(state.astype({"Year": "int64"}), on=["State", "Year"], how="inner")
+        built[name] = df[columns].reset_index(drop=True)
+    return built
+
+
+def table_file(cache_dir, name):
+    return os.path.join(cache_dir, "tables", f"{name}.parquet")
+
+
+def load_table(name, cache_dir=CACHE_DIR):
+    """Reads a training table written by run()."""
+    return pd.read_parquet(table_file(cache_dir, name))
+
+
+def load_socioeconomic(cache_dir=CACHE_DIR, gdp_file=GDP_FILE, population_files=POPULATION_FILES,
+                       size_file=SIZE_FILE):
+    """Returns the (county, state) values, from the cache when it is newer than the input files."""
+    county_file = os.path.join(cache_dir, "county_values.parquet")
+    state_file = os.path.join(cache_dir, "state_values.parquet")
+    sources = [gdp_file, *population_files, size_file]
+    if _is_fresh(county_file, sources) and _is_fresh(state_file, sources):
+        return pd.read_parquet(county_file), pd.read_parquet(state_file)
+    county, state = build_socioeconomic(gdp_file, population_files, size_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    county.to_parquet(county_file, index=False)
+    state.to_parquet(state_file, index=False)
+    return county, state
+
+
+def run(events_dir=".", cache_dir=CACHE_DIR, workers=None, data_dir=".", county_csv=None):
+    """
+    Caches the event files and rebuilds the training tables.
+
+    Returns:
+    {year: True when the file was parsed in this run}
+    """
+    start = time.perf_counter()
+    cached = ingest_events(events_dir, cache_dir, workers)
+    parsed = [year for year, (_, rebuilt) in cached.items() if rebuilt]
+    print(f"Events: {len(cached)} years cached, {len(parsed)} parsed ({time.perf_counter() - start:.1f}s)",
+          file=sys.stderr)
+
+    county, state = load_socioeconomic(
+        cache_dir, os.path.join(data_dir, GDP_FILE), [os.path.join(data_dir, f) for f in POPULATION_FILES],
+        os.path.join(data_dir, SIZE_FILE),
+    )
+    if county_csv:
+        state_names = state.drop_duplicates("STATE").set_index("STATE")["State"]
+        county_values = county.assign(State=county["STATE"].map(state_names)).dropna(subset=["State"])
+        county_values = project_county_values(county_values)
+        county_values[["County", "GEOID", "Year", "Density", "STATE", "GDP_per_capita", "State"]].to_csv(
+            county_csv, index=False)
+
+    events = load_events(cache_dir, event_types=[event_type for event_type, _, _ in TABLES.values()])
+    os.makedirs(os.path.join(cache_dir, "tables"), exist_ok=True)
+    for name, table in build_tables(events, county, state).items():
+        table.to_parquet(table_file(cache_dir, name), index=False)
+        print(f"{name}: {len(table)} rows", file=sys.stderr)
+    print(f"Done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return {year: rebuilt for year, (_, rebuilt) in cached.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache the storm event files and build the training tables.")
+    parser.add_argument("--events-dir", default=".", help="directory with the Events_<year>.csv files")
+    parser.add_argument("--data-dir", default=".", help="directory with the GDP, population and land area files")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--county-csv", default=None,
+                        help="also write the GDP per capita and Density per county and year (merged_data_county.csv)")
+    args = parser.parse_args(argv)
+    run(args.events_dir, args.cache_dir, args.workers, args.data_dir, args.county_csv)
+
+
+if __name__ == "__main__":
+    main()
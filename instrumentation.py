@@ -0,0 +1,253 @@
+"""
+Timing spans and memory peaks of the reruns of the app.
+
+Every rerun of app_final.py opens a Trace, wraps each stage in a named span and finishes the
+trace at the end of the script (or before st.stop). A finished trace is:
+- logged as one JSON line on the "app.timing" logger (stderr by default),
+- added to the histograms of the process, written in the Prometheus text format to
+  APP_METRICS_FILE (metrics/app.<pid>.prom by default) for the node exporter textfile collector
+  or a local scrape. Every process writes its own file, with a pid label on its series, so the
+  counters of the processes of a deployment are never mixed up; the files of the processes that
+  are gone are removed (at most once a minute),
+- shown in the debug panel of the sidebar.
+
+Every rerun records the resident set size of the process at its end and the maximum RSS of the
+process, which cost one read of /proc (or one system call). The peak of the Python allocations of
+the rerun itself is opt-in: it is measured with tracemalloc, which slows every allocation down,
+so it is only enabled with APP_TRACE_MEMORY=1. Streamlit runs the sessions in threads of the same
+process, so the peak of a rerun includes the allocations of the reruns running at the same time.
+The RSS figures are left out where the platform does not provide them (no resource module and no
+psutil, e.g. on Windows without psutil).
+"""
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# {pid} is replaced by the id of the process writing the file
+METRICS_FILE = os.environ.get("APP_METRICS_FILE", os.path.join("metrics", "app.{pid}.prom"))
+TRACE_MEMORY = os.environ.get("APP_TRACE_MEMORY", "0") not in ("", "0")
+# Minimum number of seconds between two clean-ups of the metrics files of the processes that are gone
+CLEANUP_SECONDS = 60
+
+# Upper bounds of the histogram buckets of the span durations, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("app.timing")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_files(path=METRICS_FILE):
+    """Removes the metrics files written by processes that are not running anymore."""
+    if "{pid}" not in path:
+        return
+    prefix, suffix = os.path.basename(path).split("{pid}", 1)
+    directory = os.path.dirname(path) or "."
+    for name in os.listdir(directory):
+        pid = name[len(prefix):len(name) - len(suffix)]
+        if name.startswith(prefix) and name.endswith(suffix) and pid.isdigit() and not _process_alive(int(pid)):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def _psutil_memory():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info()
+
+
+def rss_mb():
+    """The current resident set size of the process in MB, None when it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        memory = _psutil_memory()
+        return memory.rss / 1024 ** 2 if memory is not None else None
+
+
+def max_rss_mb():
+    """The maximum resident set size of the process in MB, None when it cannot be read."""
+    if resource is not None:
+        # ru_maxrss is in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    memory = _psutil_memory()
+    peak = getattr(memory, "peak_wset", None)  # Windows
+    return peak / 1024 ** 2 if peak is not None else None
+
+
+class Metrics:
+    """
+    Span durations and rerun counts of all the reruns of the process.
+
+    Parameters:
+    - buckets: upper bounds of the histogram buckets, in seconds
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reruns = {}  # status -> number of reruns
+        self.spans = {}  # span name -> [count per bucket..., count, sum of the seconds]
+        self.last_peak_mb = None
+        self._cleaned_at = None  # time.monotonic() of the last clean-up of the stale metrics files
+
+    def observe(self, record):
+        with self._lock:
+            self.reruns[record["status"]] = self.reruns.get(record["status"], 0) + 1
+            for name, seconds in [*record["spans"].items(), ("rerun", record["seconds"])]:
+                histogram = self.spans.setdefault(name, [0] * (len(self.buckets) + 2))
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        histogram[i] += 1
+                histogram[-2] += 1
+                histogram[-1] += seconds
+            if "peak_traced_mb" in record:
+                self.last_peak_mb = record["peak_traced_mb"]
+
+    def summary(self):
+        """Returns {span name: (number of runs, mean seconds)}."""
+        with self._lock:
+            return {name: (histogram[-2], histogram[-1] / histogram[-2]) for name, histogram in self.spans.items()}
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format, with the pid of the process on every series."""
+        pid = f'pid="{os.getpid()}"'
+        lines = ["# HELP app_reruns_total Reruns of the app, by how they ended.", "# TYPE app_reruns_total counter"]
+        with self._lock:
+            lines += [f'app_reruns_total{{{pid},status="{status}"}} {count}' for status, count in sorted(self.reruns.items())]
+            lines += ["# HELP app_span_seconds Duration of the stages of the reruns.",
+                      "# TYPE app_span_seconds histogram"]
+            for name, histogram in sorted(self.spans.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'app_span_seconds_bucket{{{pid},span="{name}",le="{bound}"}} {count}')
+                lines.append(f'app_span_seconds_bucket{{{pid},span="{name}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'app_span_seconds_count{{{pid},span="{name}"}} {histogram[-2]}')
+                lines.append(f'app_span_seconds_sum{{{pid},span="{name}"}} {histogram[-1]:.6f}')
+            if self.last_peak_mb is not None:
+                lines += ["# HELP app_rerun_peak_memory_bytes Peak of the Python allocations of the last rerun.",
+                          "# TYPE app_rerun_peak_memory_bytes gauge",
+                          f"app_rerun_peak_memory_bytes{{{pid}}} {self.last_peak_mb * 1024 ** 2:.0f}"]
+        for name, help_text, megabytes in [("app_rss_bytes", "Resident set size of the process.", rss_mb()),
+                                           ("app_max_rss_bytes", "Maximum resident set size of the process.", max_rss_mb())]:
+            if megabytes is not None:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge",
+                          f"{name}{{{pid}}} {megabytes * 1024 ** 2:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=METRICS_FILE):
+        """
+        Writes the metrics of the process atomically, so that a scrape never reads half a file,
+        and removes the files of the processes that are gone at most every CLEANUP_SECONDS.
+
+        Returns:
+        The path of the file, with {pid} replaced by the id of the process.
+        """
+        template, path = path, path.format(pid=os.getpid())
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+        now = time.monotonic()
+        with self._lock:
+            clean_up = self._cleaned_at is None or now - self._cleaned_at >= CLEANUP_SECONDS
+            if clean_up:
+                self._cleaned_at = now
+        if clean_up:
+            remove_stale_files(template)
+        return path
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """
+    Timing spans of one rerun.
+
+    Parameters:
+    - trace_memory: bool, measure the peak of the Python allocations of the rerun (tracemalloc)
+    """
+
+    def __init__(self, trace_memory=TRACE_MEMORY):
+        self.spans = {}
+        self.trace_memory = trace_memory
+        self.record = None
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name):
+        """Times a stage; the time of the spans with the same name adds up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, status="ok", **fields):
+        """
+        Ends the rerun: logs it, adds it to the metrics of the process and writes the metrics file.
+        Only the first call has an effect.
+
+        Parameters:
+        - status: how the rerun ended, e.g. "ok" or "stopped"
+        - fields: values added to the log record, e.g. the disaster type
+
+        Returns:
+        The record of the rerun.
+        """
+        if self.record is not None:
+            return self.record
+        self.record = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "status": status,
+            **fields,
+            "seconds": round(time.perf_counter() - self.start, 6),
+            "spans": {name: round(seconds, 6) for name, seconds in self.spans.items()},
+        }
+        for name, megabytes in (("rss_mb", rss_mb()), ("max_rss_mb", max_rss_mb())):
+            if megabytes is not None:
+                self.record[name] = round(megabytes, 1)
+        if self.trace_memory:
+            self.record["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+        logger.info(json.dumps(self.record))
+        metrics.observe(self.record)
+        try:
+            metrics.write()
+        except OSError as e:
+            logger.warning(json.dumps({"error": f"Could not write the metrics file: {e}"}))
+        return self.record
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+
+# Pickled model for each disaster type
+MODEL_FILES = {
+    "Tornado": "tornado_model.pkl",
+    "Flood": "flood_model.pkl",
+    "Lightning": "lightning_model.pkl",
+    "High Wind": "high_wind_model.pkl",
+    "Wildfire": "wildfire_model.pkl",
+    "Tropical Depression": "tropical_depression_model.pkl",
+}
+
+
+class ModelRegistry:
+    """
+    Loads the models lazily and keeps them in memory for the whole process.
+
+    A model is only read from disk the first time its disaster type is requested, and it is then
+    shared by every Streamlit session of the process. The models that have not been used for
+    idle_seconds, or the least recently used ones above max_models, are dropped again.
+
+    Parameters:
+    - model_files: dict, disaster type -> pickle file
+    - max_models: int, maximum number of models kept in memory at the same time
+    - idle_seconds: float, models not used for this long are evicted
+    - prefer_flat: bool, load the flat .npz export of a model when there is one (see flat_trees.py);
+      it loads much faster and needs less memory, and the batches are still predicted by the
+      original model, which is only loaded when the first batch comes in
+    """
+
+    def __init__(self, model_files=MODEL_FILES, max_models=3, idle_seconds=30 * 60, prefer_flat=False):
+        self.model_files = model_files
+        self.max_models = max_models
+        self.idle_seconds = idle_seconds
+        self.prefer_flat = prefer_flat
+        self._models = OrderedDict()  # disaster type -> (model, last used)
+        self._lock = threading.Lock()
+        self._loading = {}  # disaster type -> lock held while its model is loaded
+        self._sources = {}  # disaster type -> function loading its model instead of the model file
+
+    def get(self, disaster_type):
+        with self._lock:
+            loading = self._loading.setdefault(disaster_type, threading.Lock())
+        # Only the loads of the same model wait for each other, different models load in parallel
+        with loading:
+            with self._lock:
+                if disaster_type in self._models:
+                    model = self._models.pop(disaster_type)[0]
+                    return self._keep(disaster_type, model)
+            source = self._sources.get(disaster_type)
+            model = source() if source is not None else self._load(self.model_files[disaster_type])
+            with self._lock:
+                return self._keep(disaster_type, model)
+
+    def get_many(self, disaster_types):
+        """
+        Returns {disaster type: model} for several disaster types, loading the missing models in
+        parallel threads.
+
+        The returned dict keeps the models alive while the caller uses them, so max_models is
+        not raised: the registry stays bounded and only keeps the most recently used ones.
+        """
+        disaster_types = list(disaster_types)
+        with ThreadPoolExecutor(max_workers=len(disaster_types) or 1) as pool:
+            return dict(zip(disaster_types, pool.map(self.get, disaster_types)))
+
+    def add_source(self, disaster_type, load):
+        """
+        Makes the registry load a model with load() instead of reading its model file, e.g. from
+        the start-up bundle (see artifacts.py). The model is still only loaded when it is
+        requested, and evicted like the others.
+        """
+        with self._lock:
+            self._sources[disaster_type] = load
+
+    def _keep(self, disaster_type, model):
+        now = time.monotonic()
+        self._models[disaster_type] = (model, now)
+        self._evict(now)
+        return model
+
+    def _load(self, model_file):
+        if self.prefer_flat:
+            from flat_trees import FlatModel, flat_file
+
+            if os.path.exists(flat_file(model_file)):
+                return FlatModel.load(model_file)
+        # The large numpy arrays (e.g. the trees of a random forest) are memory-mapped
+        # instead of copied; boosters are stored as raw bytes and are loaded as usual
+        return joblib.load(model_file, mmap_mode="r")
+
+    def _evict(self, now):
+        for name, (_, last_used) in list(self._models.items()):
+            if now - last_used > self.idle_seconds:
+                del self._models[name]
+        while len(self._models) > self.max_models:
+            self._models.popitem(last=False)
+
+    def loaded(self):
+        """Returns the disaster types whose model is currently in memory."""
+        with self._lock:
+            return list(self._models)
+
+
+# One registry per process, so that all the sessions share the same models
+registry = ModelRegistry()
+
+
+def get_model(disaster_type):
+    return registry.get(disaster_type)
@@ -0,0 +1,86 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def _nbytes(value):
+    """Memory taken by a cached value; the values the cache cannot size are rejected."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (str, bytes, int, float, np.generic)):
+        return sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_nbytes(k) + _nbytes(v) for k, v in value.items())
+    raise TypeError(f"Cannot cache a {type(value).__name__}: its size is unknown")
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of the results of a scenario.
+
+    An entry is keyed on the disaster type, the year and the encoded feature vector of the
+    scenario, and holds any of its results: the single-county prediction, the damage array of all
+    the counties and the rendered map. The least recently used entries are dropped when the
+    entries take more than max_bytes in total.
+
+    Parameters:
+    - max_bytes: int, memory budget of the cache
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (results, size in bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(disaster_type, features, year):
+        return disaster_type, int(year), np.ascontiguousarray(features, dtype=np.float32).tobytes()
+
+    def get(self, key, result):
+        """Returns one result of an entry (e.g. "county_damage"), or None when it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or result not in entry[0]:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0][result]
+
+    def put(self, key, result, value):
+        _nbytes(value)  # raises before the entry is changed when the value cannot be sized
+        with self._lock:
+            results, size = self._entries.pop(key, ({}, 0))
+            self._bytes -= size
+            results[result] = value
+            size = sum(_nbytes(v) for v in results.values())
+            self._entries[key] = (results, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+# One cache per process, shared by all the sessions
+cache = PredictionCache()
@@ -0,0 +1,390 @@
+"""
+Incremental refresh of the training tables and the models when new input files arrive.
+
+A manifest in the ingestion cache records a fingerprint of every input file, of every training
+table and the training history of every model. A refresh then:
+1. finds the input files that changed since the last run (e.g. a new Events_2025.csv),
+2. parses only the new or changed yearly files (see ingest.py),
+3. replaces the rows of those years in the training tables; every year is rebuilt when the GDP,
+   population or land area files changed, since they change the values of all the rows,
+4. retrains only the models whose table changed, by adding boosting rounds to the XGBoost
+   models (and trees to a random forest) instead of refitting them from scratch,
+5. writes the changed inputs, tables and models to the manifest.
+
+The first run only records the current inputs as the baseline of the shipped models. A model is
+only retrained when the StandardScaler file of its notebook is there, since the models were
+fitted on scaled features (see training_encoder).
+
+Example:
+    python retrain.py --events-dir data --data-dir data --rounds 50
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import ingest
+from features import FeatureEncoder, FEATURE_FILES, SCALER_FILES, CATEGORICAL
+from model_registry import MODEL_FILES
+
+MANIFEST_FILE = "manifest.json"
+
+# Disaster type of each training table
+TABLE_TYPES = {name: event_type for name, (event_type, _, _) in ingest.TABLES.items()}
+
+# Table columns that are not inputs of the models
+NOT_FEATURES = ["STATE_FIPS", "County", "MAGNITUDE_TYPE"]
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Size, modification time and SHA-256 of a file; the hash of previous is reused when the size
+    and the modification time did not change. None when the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+        return previous
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 ** 2), b""):
+            digest.update(block)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+
+
+def table_fingerprint(df):
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def load_manifest(cache_dir=ingest.CACHE_DIR):
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, cache_dir=ingest.CACHE_DIR):
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def input_files(events_dir, data_dir):
+    """Returns {name in the manifest: path} of all the input files."""
+    files = {f"events/{os.path.basename(path)}": path for path in ingest.event_files(events_dir).values()}
+    for name in (ingest.GDP_FILE, *ingest.POPULATION_FILES, ingest.SIZE_FILE):
+        files[name] = os.path.join(data_dir, name)
+    return files
+
+
+def _event_year(name):
+    return int(re.search(r"Events_(\d{4})", name).group(1))
+
+
+def changed_inputs(files, previous):
+    """
+    Returns the fingerprints of the input files that exist, the names of the ones that are new,
+    changed or removed since the previous manifest entries, and the names of the expected files
+    that are missing.
+    """
+    fingerprints = {name: file_fingerprint(path, previous.get(name)) for name, path in files.items()}
+    missing = sorted(name for name, fingerprint in fingerprints.items() if fingerprint is None)
+    fingerprints = {name: fingerprint for name, fingerprint in fingerprints.items() if fingerprint is not None}
+    changed = [name for name, fingerprint in fingerprints.items()
+               if name not in previous or previous[name]["sha256"] != fingerprint["sha256"]]
+    changed += [name for name in previous if name not in fingerprints]
+    return fingerprints, sorted(changed), missing
+
+
+def update_tables(cache_dir, years, county, state):
+    """
+    Replaces the rows of some years in the training tables with rows built from the event cache.
+
+    Returns:
+    {table name: updated DataFrame}
+    """
+    events = ingest.load_events(cache_dir, years=years, event_types=list(TABLE_TYPES.values()))
+    new_rows = ingest.build_tables(events, county, state)
+    os.makedirs(os.path.join(cache_dir, "tables"), exist_ok=True)
+    tables = {}
+    for name, rows in new_rows.items():
+        path = ingest.table_file(cache_dir, name)
+        if os.path.exists(path):
+            table = pd.read_parquet(path)
+            rows = pd.concat([table[~table["Year"].isin(years)], rows], ignore_index=True)
+        table = rows.sort_values("Year", kind="stable").reset_index(drop=True)
+        table.to_parquet(path, index=False)
+        tables[name] = table
+    return tables
+
+
+def unseen_categories(encoder, df):
+    """
+    Flags the rows with a category that the model has never seen.
+
+    pd.get_dummies(drop_first=True) gives the first category (in sorted order) no column, so a
+    value without a column is only the dropped category when it sorts before all the others;
+    any other value was not in the training data, and the encoder would silently treat it as
+    the dropped category.
+    """
+    unseen = np.zeros(len(df), dtype=bool)
+    for feature in CATEGORICAL:
+        categories = encoder.categories(feature)
+        if feature not in df.columns or not categories:
+            continue
+        values = df[feature].astype(str)
+        unseen |= (~values.isin(categories) & (values > min(categories))).to_numpy()
+    return unseen
+
+
+def usable_rows(table, encoder):
+    """Returns the rows of a table that a model can use: no missing value and no unseen category."""
+    rows = table.drop(columns=[c for c in NOT_FEATURES if c in table.columns]).dropna()
+    return rows[~unseen_categories(encoder, rows)]
+
+
+def training_data(table, encoder):
+    """Returns the feature matrix, the log damage and the years of the usable rows of a table."""
+    rows = usable_rows(table, encoder)
+    X = encoder.encode_frame(rows.drop(columns=["DAMAGE_PROPERTY", "GEOID"]))
+    y = np.log1p(rows["DAMAGE_PROPERTY"].to_numpy(dtype=np.float64))
+    return X, y, rows["Year"].to_numpy()
+
+
+def _rmse(model, X, y):
+    return float(np.sqrt(np.mean((model.predict(X) - y) ** 2))) if len(y) else None
+
+
+def continue_training(model, X, y, rounds):
+    """
+    Adds rounds boosting rounds to an XGBRegressor (or rounds trees to a random forest), fitted on
+    X and y, and keeps the existing trees.
+    """
+    if hasattr(model, "get_booster"):
+        params = model.get_params()
+        params["n_estimators"] = rounds
+        updated = type(model)(**params)
+        updated.fit(X, y, xgb_model=model.get_booster())
+        return updated
+    if hasattr(model, "estimators_"):
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + rounds)
+        model.fit(X, y)
+        return model
+    raise TypeError(f"Cannot continue training a {type(model).__name__}")
+
+
+def save_model(model, model_file):
+    """
+    Replaces a model pickle, and its exported flat model when there is one.
+
+    Both are first written to temporary files, and the flat model is checked against the new
+    model (see flat_trees.export_flat), so a failed check leaves the deployed pickle and flat
+    model as they were; the two files are then replaced one after the other.
+    """
+    from flat_trees import export_flat, flat_file
+
+    tmp_files = {model_file: f"{model_file}.{os.getpid()}.tmp"}
+    if os.path.exists(flat_file(model_file)):
+        tmp_files[flat_file(model_file)] = f"{flat_file(model_file)}.{os.getpid()}.tmp"
+    try:
+        joblib.dump(model, tmp_files[model_file])
+        if flat_file(model_file) in tmp_files:
+            export_flat(model, tmp_files[flat_file(model_file)])
+    except BaseException:
+        for tmp_file in tmp_files.values():
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        raise
+    for path, tmp_file in tmp_files.items():
+        os.replace(tmp_file, path)
+
+
+def training_encoder(disaster_type):
+    """
+    The feature encoder used to train the model of a disaster type, with the StandardScaler of
+    the notebook: the models were fitted on scaled features, and the app scales its inputs the
+    same way, so training on raw values would give a model that the app feeds wrong inputs.
+
+    Raises a FileNotFoundError when the scaler file of the disaster type is missing.
+    """
+    scaler_file = SCALER_FILES[disaster_type]
+    if not os.path.exists(scaler_file):
+        raise FileNotFoundError(f"{scaler_file} not found: the {disaster_type} model is trained on scaled features")
+    return FeatureEncoder.from_schema(FEATURE_FILES[disaster_type], scaler_file)
+
+
+def retrain_model(disaster_type, table, trained_years, rounds, full=False, seed=42):
+    """
+    Retrains the model of a disaster type on its updated table.
+
+    20% of the rows of the years that the current model was not trained on are held out (like
+    the test split of the notebook) to compare the model before and after the update. The rows
+    of the years it was trained on are never held out: its error on them is a training error,
+    so when there is no new year (e.g. only the GDP or population files changed, or
+    --retrain-all) the comparison is skipped and the summary says why.
+
+    Parameters:
+    - trained_years: years of the table the current model was trained on, None when unknown
+
+    Returns:
+    A dict with the training summary, written to the manifest.
+    """
+    model_file = MODEL_FILES[disaster_type]
+    encoder = training_encoder(disaster_type)
+    model = joblib.load(model_file)
+    X, y, years = training_data(table, encoder)
+
+    rng = np.random.default_rng(seed)
+    if trained_years is None:
+        comparison = "skipped: the years the current model was trained on are unknown"
+        held_out = np.zeros(len(y), dtype=bool)
+    else:
+        held_out = ~np.isin(years, trained_years) & (rng.random(len(y)) < 0.2)
+        comparison = "held-out rows of new years" if held_out.any() else \
+            "skipped: no new year, every row was already seen by the current model"
+    before = _rmse(model, X[held_out], y[held_out])
+
+    start = time.perf_counter()
+    if full:
+        model = type(model)(**model.get_params()).fit(X[~held_out], y[~held_out])
+    else:
+        model = continue_training(model, X[~held_out], y[~held_out], rounds)
+    seconds = time.perf_counter() - start
+
+    save_model(model, model_file)
+
+    return {
+        "updated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "mode": "full" if full else "warm start",
+        "added_rounds": None if full else rounds,
+        "training_rows": int((~held_out).sum()),
+        "held_out_rows": int(held_out.sum()),
+        "comparison": comparison,
+        "held_out_rmse_log_before": before,
+        "held_out_rmse_log_after": _rmse(model, X[held_out], y[held_out]),
+        "seconds": round(seconds, 1),
+    }
+
+
+def _years(table):
+    return sorted(int(year) for year in table["Year"].unique())
+
+
+def refresh(events_dir=".", data_dir=".", cache_dir=ingest.CACHE_DIR, rounds=50, workers=None, full=False,
+            retrain_all=False):
+    """
+    Runs an incremental refresh (see the module docstring).
+
+    Returns:
+    The entry of this run in the manifest.
+    """
+    manifest = load_manifest(cache_dir)
+    baseline = manifest is None
+    manifest = manifest or {"inputs": {}, "tables": {}, "models": {}, "runs": []}
+
+    fingerprints, changed, missing = changed_inputs(input_files(events_dir, data_dir), manifest["inputs"])
+    run = {"time": datetime.now(timezone.utc).isoformat(timespec="seconds"), "changed_inputs": changed,
+           "missing_inputs": missing, "rebuilt_years": [], "changed_tables": [], "retrained_models": []}
+    if missing:
+        # The tables cannot be built without the GDP, population and land area files
+        print(f"Missing input files: {', '.join(missing)}; nothing was rebuilt", file=sys.stderr)
+        return run
+    if not changed and not retrain_all:
+        print("No input file changed", file=sys.stderr)
+        return run
+
+    event_years = {_event_year(name): name for name in fingerprints if name.startswith("events/")}
+    socioeconomic_changed = any(not name.startswith("events/") for name in changed)
+    if baseline or socioeconomic_changed:
+        years = sorted(event_years)
+    else:
+        years = sorted(year for year, name in event_years.items() if name in changed)
+    removed_years = [_event_year(name) for name in changed if name.startswith("events/") and name not in fingerprints]
+    for year in removed_years:
+        path = ingest.events_cache_file(cache_dir, year)
+        if os.path.exists(path):
+            os.remove(path)
+
+    if years or removed_years:
+        ingest.ingest_events(events_dir, cache_dir, workers, years=years)
+        county, state = ingest.load_socioeconomic(
+            cache_dir, os.path.join(data_dir, ingest.GDP_FILE),
+            [os.path.join(data_dir, name) for name in ingest.POPULATION_FILES], os.path.join(data_dir, ingest.SIZE_FILE),
+        )
+        tables = update_tables(cache_dir, years + removed_years, county, state)
+    else:
+        # --retrain-all without any changed input: the current tables are used as they are
+        tables = {name: ingest.load_table(name, cache_dir) for name in TABLE_TYPES
+                  if os.path.exists(ingest.table_file(cache_dir, name))}
+    run["rebuilt_years"] = years + removed_years
+
+    for name, table in tables.items():
+        fingerprint = {"rows": len(table), "sha256": table_fingerprint(table)}
+        if manifest["tables"].get(name, {}).get("sha256") != fingerprint["sha256"]:
+            run["changed_tables"].append(name)
+        manifest["tables"][name] = fingerprint
+
+    if baseline:
+        # The shipped models were trained on the years of the first tables
+        for name, table in tables.items():
+            if os.path.exists(MODEL_FILES[TABLE_TYPES[name]]):
+                manifest["models"][TABLE_TYPES[name]] = {"mode": "baseline", "years": _years(table)}
+    if baseline and not retrain_all:
+        print("First run: inputs and tables recorded as the baseline of the current models", file=sys.stderr)
+    else:
+        for name in (TABLE_TYPES if retrain_all else run["changed_tables"]):
+            disaster_type = TABLE_TYPES[name]
+            if name not in tables:
+                print(f"{disaster_type}: no training table in {cache_dir}, skipped", file=sys.stderr)
+                continue
+            missing_files = [path for path in (MODEL_FILES[disaster_type], SCALER_FILES[disaster_type])
+                             if not os.path.exists(path)]
+            if missing_files:
+                print(f"{disaster_type}: {', '.join(missing_files)} not found, skipped", file=sys.stderr)
+                continue
+            trained_years = manifest["models"].get(disaster_type, {}).get("years")
+            summary = retrain_model(disaster_type, tables[name], trained_years, rounds, full)
+            manifest["models"][disaster_type] = dict(summary, years=_years(tables[name]))
+            run["retrained_models"].append(disaster_type)
+            if summary["held_out_rows"]:
+                print(f"{disaster_type}: held-out RMSE (log) {summary['held_out_rmse_log_before']} -> "
+                      f"{summary['held_out_rmse_log_after']} in {summary['seconds']}s", file=sys.stderr)
+            else:
+                print(f"{disaster_type}: retrained in {summary['seconds']}s, comparison {summary['comparison']}",
+                      file=sys.stderr)
+
+    manifest["inputs"] = fingerprints
+    manifest["runs"].append(run)
+    save_manifest(manifest, cache_dir)
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the training tables and the models with new input files.")
+    parser.add_argument("--events-dir", default=".", help="directory with the Events_<year>.csv files")
+    parser.add_argument("--data-dir", default=".", help="directory with the GDP, population and land area files")
+    parser.add_argument("--cache-dir", default=ingest.CACHE_DIR)
+    parser.add_argument("--rounds", type=int, default=50, help="boosting rounds (or forest trees) added per model")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes used to parse the event files")
+    parser.add_argument("--full", action="store_true",
+                        help="refit the retrained models from scratch with their hyperparameters")
+    parser.add_argument("--retrain-all", action="store_true", help="retrain every model, even if its table did not change")
+    args = parser.parse_args(argv)
+    run = refresh(args.events_dir, args.data_dir, args.cache_dir, args.rounds, args.workers, args.full, args.retrain_all)
+    print(json.dumps(run, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# These features depend on the county and not on the user inputs
+COUNTY_FEATURES = ["GDP_per_capita", "Density"]
+
+
+def build_county_matrix(encoder, scenario, cmap, varying=None):
+    """
+    Builds the feature matrix used to score every county at once.
+
+    The scenario inputs are shared by all the counties, so they are broadcast
+    to every row; only the GDP per capita and the Density are taken from the
+    columns of cmap.
+
+    Parameters:
+    - encoder: FeatureEncoder of the selected disaster type
+    - scenario: dict with the user inputs
+    - cmap: DataFrame with one row per county and the GDP_per_capita and Density columns
+    - varying: dict, feature name -> array with one value per county, for the other inputs
+      that differ between the counties (e.g. Distance_km from an event footprint)
+
+    Returns:
+    A float32 NumPy array with one row per county, in training column order.
+    """
+    county_values = {feature: cmap[feature].to_numpy(dtype=np.float32) for feature in COUNTY_FEATURES}
+    county_values.update(varying or {})
+    return encoder.encode_rows(scenario, len(cmap), county_values)
+
+
+def predict_counties(model, encoder, scenario, cmap, varying=None):
+    """
+    Predicts the property damage of every county with a single model call.
+
+    Returns:
+    A NumPy array with the predicted damage in dollars, in the row order of cmap.
+    """
+    X = build_county_matrix(encoder, scenario, cmap, varying)
+    prediction = model.predict(X)
+    return np.expm1(prediction)
+
+
+def sweep_points(grid):
+    """
+    Returns every combination of the values of grid (dict, feature name -> 1D array of values)
+    as a (points, features) array; the first feature varies the slowest.
+    """
+    mesh = np.meshgrid(*grid.values(), indexing="ij")
+    return np.stack([values.ravel() for values in mesh], axis=1)
+
+
+def predict_sweep(model, encoder, scenario, cmap, grid, max_rows=250000):
+    """
+    Predicts the property damage of every county for every point of a grid of scenario values.
+
+    The (grid points x counties) feature rows are built by the encoder in one pass, with the
+    scenario broadcast to every row, the swept features taken from the grid and the GDP per
+    capita and Density taken from cmap, and scored in blocks of at most max_rows rows.
+
+    Parameters:
+    - grid: dict, feature name -> 1D array of the values to try (one or two features)
+
+    Returns:
+    - points: (points, features) array, see sweep_points
+    - damage: (points, counties) array with the predicted damage in dollars
+    """
+    points = sweep_points(grid)
+    n_counties = len(cmap)
+    county_values = {feature: cmap[feature].to_numpy(dtype=np.float32) for feature in COUNTY_FEATURES}
+    damage = np.empty((len(points), n_counties))
+    points_per_block = max(1, max_rows // max(n_counties, 1))
+    for start in range(0, len(points), points_per_block):
+        block = points[start:start + points_per_block]
+        varying = {feature: np.tile(values, len(block)) for feature, values in county_values.items()}
+        for j, feature in enumerate(grid):
+            varying[feature] = np.repeat(block[:, j], n_counties)
+        X = encoder.encode_rows(scenario, len(block) * n_counties, varying)
+        damage[start:start + len(block)] = np.expm1(model.predict(X)).reshape(len(block), n_counties)
+    return points, damage
+
+
+# Quantiles of the uncertainty bands (an 80% band around the prediction)
+BAND_QUANTILES = (0.1, 0.9)
+
+
+def predict_bands(flat, X, quantiles=BAND_QUANTILES):
+    """
+    Quantile bands of the log damage, from the outputs of every tree of a flat model (see
+    flat_trees.py) computed in one batched pass.
+
+    For a random forest, every tree is an estimate of its own and the bands are the quantiles of
+    the tree outputs. For a boosted model the trees are corrections that add up, so the bands come
+    from the staged predictions (the sum of the first k trees) over the last half of the boosting
+    rounds: their distances to the final prediction are taken on both sides of it, since the
+    staged predictions usually approach it from one side. These bands show how much the
+    prediction still moves as trees are added, not a sampling interval.
+
+    Returns:
+    A (quantiles, rows) array in log dollars, like model.predict.
+    """
+    outputs = flat.tree_outputs(X)
+    if flat.average:
+        samples = outputs + flat.base_score
+    else:
+        staged = np.cumsum(outputs, axis=1)
+        final = staged[:, -1:]
+        moves = staged[:, staged.shape[1] // 2:] - final
+        samples = np.concatenate([final + moves, final - moves], axis=1) + flat.base_score
+    return np.quantile(samples, quantiles, axis=1)
+
+
+def predict_hazard(model, encoder, scenario, counties):
+    """
+    Predicts the property damage of every county for one disaster type, each county with its own state.
+
+    The counties of the states that the model has no column for (no recorded event of this type)
+    are masked with NaN instead of being scored.
+
+    Parameters:
+    - counties: DataFrame with the State, GDP_per_capita and Density of every county, and
+      optionally other inputs that differ between the counties (e.g. Distance_km); the counties
+      with a missing value are masked too
+
+    Returns:
+    A NumPy array with the predicted damage in dollars, NaN for the masked counties.
+    """
+    # The State_ columns of the models are title-cased, like selected_state.title() in the app
+    states = counties["State"].astype(str).str.title()
+    covered = states.isin(encoder.categories("State")).to_numpy() & counties.notna().all(axis=1).to_numpy()
+    damage = np.full(len(counties), np.nan)
+    if covered.any():
+        shared = {feature: value for feature, value in scenario.items() if feature not in counties.columns}
+        rows = counties.loc[covered].assign(State=states[covered], **shared)
+        damage[covered] = np.expm1(model.predict(encoder.encode_frame(rows)))
+    return damage
+
+
+def compare_hazards(models, encoders, scenario, counties, workers=None):
+    """
+    Scores every county with the model of every disaster type, for the same scenario.
+
+    The models run concurrently in threads: xgboost and sklearn release the GIL while they predict.
+
+    Parameters:
+    - models, encoders: dicts, disaster type -> model / FeatureEncoder
+    - counties: see predict_hazard
+
+    Returns:
+    A DataFrame with the predicted damage of every county (rows, in the order of counties) for
+    every disaster type (columns), NaN where a model does not cover the state of the county.
+    """
+    with ThreadPoolExecutor(max_workers=workers or len(models)) as pool:
+        futures = {
+            disaster_type: pool.submit(predict_hazard, model, encoders[disaster_type], scenario, counties)
+            for disaster_type, model in models.items()
+        }
+        return pd.DataFrame({disaster_type: future.result() for disaster_type, future in futures.items()},
+                            index=counties.index)
@@ -0,0 +1,331 @@
+"""
+HTTP prediction service for the damage models.
+
+Endpoints:
+- POST /predict: one scenario (same fields as a row of batch_predict.py), returns its predicted damage
+- POST /predict/counties: one scenario, returns the predicted damage of every county of cmap.csv
+- GET /metrics: request latency percentiles and micro-batching counters
+
+Concurrent requests for the same disaster type are coalesced into a single model call: the first
+request opens a short window (--window-ms) and every request arriving in it joins the batch.
+The small batches are scored with the flat .npz models exported by flat_trees.py, which predict
+a few rows faster than xgboost, and the larger ones with the original models (--native-models
+always uses the original models).
+
+A malformed scenario is answered with 400 (body that is not a JSON object, Year missing, a field
+of the wrong type) or 422 (negative or non-finite value, no county data, State not covered by the
+model), an unknown disaster type with 404, and a disaster type whose model files are missing
+with 503.
+
+Example:
+    python service.py --port 8000 --window-ms 5 --max-concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import math
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tornado.web
+
+from batch_predict import INVALID_YEAR, get_county_lookup, prepare_scenarios
+from county_tables import load_county_table
+from features import CATEGORICAL, FEATURE_FILES, load_encoder
+from model_registry import get_model, registry
+from scoring import build_county_matrix
+
+
+class MicroBatcher:
+    """
+    Collects the feature matrices of concurrent requests and scores them with one predict call.
+
+    Parameters:
+    - disaster_type: str, model used for the batches
+    - executor: thread pool running the model calls (tree inference releases the GIL)
+    - window: float, seconds to wait for other requests after the first one of a batch
+    - max_rows: int, the batch is sent straight away when it reaches this many rows
+    """
+
+    def __init__(self, disaster_type, executor, window=0.005, max_rows=100000):
+        self.disaster_type = disaster_type
+        self.executor = executor
+        self.window = window
+        self.max_rows = max_rows
+        self.batches = 0
+        self.requests = 0
+        self._pending = []
+        self._rows = 0
+        self._timer = None
+
+    async def predict(self, X):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((X, future))
+        self._rows += len(X)
+        if self._rows >= self.max_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._rows = self._pending, [], 0
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    def _predict(self, X):
+        return get_model(self.disaster_type).predict(X)
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.requests += len(batch)
+        try:
+            X = np.concatenate([x for x, _ in batch])
+            prediction = await asyncio.get_running_loop().run_in_executor(self.executor, self._predict, X)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        ends = np.cumsum([len(x) for x, _ in batch])
+        for (_, future), part in zip(batch, np.split(prediction, ends[:-1])):
+            if not future.cancelled():
+                future.set_result(part)
+
+
+class Metrics:
+    """Latencies of the most recent requests of each endpoint."""
+
+    def __init__(self, size=10000):
+        self.latencies = defaultdict(lambda: deque(maxlen=size))
+        self.counts = defaultdict(int)
+
+    def record(self, endpoint, seconds):
+        self.latencies[endpoint].append(seconds)
+        self.counts[endpoint] += 1
+
+    def summary(self):
+        summary = {}
+        for endpoint, latencies in self.latencies.items():
+            p50, p90, p99 = np.percentile(np.array(latencies) * 1000, [50, 90, 99])
+            summary[endpoint] = {"requests": self.counts[endpoint], "p50_ms": p50, "p90_ms": p90, "p99_ms": p99}
+        return summary
+
+
+def check_fields(record, encoder):
+    """
+    Checks the types and the ranges of the fields of a scenario before it is encoded.
+
+    Parameters:
+    - record: dict, scenario of a request
+    - encoder: FeatureEncoder of its disaster type
+
+    Returns:
+    (status, message) of the first invalid field, None when they are all valid.
+    """
+    for feature, value in record.items():
+        if value is None or feature == "disaster_type":
+            continue
+        if feature in ("State", "County", *CATEGORICAL):
+            if not isinstance(value, str):
+                return 400, f"{feature} must be a string"
+        elif feature in encoder.index:
+            # Every numeric feature of the models is a year, a count, a duration or a size
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return 400, f"{feature} must be a number"
+            if not math.isfinite(value) or value < 0:
+                return 422, f"{feature} must be a finite number, at least 0"
+            if feature == "Year" and value != int(value):
+                return 400, "Year must be a whole number"
+        elif isinstance(value, (list, dict)):
+            # Ignored by the models, but not a value of a scenario
+            return 400, f"{feature} must be a number or a string"
+    return None
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def on_finish(self):
+        self.service.metrics.record(self.request.path, self.request.request_time())
+
+    def error(self, status, message):
+        self.set_status(status)
+        self.finish({"error": message})
+
+    def scenario(self, county_values=True):
+        """
+        Parses the scenario of the request body, or answers with an error and returns None.
+
+        With county_values, the scenario must have a GDP per capita and a Density, given or
+        looked up with its County; the county predictions take them from cmap.csv instead.
+        """
+        try:
+            record = json.loads(self.request.body)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            self.error(400, "The body must be a JSON object")
+            return None
+        if not isinstance(record.get("disaster_type"), str) or record["disaster_type"] not in FEATURE_FILES:
+            self.error(404, f"Unknown disaster_type, it must be one of {list(FEATURE_FILES)}")
+            return None
+        try:
+            encoder = load_encoder(record["disaster_type"])
+        except OSError:
+            self.error(503, f"The {record['disaster_type']} model is not available")
+            return None
+        invalid = check_fields(record, encoder)
+        if invalid is not None:
+            self.error(*invalid)
+            return None
+        scenarios, reasons = prepare_scenarios([record], self.service.county_file)
+        scenario, reason = scenarios[0], reasons[0]
+        if reason == INVALID_YEAR:
+            self.error(400, "The scenario needs at least the State and the Year")
+            return None
+        if reason is not None and county_values:
+            # Predicting without GDP per capita and Density would score them as 0
+            self.error(422, f"There is no GDP per capita and Density for {record.get('County')}, "
+                            f"{record.get('State')} in {scenario['Year']}: send them with the scenario")
+            return None
+        if not encoder.covers("State", scenario["State"]):
+            self.error(422, f"There have not been any recorded {scenario['disaster_type'].lower()} "
+                            f"in the State of {record.get('State')} since 2007")
+            return None
+        return scenario
+
+    async def predict(self, disaster_type, X):
+        """Scores X with the micro-batcher of the disaster type, or answers 503 and returns None."""
+        try:
+            return await self.service.batcher(disaster_type).predict(X)
+        except OSError:
+            # The model file is missing or unreadable
+            self.error(503, f"The {disaster_type} model is not available")
+            return None
+
+
+class PredictHandler(BaseHandler):
+    async def post(self):
+        async with self.service.limit:
+            scenario = self.scenario()
+            if scenario is None:
+                return
+            disaster_type = scenario["disaster_type"]
+            X = load_encoder(disaster_type).encode(scenario)[np.newaxis, :]
+            prediction = await self.predict(disaster_type, X)
+            if prediction is None:
+                return
+            self.finish({"disaster_type": disaster_type, "predicted_damage": float(np.expm1(prediction[0]))})
+
+
+class CountiesHandler(BaseHandler):
+    async def post(self):
+        async with self.service.limit:
+            scenario = self.scenario(county_values=False)
+            if scenario is None:
+                return
+            disaster_type = scenario["disaster_type"]
+            X = build_county_matrix(load_encoder(disaster_type), scenario, self.service.cmap)
+            prediction = await self.predict(disaster_type, X)
+            if prediction is None:
+                return
+            self.finish({
+                "disaster_type": disaster_type,
+                "GEOID": self.service.cmap["GEOID"].tolist(),
+                "predicted_damage": np.expm1(prediction).tolist(),
+            })
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.finish({
+            "latency": self.service.metrics.summary(),
+            "batching": {
+                disaster_type: {"batches": batcher.batches, "requests": batcher.requests}
+                for disaster_type, batcher in self.service.batchers.items()
+            },
+        })
+
+    def on_finish(self):
+        pass
+
+
+class PredictionService:
+    """
+    Shared state of the service: county data, micro-batchers and metrics.
+
+    Parameters:
+    - window_ms: float, micro-batching window
+    - max_batch_rows: int, largest batch sent to a model
+    - max_concurrency: int, requests processed at the same time (the others wait)
+    - threads: int, model calls running at the same time
+    - flat_models: bool, serve the flat models where they were exported (see flat_trees.py)
+    """
+
+    def __init__(self, cmap_file="cmap.csv", county_file="merged_data_county.csv", window_ms=5,
+                 max_batch_rows=100000, max_concurrency=64, threads=4, flat_models=True):
+        registry.prefer_flat = flat_models
+        # Memory-mapped compact county table, shared with the other processes of the node
+        self.cmap = load_county_table(cmap_file)
+        self.county_file = county_file
+        # Loaded now rather than by the first requests, which would block the event loop
+        get_county_lookup(county_file)
+        for disaster_type in FEATURE_FILES:
+            try:
+                load_encoder(disaster_type)
+            except OSError:
+                pass  # answered with 503
+        self.window = window_ms / 1000
+        self.max_batch_rows = max_batch_rows
+        self.limit = asyncio.Semaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.metrics = Metrics()
+        self.batchers = {}
+
+    def batcher(self, disaster_type):
+        if disaster_type not in self.batchers:
+            self.batchers[disaster_type] = MicroBatcher(disaster_type, self.executor, self.window, self.max_batch_rows)
+        return self.batchers[disaster_type]
+
+    def application(self):
+        return tornado.web.Application([
+            (r"/predict", PredictHandler, {"service": self}),
+            (r"/predict/counties", CountiesHandler, {"service": self}),
+            (r"/metrics", MetricsHandler, {"service": self}),
+        ])
+
+
+async def serve(port, **options):
+    service = PredictionService(**options)
+    service.application().listen(port)
+    print(f"Serving predictions on http://localhost:{port}")
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP prediction service for the damage models.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--window-ms", type=float, default=5, help="micro-batching window")
+    parser.add_argument("--max-batch-rows", type=int, default=100000, help="largest batch sent to a model")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="requests processed at the same time")
+    parser.add_argument("--threads", type=int, default=4, help="model calls running at the same time")
+    parser.add_argument("--cmap-file", default="cmap.csv")
+    parser.add_argument("--county-file", default="merged_data_county.csv")
+    parser.add_argument("--native-models", action="store_true",
+                        help="always score with the pickled models instead of their flat .npz exports")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(
+        args.port, cmap_file=args.cmap_file, county_file=args.county_file, window_ms=args.window_ms,
+        max_batch_rows=args.max_batch_rows, max_concurrency=args.max_concurrency, threads=args.threads,
+        flat_models=not args.native_models,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import pathlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the app live at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Counties of the small county tables written by the county_files fixture
+COUNTIES = [(48201, "Texas", "Harris", 48), (48113, "Texas", "Dallas", 48), (20173, "Kansas", "Sedgwick", 20)]
+YEARS = range(2018, 2023)
+
+
+def write_county_files(directory):
+    """
+    Writes a small cmap.csv and merged_data_county.csv in directory, like the ones of the app:
+    GDP per capita 1000 * GEOID % 100 + year, Density GEOID % 1000 + year, no GDP for Dallas in
+    2020 and a row without GEOID.
+
+    Returns:
+    (path of the cmap.csv, path of the merged_data_county.csv)
+    """
+    directory = pathlib.Path(directory)
+    rows = [(geoid, year, geoid % 1000 + year, county, 1000 * (geoid % 100) + year, statefp, state)
+            for geoid, state, county, statefp in COUNTIES for year in YEARS]
+    values = pd.DataFrame(rows, columns=["GEOID", "Year", "Density", "County", "GDP_per_capita", "STATE", "State"])
+    values.loc[(values["County"] == "Dallas") & (values["Year"] == 2020), "GDP_per_capita"] = np.nan
+    values.loc[len(values)] = [np.nan, 2020, 1.0, "Nowhere", 1.0, 48, "Texas"]
+    county_file = directory / "merged_data_county.csv"
+    values.to_csv(county_file, index=False)
+
+    cmap = pd.DataFrame({
+        "GEOID": [geoid for geoid, _, _, _ in COUNTIES],
+        "NAME": [county for _, _, county, _ in COUNTIES],
+        "STATEFP": [statefp for _, _, _, statefp in COUNTIES],
+        "GDP_per_capita": [50000.0, 60000.0, 40000.0],
+        "Density": [1000.0, 1500.0, 300.0],
+        "geometry": ["POINT (0 0)"] * len(COUNTIES),
+    })
+    cmap_file = directory / "cmap.csv"
+    cmap.to_csv(cmap_file, index=False)
+    return str(cmap_file), str(county_file)
+
+
+@pytest.fixture
+def county_files(tmp_path):
+    """The county tables of write_county_files, in tmp_path."""
+    return write_county_files(tmp_path)
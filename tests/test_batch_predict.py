@@ -0,0 +1,93 @@
+"""
+Scenario preparation and the "reason" column of batch scoring (batch_predict.py).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch_predict import INVALID_YEAR, NO_COUNTY_DATA, prepare_scenarios, run, score_chunk
+from conftest import ROOT
+from model_registry import MODEL_FILES
+
+pytestmark = pytest.mark.skipif(not os.path.exists(os.path.join(ROOT, MODEL_FILES["Lightning"])),
+                                reason="the Lightning model is not shipped")
+
+
+@pytest.fixture(autouse=True)
+def in_repository(monkeypatch):
+    # The feature schemas and the models are read from the root of the repository
+    monkeypatch.chdir(ROOT)
+
+
+def scenario(**fields):
+    return dict({"disaster_type": "Lightning", "State": "Texas", "County": "Harris", "Year": 2020,
+                 "DURATION_HOURS": 2.0}, **fields)
+
+
+def test_prepare_scenarios(county_files):
+    _, county_file = county_files
+    scenarios, reasons = prepare_scenarios([
+        scenario(),
+        scenario(County="Dallas"),
+        scenario(County="Nowhere", GDP_per_capita=1.0, Density=2.0),
+        scenario(Year=np.nan),
+        scenario(Year="next year"),
+        scenario(DEATHS_DIRECT=np.nan),
+        scenario(State="kansas", GDP_per_capita=1.0, Density=2.0),
+    ], county_file)
+    assert reasons == [None, NO_COUNTY_DATA, None, INVALID_YEAR, INVALID_YEAR, None, None]
+    assert scenarios[0]["GDP_per_capita"] == 1000 + 2020 and scenarios[0]["Density"] == 201 + 2020
+    # Values sent with the scenario are kept
+    assert scenarios[2]["GDP_per_capita"] == 1.0 and scenarios[2]["Density"] == 2.0
+    # Empty values are dropped, the encoder leaves them at 0
+    assert "DEATHS_DIRECT" not in scenarios[5]
+    # The state is written like the State_ columns of the models
+    assert scenarios[6]["State"] == "Kansas"
+
+
+def test_reason_column(county_files):
+    _, county_file = county_files
+    rows = [
+        scenario(),
+        scenario(County="Dallas"),
+        scenario(Year=None),
+        scenario(State="Alaska", GDP_per_capita=50000.0, Density=1.0),
+        scenario(disaster_type="Hail"),
+    ]
+    chunk = pd.DataFrame(rows, index=pd.RangeIndex(100, 100 + len(rows)))
+    result = score_chunk(chunk, county_file)
+
+    assert result["row"].tolist() == list(range(100, 105))
+    assert result["reason"].dtype == pd.StringDtype()
+    assert result["reason"].tolist()[1:] == [NO_COUNTY_DATA, INVALID_YEAR, "no recorded Lightning in this State",
+                                             "unknown disaster type"]
+    assert pd.isna(result["reason"][0]) and result["predicted_damage"][0] > 0
+    assert result["predicted_damage"][1:].isna().all()
+
+
+def test_a_missing_model_file_is_a_reason(county_files, monkeypatch):
+    import model_registry
+
+    monkeypatch.setitem(model_registry.registry.model_files, "Tornado", "missing_tornado_model.pkl")
+    result = score_chunk(pd.DataFrame([scenario(disaster_type="Tornado"), scenario()]), county_files[1])
+    assert result["reason"].tolist()[0] == "no model file"
+    assert pd.isna(result["reason"][1])
+
+
+def test_run_keeps_the_input_order(county_files, tmp_path):
+    _, county_file = county_files
+    rows = [scenario(Year=2018 + i % 5, County=["Harris", "Dallas"][i % 2]) for i in range(30)]
+    rows[7] = scenario(disaster_type="Hail")
+    input_file = tmp_path / "scenarios.jsonl"
+    pd.DataFrame(rows).to_json(input_file, orient="records", lines=True)
+
+    assert run(str(input_file), str(tmp_path / "out.csv"), chunksize=8, workers=2, county_file=county_file) == 30
+    result = pd.read_csv(tmp_path / "out.csv")
+    assert result["row"].tolist() == list(range(30))
+    assert result["reason"][7] == "unknown disaster type"
+    # Dallas has no GDP per capita in 2020 only
+    no_data = [i for i, row in enumerate(rows) if row["County"] == "Dallas" and row["Year"] == 2020 and i != 7]
+    assert result["reason"][no_data].eq(NO_COUNTY_DATA).all()
+    assert result["predicted_damage"].notna().sum() == 30 - 1 - len(no_data)
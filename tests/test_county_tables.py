@@ -0,0 +1,96 @@
+"""
+The county lookup (county_lookup.py) and the compact Arrow copies of the county tables
+(county_tables.py).
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import pytest
+
+from conftest import COUNTIES, YEARS
+from county_lookup import CountyLookup
+from county_tables import (COUNTY_TABLE_TYPES, COUNTY_VALUES_TYPES, compact_file, load_county_lookup,
+                           load_county_table)
+
+
+@pytest.fixture
+def lookup(county_files):
+    return CountyLookup.from_csv(county_files[1])
+
+
+def test_lookup_by_name_and_year(lookup):
+    assert lookup.lookup("Texas", "Harris", 2019) == (1000 + 2019, 201 + 2019)
+    assert lookup.lookup("Kansas", "Sedgwick", 2022) == (73000 + 2022, 173 + 2022)
+
+
+def test_lookup_without_data(lookup):
+    assert lookup.lookup("Texas", "Dallas", 2020) is None  # no GDP per capita that year
+    assert lookup.lookup("Texas", "Dallas", 2021) is not None
+    assert lookup.lookup("Texas", "Harris", min(YEARS) - 1) is None
+    assert lookup.lookup("Texas", "Harris", max(YEARS) + 1) is None
+    assert lookup.lookup("texas", "Harris", 2020) is None
+    assert lookup.lookup("Texas", "Nowhere", 2020) is None  # its row has no GEOID
+
+
+def test_dropdown_options(lookup):
+    assert lookup.state_options == ["Kansas", "Texas"]
+    assert lookup.counties("Texas") == ["Dallas", "Harris"]
+    assert lookup.counties("Ohio") == []
+
+
+def test_values_of_many_counties(lookup):
+    gdp, density = lookup.year_values(2020, [48201, 99999, 48113])
+    assert gdp[0] == 1000 + 2020 and np.isnan(gdp[1]) and np.isnan(gdp[2])
+    assert density[0] == 201 + 2020 and np.isnan(density[1]) and density[2] == 113 + 2020
+    gdp, _ = lookup.year_values(1990)
+    assert len(gdp) == len(COUNTIES) and np.isnan(gdp).all()
+    states = lookup.states([20173, 48201, 1])
+    assert states[:2].tolist() == ["Kansas", "Texas"] and pd.isna(states[2])
+
+
+def test_compact_lookup_answers_like_the_csv(county_files, lookup):
+    compact = load_county_lookup(county_files[1])
+    for _, state, county, _ in COUNTIES:
+        for year in YEARS:
+            expected, actual = lookup.lookup(state, county, year), compact.lookup(state, county, year)
+            if expected is None:
+                assert actual is None
+            else:
+                assert actual == pytest.approx(expected, rel=1e-6)
+    assert compact.state_options == lookup.state_options
+
+
+def test_compact_tables_have_small_types(county_files):
+    cmap_file, county_file = county_files
+    table = load_county_table(cmap_file)
+    assert list(table.columns) == list(COUNTY_TABLE_TYPES)
+    assert table["GEOID"].dtype == np.int32 and table["Density"].dtype == np.float32
+    assert isinstance(table["NAME"].dtype, pd.CategoricalDtype)
+    assert table["GEOID"].tolist() == [geoid for geoid, _, _, _ in COUNTIES]
+
+    load_county_lookup(county_file)
+    values = feather.read_table(compact_file(county_file, "merged_data_county.csv", "county_values.arrow"))
+    assert values.schema.names == list(COUNTY_VALUES_TYPES)
+    assert values.num_rows == len(COUNTIES) * len(YEARS)  # the row without GEOID is dropped
+
+
+def test_each_csv_file_gets_its_own_compact_file(tmp_path):
+    assert compact_file("merged_data_county.csv", "merged_data_county.csv", "county_values.arrow") == "county_values.arrow"
+    assert compact_file(str(tmp_path / "other.csv"), "merged_data_county.csv", "county_values.arrow") == \
+        str(tmp_path / "other.arrow")
+
+
+def test_compact_file_is_rebuilt_when_the_csv_changes(county_files):
+    _, county_file = county_files
+    assert load_county_lookup(county_file).lookup("Texas", "Harris", 2019) is not None
+
+    values = pd.read_csv(county_file)
+    values.loc[values["County"] == "Harris", "GDP_per_capita"] = 5.0
+    values.to_csv(county_file, index=False)
+    later = time.time() + 10
+    os.utime(county_file, (later, later))
+    assert load_county_lookup(county_file).lookup("Texas", "Harris", 2019)[0] == 5.0
+    assert not [name for name in os.listdir(os.path.dirname(county_file)) if name.endswith(".tmp")]
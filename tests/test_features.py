@@ -0,0 +1,100 @@
+"""
+Column alignment of the feature encoder (features.py): every scenario is encoded in the training
+column order of its model, whatever the order and the extra fields of the scenario.
+"""
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT
+from features import FEATURE_FILES, FeatureEncoder
+
+COLUMNS = ["Year", "DURATION_HOURS", "Density", "State_Kansas", "State_Texas", "TOR_F_SCALE_EF1", "TOR_F_SCALE_EF2"]
+
+
+@pytest.fixture
+def encoder():
+    return FeatureEncoder(COLUMNS)
+
+
+def test_numeric_and_categorical_features_land_in_their_columns(encoder):
+    x = encoder.encode({"State": "Texas", "Density": 12.5, "Year": 2020, "TOR_F_SCALE": "EF2", "DURATION_HOURS": 3})
+    assert x.dtype == np.float32
+    assert x.tolist() == [2020, 3, 12.5, 0, 1, 0, 1]
+
+
+def test_unknown_features_are_ignored_and_missing_ones_are_zero(encoder):
+    x = encoder.encode({"State": "Ohio", "Year": 2010, "MAGNITUDE": 50, "County": "Harris"})
+    # Ohio is the dropped category of the one-hot columns, or a state the model never saw
+    assert x.tolist() == [2010, 0, 0, 0, 0, 0, 0]
+
+
+def test_a_reused_buffer_is_cleared(encoder):
+    out = np.full(len(COLUMNS), 7, dtype=np.float32)
+    encoder.encode({"State": "Kansas", "Year": 2000}, out=out)
+    assert out.tolist() == [2000, 0, 0, 1, 0, 0, 0]
+    encoder.encode({"Year": 2001}, out=out)
+    assert out.tolist() == [2001, 0, 0, 0, 0, 0, 0]
+
+
+def test_batch_rows_and_frame_encodings_agree(encoder):
+    scenarios = [
+        {"State": "Texas", "Year": 2020, "DURATION_HOURS": 1.5, "TOR_F_SCALE": "EF1"},
+        {"State": "Kansas", "Year": 2015, "Density": 40.0},
+    ]
+    batch = encoder.encode_batch(scenarios)
+    assert np.array_equal(batch, np.stack([encoder.encode(scenario) for scenario in scenarios]))
+    frame = encoder.encode_frame(pd.DataFrame(scenarios))
+    assert np.array_equal(np.nan_to_num(frame), batch)
+
+    rows = encoder.encode_rows(scenarios[0], 3, varying={"Density": np.array([1.0, 2.0, 3.0]), "County": [1, 2, 3]})
+    assert rows.shape == (3, len(COLUMNS))
+    assert rows[:, COLUMNS.index("Density")].tolist() == [1, 2, 3]
+    assert np.array_equal(np.delete(rows, COLUMNS.index("Density"), axis=1),
+                          np.delete(np.repeat(batch[:1], 3, axis=0), COLUMNS.index("Density"), axis=1))
+
+
+def test_scaler_is_applied_per_column():
+    mean = np.arange(len(COLUMNS), dtype=np.float32)
+    scale = np.full(len(COLUMNS), 2, dtype=np.float32)
+    x = FeatureEncoder(COLUMNS, mean, scale).encode({"Year": 2020, "State": "Texas"})
+    raw = FeatureEncoder(COLUMNS).encode({"Year": 2020, "State": "Texas"})
+    assert np.allclose(x, (raw - mean) / scale)
+
+
+def test_categories_and_coverage(encoder):
+    assert encoder.categories("State") == ["Kansas", "Texas"]
+    assert encoder.categories("TOR_F_SCALE") == ["EF1", "EF2"]
+    assert encoder.covers("State", "Texas")
+    assert not encoder.covers("State", "texas")
+
+
+@pytest.mark.parametrize("disaster_type", list(FEATURE_FILES))
+def test_shipped_schemas_keep_the_file_order(disaster_type, tmp_path):
+    features_file = os.path.join(ROOT, FEATURE_FILES[disaster_type])
+    with open(features_file) as f:
+        columns = [line.rstrip("\n") for line in f if line.strip()]
+    encoder = FeatureEncoder.from_schema(features_file, str(tmp_path / "missing_scaler.pkl"))
+    assert encoder.columns == columns
+    assert encoder.mean is None  # no scaler file, the values are left as they are
+    x = encoder.encode({"Year": 2020, "DURATION_HOURS": 2})
+    assert x[columns.index("Year")] == 2020 and x[columns.index("DURATION_HOURS")] == 2
+    assert np.count_nonzero(x) == 2
+
+
+def test_from_schema_loads_the_scaler(tmp_path):
+    from sklearn.preprocessing import StandardScaler
+
+    features_file = tmp_path / "features.txt"
+    features_file.write_text("\n".join(COLUMNS) + "\n")
+    data = np.random.default_rng(0).normal(loc=5, size=(50, len(COLUMNS)))
+    scaler = StandardScaler().fit(data)
+    joblib.dump(scaler, tmp_path / "scaler.pkl")
+
+    encoder = FeatureEncoder.from_schema(str(features_file), str(tmp_path / "scaler.pkl"))
+    scenario = {"Year": 2020, "DURATION_HOURS": 4, "State": "Kansas"}
+    raw = FeatureEncoder(COLUMNS).encode(scenario)
+    assert np.allclose(encoder.encode(scenario), scaler.transform(raw[np.newaxis, :])[0], atol=1e-4)
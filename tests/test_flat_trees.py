@@ -0,0 +1,101 @@
+"""
+Prediction parity of the flat models (flat_trees.py) with the pickled models they are exported
+from, on every shipped pickle and on a small random forest fitted here.
+"""
+import os
+import shutil
+
+import joblib
+import numpy as np
+import pytest
+
+from conftest import ROOT
+from flat_trees import FLAT_MAX_ROWS, FlatEnsemble, FlatModel, export_model, flat_file, model_inputs, parity_inputs
+from model_registry import MODEL_FILES, ModelRegistry
+
+SHIPPED = [disaster_type for disaster_type, path in MODEL_FILES.items() if os.path.exists(os.path.join(ROOT, path))]
+RANDOM_FOREST = "random forest"
+
+
+def fit_random_forest(model_file):
+    """Fits a small sklearn random forest on random data and pickles it, like the notebook does."""
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 12)).astype(np.float32)
+    y = 3 * X[:, 0] + np.sin(X[:, 1]) + (X[:, 2] > 0.5) + rng.normal(scale=0.1, size=len(X))
+    joblib.dump(RandomForestRegressor(n_estimators=25, max_depth=8, random_state=0).fit(X, y), model_file)
+
+
+@pytest.fixture(scope="module", params=[*SHIPPED, RANDOM_FOREST])
+def exported(request, tmp_path_factory):
+    """(original model, flat model exported from a copy of its pickle, path of the copy)"""
+    directory = tmp_path_factory.mktemp("models")
+    if request.param == RANDOM_FOREST:
+        model_file = str(directory / "random_forest_model.pkl")
+        fit_random_forest(model_file)
+    else:
+        model_file = str(directory / MODEL_FILES[request.param])
+        shutil.copy(os.path.join(ROOT, MODEL_FILES[request.param]), model_file)
+    export_model(model_file)
+    return joblib.load(model_file), FlatEnsemble.load(flat_file(model_file)), model_file
+
+
+def expected(model, X):
+    return np.asarray(model.predict(X), dtype=np.float64)
+
+
+def edge_cases(flat, n_features):
+    """Rows on every threshold of the model, and rows of missing, zero and extreme values."""
+    splits = flat.child >= 0
+    rows = []
+    for feature in range(n_features):
+        thresholds = np.unique(flat.threshold[splits & (flat.feature == feature)])
+        block = np.zeros((len(thresholds), n_features), dtype=np.float32)
+        block[:, feature] = thresholds
+        rows.append(block)
+    special = np.array([np.nan, 0.0, -0.0, 1e30, -1e30, np.finfo(np.float32).max], dtype=np.float32)
+    rows.append(np.repeat(special[:, None], n_features, axis=1))
+    rows.append(np.full((1, n_features), np.nan, dtype=np.float32))
+    return np.concatenate(rows)
+
+
+def test_random_inputs(exported):
+    model, flat, _ = exported
+    X = np.random.default_rng(1).normal(scale=3, size=(5000, model.n_features_in_)).astype(np.float32)
+    assert np.allclose(flat.predict(X), expected(model, X), rtol=1e-5, atol=1e-4)
+
+
+def test_threshold_and_missing_inputs(exported):
+    model, flat, _ = exported
+    X = parity_inputs(flat, model.n_features_in_, n_rows=5000, seed=2)
+    assert np.isnan(X).any()
+    X = model_inputs(model, X)
+    assert np.allclose(flat.predict(X), expected(model, X), rtol=1e-5, atol=1e-4)
+
+
+def test_edge_cases(exported):
+    model, flat, _ = exported
+    X = model_inputs(model, edge_cases(flat, model.n_features_in_))
+    assert np.allclose(flat.predict(X), expected(model, X), rtol=1e-5, atol=1e-4)
+
+
+def test_tree_outputs_add_up_to_the_prediction(exported):
+    model, flat, _ = exported
+    X = model_inputs(model, parity_inputs(flat, model.n_features_in_, n_rows=500, seed=3))
+    assert flat.tree_outputs(X).shape == (len(X), flat.n_trees)
+    assert np.allclose(flat.aggregate(flat.tree_outputs(X)), expected(model, X), rtol=1e-5, atol=1e-4)
+
+
+def test_registry_routes_batches_to_the_original_model(exported):
+    model, flat, model_file = exported
+    served = ModelRegistry({"model": model_file}, prefer_flat=True).get("model")
+    assert isinstance(served, FlatModel)
+
+    single = model_inputs(model, parity_inputs(flat, model.n_features_in_, n_rows=FLAT_MAX_ROWS, seed=4))
+    assert np.allclose(served.predict(single), expected(model, single), rtol=1e-5, atol=1e-4)
+    assert served._native is None  # the pickle is not loaded for the small requests
+
+    batch = model_inputs(model, parity_inputs(flat, model.n_features_in_, n_rows=2000, seed=5))
+    assert np.allclose(served.predict(batch), expected(model, batch), rtol=1e-5, atol=1e-4)
+    assert served._native is not None
@@ -0,0 +1,93 @@
+"""
+Distances of the counties to an event footprint (footprint.py), on a grid of square counties.
+"""
+import json
+
+import numpy as np
+import pytest
+import shapely
+
+from footprint import KM_PER_DEGREE, Footprint
+from geometry_store import GeometryStore, build_geometry_store
+
+# 10 x 10 counties of 0.5 x 0.5 degrees, from longitude -100 and latitude 60 (far north, where a
+# degree of longitude is half a degree of latitude)
+SIZE, ORIGIN = 0.5, (-100.0, 60.0)
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("counties")
+    features = []
+    for i in range(10):
+        for j in range(10):
+            x, y = ORIGIN[0] + i * SIZE, ORIGIN[1] + j * SIZE
+            square = shapely.box(x, y, x + SIZE, y + SIZE)
+            features.append({"type": "Feature", "geometry": json.loads(shapely.to_geojson(square)),
+                             "properties": {"GEOID": str(1000 + 10 * i + j), "NAME": f"County {i} {j}", "STATEFP": "2"}})
+    geojson_file = directory / "counties.geojson"
+    geojson_file.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    return GeometryStore.load(build_geometry_store(str(geojson_file), str(directory / "store.parquet"), tolerances=()))
+
+
+def test_distance_of_a_point_to_a_county():
+    county = shapely.box(0, 0, 1, 1)
+    footprint = Footprint.from_point(lat=0.5, lon=-1, radius_km=0)
+    # One degree of longitude west of the county, at the equator
+    assert footprint.distances_km(np.array([county]))[0] == pytest.approx(KM_PER_DEGREE, rel=1e-3)
+    with_radius = Footprint.from_point(lat=0.5, lon=-1, radius_km=10)
+    assert with_radius.distances_km(np.array([county]))[0] == pytest.approx(KM_PER_DEGREE - 10, rel=1e-3)
+
+
+def test_longitude_degrees_shrink_with_the_latitude():
+    footprint = Footprint.from_point(lat=60, lon=-1, radius_km=0)
+    county = shapely.box(0, 59.5, 1, 60.5)
+    assert footprint.distances_km(np.array([county]))[0] == pytest.approx(KM_PER_DEGREE / 2, rel=1e-2)
+
+
+def test_touched_counties_are_at_zero():
+    track = shapely.LineString([(0.5, -1), (0.5, 2)])
+    distances = Footprint(track).distances_km(np.array([shapely.box(0, 0, 1, 1), shapely.box(0, 3, 1, 4)]))
+    assert distances[0] == 0
+    assert distances[1] == pytest.approx(KM_PER_DEGREE, rel=1e-2)
+
+
+def test_geojson_circles_and_collections():
+    circle = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [0, 0]}, "properties": {"radius": 20000}}
+    footprint = Footprint.from_geojson(json.dumps(circle))
+    county = shapely.box(1, -0.5, 2, 0.5)
+    assert footprint.distances_km(np.array([county]))[0] == pytest.approx(KM_PER_DEGREE - 20, rel=1e-2)
+
+    line = {"type": "LineString", "coordinates": [[3, 0], [3, 1]]}
+    merged = Footprint.from_geojson({"type": "FeatureCollection", "features": [circle, {"type": "Feature", "geometry": line}]})
+    # The nearest shape of the collection counts
+    near_the_line = shapely.box(3.5, 0, 4, 1)
+    distances = merged.distances_km(np.array([county, near_the_line]))
+    assert distances == pytest.approx([KM_PER_DEGREE - 20, KM_PER_DEGREE / 2], rel=1e-2)
+
+
+def test_empty_footprints_are_rejected():
+    with pytest.raises(ValueError):
+        Footprint.from_geojson({"type": "FeatureCollection", "features": []})
+    with pytest.raises(ValueError):
+        Footprint(shapely.LineString())
+
+
+@pytest.mark.parametrize("max_distance_km", [0, 30, 100, 250])
+def test_affected_counties_match_a_full_scan(store, max_distance_km):
+    footprint = Footprint.from_point(lat=62.3, lon=-97.6, radius_km=15)
+    rows, distances = footprint.affected(store, max_distance_km)
+    all_distances = footprint.distances_km(store.geometries())
+    expected = np.flatnonzero(all_distances <= max_distance_km)
+    assert sorted(rows.tolist()) == expected.tolist()
+    assert np.allclose(distances, all_distances[rows])
+    assert (distances <= max_distance_km).all()
+
+
+def test_county_distances_by_geoid(store):
+    footprint = Footprint.from_point(lat=60.25, lon=-99.75, radius_km=0)  # centre of county 1000
+    distances = footprint.county_distances(store, [1000, 1001, 1099, 5], max_distance_km=60)
+    assert distances[0] == 0
+    assert distances[1] == pytest.approx(0.25 * KM_PER_DEGREE, rel=1e-2)  # the next county to the north
+    assert np.isnan(distances[2])  # farther than max_distance_km
+    assert np.isnan(distances[3])  # unknown GEOID
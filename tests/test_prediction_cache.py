@@ -0,0 +1,77 @@
+"""
+LRU order, byte budget and sizing of the prediction cache (prediction_cache.py).
+"""
+import numpy as np
+import pytest
+
+from prediction_cache import PredictionCache
+
+
+def key(n):
+    return PredictionCache.key("Tornado", np.full(4, n), 2020)
+
+
+def test_key_depends_on_the_type_the_year_and_the_features():
+    features = np.array([1.0, 2.0, 3.0])
+    assert PredictionCache.key("Tornado", features, 2020) == PredictionCache.key("Tornado", features.tolist(), 2020.0)
+    assert PredictionCache.key("Tornado", features, 2020) != PredictionCache.key("Flood", features, 2020)
+    assert PredictionCache.key("Tornado", features, 2020) != PredictionCache.key("Tornado", features, 2021)
+    assert PredictionCache.key("Tornado", features, 2020) != PredictionCache.key("Tornado", features + 1, 2020)
+
+
+def test_results_of_an_entry_are_cached_separately():
+    cache = PredictionCache()
+    cache.put(key(1), "prediction", 12.5)
+    assert cache.get(key(1), "prediction") == 12.5
+    assert cache.get(key(1), "county_damage") is None
+    cache.put(key(1), "county_damage", np.ones(10))
+    assert cache.get(key(1), "prediction") == 12.5
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    value = np.zeros(100)  # 800 bytes
+    cache = PredictionCache(max_bytes=3 * value.nbytes)
+    for n in range(3):
+        cache.put(key(n), "county_damage", value)
+    cache.get(key(0), "county_damage")  # 0 becomes the most recently used
+    cache.put(key(3), "county_damage", value)
+    assert cache.get(key(1), "county_damage") is None
+    assert all(cache.get(key(n), "county_damage") is not None for n in (0, 2, 3))
+
+
+def test_the_byte_budget_is_kept():
+    cache = PredictionCache(max_bytes=10_000)
+    for n in range(20):
+        cache.put(key(n), "county_damage", np.zeros(250))  # 2000 bytes each
+        assert cache.stats()["bytes"] <= 10_000
+    assert cache.stats()["entries"] == 5
+    assert cache.stats()["bytes"] == 5 * 2000
+
+
+def test_replacing_a_result_updates_the_size():
+    cache = PredictionCache()
+    cache.put(key(1), "county_damage", np.zeros(1000))
+    cache.put(key(1), "county_damage", np.zeros(10))
+    assert cache.stats()["bytes"] == 80
+
+
+def test_an_entry_larger_than_the_budget_is_kept_alone():
+    cache = PredictionCache(max_bytes=100)
+    cache.put(key(1), "county_damage", np.zeros(10))
+    cache.put(key(2), "county_damage", np.zeros(1000))
+    assert cache.stats()["entries"] == 1
+    assert cache.get(key(2), "county_damage") is not None
+
+
+def test_a_value_of_unknown_size_is_rejected_without_changing_the_cache():
+    cache = PredictionCache()
+    cache.put(key(1), "prediction", 1.0)
+    before = cache.stats()
+    with pytest.raises(TypeError):
+        cache.put(key(1), "map", object())
+    with pytest.raises(TypeError):
+        cache.put(key(2), "map", [1.0, object()])
+    assert cache.stats() == before
+    assert cache.get(key(1), "map") is None
@@ -0,0 +1,127 @@
+"""
+Year hold-out, scaling and model replacement of the incremental retraining (retrain.py), on a
+small model trained here.
+"""
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from features import FEATURE_FILES, SCALER_FILES, FeatureEncoder
+from model_registry import MODEL_FILES
+from retrain import retrain_model, save_model, training_data, training_encoder, unseen_categories
+
+DISASTER_TYPE = "Lightning"
+COLUMNS = ["Year", "DURATION_HOURS", "Density", "State_Kansas", "State_Texas"]
+
+
+def make_table(years, rows_per_year=60, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(years) * rows_per_year
+    table = pd.DataFrame({
+        "Year": np.repeat(years, rows_per_year),
+        "DURATION_HOURS": rng.exponential(3, n),
+        "Density": rng.uniform(1, 2000, n),
+        "State": rng.choice(["Alabama", "Kansas", "Texas"], n),
+        "County": "Somewhere",
+        "GEOID": rng.integers(1000, 9999, n),
+    })
+    table["DAMAGE_PROPERTY"] = np.expm1(5 + table["DURATION_HOURS"] / 3 + (table["State"] == "Texas"))
+    return table
+
+
+@pytest.fixture
+def model_files(tmp_path, monkeypatch):
+    """Features file, scaler and XGBoost model of DISASTER_TYPE, in a temporary working directory."""
+    from sklearn.preprocessing import StandardScaler
+    from xgboost import XGBRegressor
+
+    monkeypatch.chdir(tmp_path)
+    with open(FEATURE_FILES[DISASTER_TYPE], "w") as f:
+        f.write("\n".join(COLUMNS) + "\n")
+    table = make_table(range(2018, 2021))
+    raw = FeatureEncoder(COLUMNS).encode_frame(table[["Year", "DURATION_HOURS", "Density", "State"]])
+    scaler = StandardScaler().fit(raw)
+    joblib.dump(scaler, SCALER_FILES[DISASTER_TYPE])
+    model = XGBRegressor(n_estimators=20, max_depth=3).fit(scaler.transform(raw), np.log1p(table["DAMAGE_PROPERTY"]))
+    joblib.dump(model, MODEL_FILES[DISASTER_TYPE])
+    return table
+
+
+def test_training_data_is_scaled(model_files):
+    X, y, years = training_data(model_files, training_encoder(DISASTER_TYPE))
+    assert np.allclose(X.mean(axis=0), 0, atol=1e-3)
+    assert len(X) == len(y) == len(years) == len(model_files)
+
+
+def test_retraining_needs_the_scaler(model_files):
+    os.remove(SCALER_FILES[DISASTER_TYPE])
+    before = os.path.getmtime(MODEL_FILES[DISASTER_TYPE])
+    with pytest.raises(FileNotFoundError):
+        retrain_model(DISASTER_TYPE, make_table(range(2018, 2023)), [2018, 2019, 2020], rounds=5)
+    assert os.path.getmtime(MODEL_FILES[DISASTER_TYPE]) == before
+
+
+def test_only_rows_of_new_years_are_held_out(model_files):
+    table = make_table(range(2018, 2023), seed=1)
+    summary = retrain_model(DISASTER_TYPE, table, [2018, 2019, 2020], rounds=5)
+    new_rows = int(table["Year"].isin([2021, 2022]).sum())
+    assert 0 < summary["held_out_rows"] < new_rows
+    assert summary["training_rows"] + summary["held_out_rows"] == len(table)
+    assert summary["comparison"] == "held-out rows of new years"
+    assert summary["held_out_rmse_log_before"] is not None and summary["held_out_rmse_log_after"] is not None
+    assert joblib.load(MODEL_FILES[DISASTER_TYPE]).get_booster().num_boosted_rounds() == 25
+
+
+def test_nothing_is_held_out_without_a_new_year(model_files):
+    summary = retrain_model(DISASTER_TYPE, make_table(range(2018, 2021), seed=2), [2018, 2019, 2020], rounds=5)
+    assert summary["held_out_rows"] == 0
+    assert summary["comparison"].startswith("skipped: no new year")
+    assert summary["held_out_rmse_log_before"] is None
+
+
+def test_nothing_is_held_out_when_the_trained_years_are_unknown(model_files):
+    summary = retrain_model(DISASTER_TYPE, make_table(range(2018, 2023), seed=3), None, rounds=5)
+    assert summary["held_out_rows"] == 0
+    assert summary["comparison"].startswith("skipped: the years")
+
+
+def test_save_model_replaces_the_flat_model_too(model_files):
+    from flat_trees import FlatEnsemble, export_model, flat_file
+
+    export_model(MODEL_FILES[DISASTER_TYPE])
+    summary = retrain_model(DISASTER_TYPE, make_table(range(2018, 2023), seed=4), [2018, 2019, 2020], rounds=5)
+    assert summary["training_rows"] > 0
+    model = joblib.load(MODEL_FILES[DISASTER_TYPE])
+    flat = FlatEnsemble.load(flat_file(MODEL_FILES[DISASTER_TYPE]))
+    assert flat.n_trees == 25
+    X = np.random.default_rng(5).normal(size=(200, len(COLUMNS))).astype(np.float32)
+    assert np.allclose(flat.predict(X), model.predict(X), rtol=1e-5, atol=1e-4)
+    assert not [name for name in os.listdir() if name.endswith(".tmp")]
+
+
+def test_save_model_keeps_the_deployed_files_when_the_flat_check_fails(model_files, monkeypatch):
+    import flat_trees
+
+    flat_trees.export_model(MODEL_FILES[DISASTER_TYPE])
+    files = [MODEL_FILES[DISASTER_TYPE], flat_trees.flat_file(MODEL_FILES[DISASTER_TYPE])]
+    before = [open(path, "rb").read() for path in files]
+
+    def mismatch(model, flat, X, **tolerances):
+        raise AssertionError("the flat model does not match")
+
+    monkeypatch.setattr(flat_trees, "check_parity", mismatch)
+    model = joblib.load(MODEL_FILES[DISASTER_TYPE])
+    with pytest.raises(AssertionError):
+        save_model(model, MODEL_FILES[DISASTER_TYPE])
+    assert [open(path, "rb").read() for path in files] == before
+    assert not [name for name in os.listdir() if name.endswith(".tmp")]
+
+
+def test_unseen_categories():
+    encoder = FeatureEncoder(COLUMNS)
+    rows = pd.DataFrame({"State": ["Alabama", "Kansas", "Texas", "Utah"]})
+    # Alabama sorts first, it is the category dropped by pd.get_dummies; Utah was never seen
+    assert unseen_categories(encoder, rows).tolist() == [False, False, False, True]
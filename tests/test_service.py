@@ -0,0 +1,99 @@
+"""
+Request validation and answers of the prediction service (service.py).
+"""
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pytest
+from tornado.testing import AsyncHTTPTestCase
+
+import model_registry
+from conftest import ROOT, write_county_files
+from features import load_encoder
+from service import PredictionService
+
+pytestmark = pytest.mark.skipif(not os.path.exists(os.path.join(ROOT, model_registry.MODEL_FILES["Lightning"])),
+                                reason="the Lightning model is not shipped")
+
+SCENARIO = {"disaster_type": "Lightning", "State": "Texas", "County": "Harris", "Year": 2020, "DURATION_HOURS": 2}
+
+
+class ServiceTest(AsyncHTTPTestCase):
+    def setUp(self):
+        # The feature schemas and the models are read from the root of the repository
+        self.cwd = os.getcwd()
+        os.chdir(ROOT)
+        self.directory = tempfile.mkdtemp()
+        self.cmap_file, self.county_file = write_county_files(self.directory)
+        self.prefer_flat = model_registry.registry.prefer_flat
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        model_registry.registry.prefer_flat = self.prefer_flat
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def get_app(self):
+        self.service = PredictionService(self.cmap_file, self.county_file, window_ms=1)
+        return self.service.application()
+
+    def post(self, body, path="/predict"):
+        response = self.fetch(path, method="POST", body=body if isinstance(body, str) else json.dumps(body))
+        return response.code, json.loads(response.body)
+
+    def test_prediction(self):
+        code, answer = self.post(SCENARIO)
+        assert code == 200
+        # GDP per capita and Density are looked up with the County
+        encoder = load_encoder("Lightning")
+        x = encoder.encode(dict(SCENARIO, GDP_per_capita=1000 + 2020, Density=201 + 2020))
+        expected = np.expm1(model_registry.get_model("Lightning").predict(x[np.newaxis, :])[0])
+        assert answer["predicted_damage"] == pytest.approx(expected, rel=1e-4)
+
+    def test_county_predictions(self):
+        # The county values come from cmap.csv, so a county without data is not a problem
+        code, answer = self.post(dict(SCENARIO, County="Dallas"), "/predict/counties")
+        assert code == 200
+        assert answer["GEOID"] == [48201, 48113, 20173]
+        assert len(answer["predicted_damage"]) == 3 and all(value > 0 for value in answer["predicted_damage"])
+
+    def test_malformed_requests(self):
+        for body in ("not json", "[1, 2]", json.dumps(dict(SCENARIO, Year=None)), json.dumps(dict(SCENARIO, Year=2020.5)),
+                     json.dumps(dict(SCENARIO, DURATION_HOURS="two")), json.dumps(dict(SCENARIO, DURATION_HOURS=[2])),
+                     json.dumps(dict(SCENARIO, DURATION_HOURS=True)), json.dumps(dict(SCENARIO, State=["Texas"])),
+                     json.dumps(dict(SCENARIO, notes={"a": 1}))):
+            code, answer = self.post(body)
+            assert code == 400, body
+            assert answer["error"]
+
+    def test_invalid_values(self):
+        for body in (json.dumps(dict(SCENARIO, DURATION_HOURS=-1)),
+                     json.dumps(dict(SCENARIO, DURATION_HOURS=float("nan"))),
+                     json.dumps(dict(SCENARIO, INJURIES_DIRECT=float("inf"))),
+                     json.dumps(dict(SCENARIO, County="Dallas")),  # no GDP per capita in 2020
+                     json.dumps(dict(SCENARIO, State="Alaska", GDP_per_capita=50000, Density=1))):
+            code, answer = self.post(body)
+            assert code == 422, body
+            assert answer["error"]
+
+    def test_unknown_disaster_type(self):
+        assert self.post(dict(SCENARIO, disaster_type="Hail"))[0] == 404
+        assert self.post(dict(SCENARIO, disaster_type=None))[0] == 404
+
+    def test_missing_model_file(self):
+        with mock.patch.dict(model_registry.registry.model_files, {"Tornado": "missing_tornado_model.pkl"}):
+            code, answer = self.post(dict(SCENARIO, disaster_type="Tornado"))
+        assert code == 503
+        assert "Tornado" in answer["error"]
+
+    def test_metrics(self):
+        self.post(SCENARIO)
+        self.post(SCENARIO)
+        metrics = json.loads(self.fetch("/metrics").body)
+        assert metrics["latency"]["/predict"]["requests"] == 2
+        assert metrics["batching"]["Lightning"]["requests"] == 2
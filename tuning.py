@@ -0,0 +1,416 @@
+"""
+Parallel, resumable hyperparameter search of the models of every disaster type.
+
+It replaces the Bayesian optimisation blocks of Code.ipynb (xgb_bayesian), which were run once
+per model and whose results were then hardcoded:
+- the training and validation matrices of a model are prepared once from its training table
+  (see ingest.py), with the 80/20 split of the notebook, and saved as .npy files that the
+  workers memory-map; they are only prepared again when the table changes,
+- the search space of a model (XGBoost or random forest) is the one of its deployed model file,
+- the trials of all the models run in one pool of worker processes, one trial per core,
+- the parameters of a trial are drawn from the bounds of the notebook by a generator seeded
+  with the trial number, so the same command always proposes the same trials,
+- poor trials are stopped early: the validation RMSE of a trial is checked after 25, 50, 100
+  and 200 boosting rounds (or forest trees) and the trial is pruned when it is worse than the
+  median of the earlier trials of the model at the same point; the XGBoost trials also stop
+  after EARLY_STOPPING_ROUNDS rounds without improvement,
+- every finished trial is appended to <tuning-dir>/<table>/trials.jsonl with the fingerprint
+  of the training table, so an interrupted search resumes where it stopped and a trial that
+  already ran on the same data is never run again. After a data refresh the fingerprint
+  changes: the trials of the old data are kept but not reused, except that their best
+  parameters are tried first.
+
+With --apply the best parameters of every model are refitted on the training matrices and the
+model files are replaced by the same type of estimator (with their flat models, see
+flat_trees.py).
+
+Example:
+    python tuning.py --cache-dir ingest_cache --trials 40
+    python tuning.py Tornado Flood --trials 60 --workers 8 --apply
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from itertools import chain, zip_longest
+
+import numpy as np
+
+import ingest
+from features import SCALER_FILES
+from model_registry import MODEL_FILES
+from retrain import TABLE_TYPES, save_model, table_fingerprint, training_data, training_encoder
+
+TUNING_DIR = "tuning"
+TRIALS_FILE = "trials.jsonl"
+MATRICES_FILE = "matrices.json"
+
+# Training table of each disaster type
+TABLE_NAMES = {disaster_type: name for name, disaster_type in TABLE_TYPES.items()}
+
+# Bounds of the parameters: (low, high, scale); the XGBoost bounds are the ones of the notebook
+SEARCH_SPACES = {
+    "xgboost": {
+        "n_estimators": (50, 500, "int"),
+        "learning_rate": (0.01, 0.3, "log"),
+        "max_depth": (3, 10, "int"),
+        "colsample_bytree": (0.3, 1.0, "float"),
+        "subsample": (0.5, 1.0, "float"),
+        "gamma": (0.0, 5.0, "float"),
+    },
+    "forest": {
+        "n_estimators": (100, 500, "int"),
+        "max_depth": (5, 40, "int"),
+        "min_samples_split": (2, 10, "int"),
+        "min_samples_leaf": (1, 5, "int"),
+        "max_features": (0.2, 1.0, "float"),
+    },
+}
+
+# Validation split of the notebook
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+
+# Boosting rounds (or forest trees) after which a trial can be pruned, and the number of trials
+# that must have reached a checkpoint before it prunes anything
+CHECKPOINTS = (25, 50, 100, 200)
+MIN_TRIALS_TO_PRUNE = 5
+EARLY_STOPPING_ROUNDS = 50
+
+# Best trials of the previous data tried first after a data refresh
+WARM_START_TRIALS = 3
+
+
+def estimator_kind(disaster_type):
+    """
+    Returns the search space ("xgboost" or "forest") of the deployed model of a disaster type,
+    from the type of its pickle like retrain.continue_training; XGBoost, like the notebook, when
+    there is no model file yet.
+    """
+    model_file = MODEL_FILES[disaster_type]
+    if not os.path.exists(model_file):
+        return "xgboost"
+    import joblib
+
+    model = joblib.load(model_file, mmap_mode="r")
+    if hasattr(model, "get_booster"):
+        return "xgboost"
+    if hasattr(model, "estimators_"):
+        return "forest"
+    raise TypeError(f"Cannot tune a {type(model).__name__}")
+
+
+def prepare_matrices(disaster_type, cache_dir=ingest.CACHE_DIR, tuning_dir=TUNING_DIR):
+    """
+    Writes the training and validation matrices of a model, unless they are already there for
+    the current training table.
+
+    Returns:
+    (directory of the matrices and the trials, fingerprint of the training table)
+    """
+    name = TABLE_NAMES[disaster_type]
+    table = ingest.load_table(name, cache_dir)
+    fingerprint = table_fingerprint(table)
+    directory = os.path.join(tuning_dir, name)
+    meta_file = os.path.join(directory, MATRICES_FILE)
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        # Matrices written before they were scaled are prepared again
+        if meta["fingerprint"] == fingerprint and meta.get("scaled"):
+            return directory, fingerprint
+
+    from sklearn.model_selection import train_test_split
+
+    X, y, _ = training_data(table, training_encoder(disaster_type))
+    X_train, X_valid, y_train, y_valid = train_test_split(X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE)
+    os.makedirs(directory, exist_ok=True)
+    for matrix_name, matrix in (("X_train", X_train), ("X_valid", X_valid), ("y_train", y_train), ("y_valid", y_valid)):
+        np.save(os.path.join(directory, f"{matrix_name}.npy"), matrix)
+    # Written last: the matrices are only used once they are all there
+    with open(meta_file + ".tmp", "w") as f:
+        json.dump({"fingerprint": fingerprint, "scaled": True, "training_rows": len(y_train),
+                   "validation_rows": len(y_valid)}, f)
+    os.replace(meta_file + ".tmp", meta_file)
+    return directory, fingerprint
+
+
+@lru_cache(maxsize=None)
+def load_matrices(directory, fingerprint):
+    """Memory-maps the matrices of a model, once per worker process (fingerprint is only part of the cache key)."""
+    return {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ("X_train", "X_valid", "y_train", "y_valid")}
+
+
+@lru_cache(maxsize=None)
+def _dmatrices(directory, fingerprint):
+    # The XGBoost matrices of a model, built once per worker process
+    import xgboost as xgb
+
+    data = load_matrices(directory, fingerprint)
+    return xgb.DMatrix(data["X_train"], label=data["y_train"]), xgb.DMatrix(data["X_valid"], label=data["y_valid"])
+
+
+def sample_params(kind, seed, number):
+    """The parameters of trial number of a search, always the same for the same seed."""
+    rng = np.random.default_rng([seed, number])
+    params = {}
+    for name, (low, high, scale) in SEARCH_SPACES[kind].items():
+        if scale == "int":
+            params[name] = int(rng.integers(low, high + 1))
+        elif scale == "log":
+            params[name] = round(float(np.exp(rng.uniform(np.log(low), np.log(high)))), 4)
+        else:
+            params[name] = round(float(rng.uniform(low, high)), 4)
+    return params
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def prune_thresholds(trials):
+    """Median validation RMSE of the trials at every checkpoint that enough of them reached."""
+    thresholds = {}
+    for checkpoint in CHECKPOINTS:
+        values = [trial["checkpoints"][str(checkpoint)] for trial in trials
+                  if str(checkpoint) in trial.get("checkpoints", {})]
+        if len(values) >= MIN_TRIALS_TO_PRUNE:
+            thresholds[checkpoint] = float(np.median(values))
+    return thresholds
+
+
+def _scores(y, prediction):
+    errors = prediction - y
+    return {
+        "rmse": float(np.sqrt(np.mean(errors ** 2))),
+        "mae": float(np.mean(np.abs(errors))),
+        "r2": float(1 - np.sum(errors ** 2) / np.sum((y - np.mean(y)) ** 2)),
+    }
+
+
+def _train_xgboost(directory, fingerprint, params, thresholds, threads):
+    import xgboost as xgb
+
+    class MedianPruning(xgb.callback.TrainingCallback):
+        # Stops the training at a checkpoint where the trial is worse than the median trial
+        def __init__(self):
+            super().__init__()
+            self.checkpoints = {}
+            self.pruned = False
+
+        def after_iteration(self, model, epoch, evals_log):
+            rounds = epoch + 1
+            if rounds in CHECKPOINTS:
+                rmse = float(evals_log["valid"]["rmse"][-1])
+                self.checkpoints[str(rounds)] = rmse
+                self.pruned = rmse > thresholds.get(rounds, np.inf)
+            return self.pruned
+
+    train, valid = _dmatrices(directory, fingerprint)
+    booster_params = {name: value for name, value in params.items() if name != "n_estimators"}
+    pruning = MedianPruning()
+    booster = xgb.train(
+        dict(booster_params, objective="reg:squarederror", eval_metric="rmse", seed=RANDOM_STATE, nthread=threads),
+        train, num_boost_round=params["n_estimators"], evals=[(valid, "valid")],
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS, callbacks=[pruning], verbose_eval=False,
+    )
+    rounds = booster.best_iteration + 1
+    prediction = booster.predict(valid, iteration_range=(0, rounds))
+    result = {"status": "pruned" if pruning.pruned else "complete", "rounds": rounds, "checkpoints": pruning.checkpoints}
+    return dict(result, **_scores(load_matrices(directory, fingerprint)["y_valid"], prediction))
+
+
+def _train_forest(directory, fingerprint, params, thresholds, threads):
+    from sklearn.ensemble import RandomForestRegressor
+
+    data = load_matrices(directory, fingerprint)
+    model = RandomForestRegressor(warm_start=True, random_state=RANDOM_STATE, n_jobs=threads,
+                                  **{name: value for name, value in params.items() if name != "n_estimators"})
+    result = {"status": "complete", "checkpoints": {}}
+    # The forest grows up to each checkpoint in turn, keeping its trees (warm start)
+    for trees in [checkpoint for checkpoint in CHECKPOINTS if checkpoint < params["n_estimators"]] + [params["n_estimators"]]:
+        model.set_params(n_estimators=trees)
+        model.fit(data["X_train"], data["y_train"])
+        result.update(_scores(data["y_valid"], model.predict(data["X_valid"])), rounds=trees)
+        if trees in CHECKPOINTS:
+            result["checkpoints"][str(trees)] = result["rmse"]
+            if result["rmse"] > thresholds.get(trees, np.inf):
+                result["status"] = "pruned"
+                break
+    return result
+
+
+def run_trial(task):
+    """Trains and scores one trial in a worker process; returns its record for the trials file."""
+    start = time.perf_counter()
+    train = _train_xgboost if task["kind"] == "xgboost" else _train_forest
+    try:
+        result = train(task["directory"], task["fingerprint"], task["params"], task["thresholds"], task["threads"])
+    except Exception as e:
+        result = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    return {
+        "disaster_type": task["disaster_type"],
+        "number": task["number"],
+        "fingerprint": task["fingerprint"],
+        "params": task["params"],
+        **result,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def read_trials(trials_file):
+    if not os.path.exists(trials_file):
+        return []
+    with open(trials_file) as f:
+        # A line cut by an interrupted write is skipped
+        return [json.loads(line) for line in f if line.strip().endswith("}")]
+
+
+def append_trial(trials_file, record):
+    with open(trials_file, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def best_trial(trials):
+    complete = [trial for trial in trials if trial["status"] == "complete"]
+    return min(complete, key=lambda trial: trial["rmse"]) if complete else None
+
+
+def plan_trials(disaster_type, directory, fingerprint, n_trials, seed):
+    """
+    Returns the study of a model: its trials on the current data and the queue of the trials
+    to run, without the ones that already ran.
+    """
+    kind = estimator_kind(disaster_type)
+    trials_file = os.path.join(directory, TRIALS_FILE)
+    # The trials of another search space (the deployed model changed type) are not reused
+    previous = [trial for trial in read_trials(trials_file) if set(trial["params"]) == set(SEARCH_SPACES[kind])]
+    trials = [trial for trial in previous if trial["fingerprint"] == fingerprint]
+    ran = {params_key(trial["params"]) for trial in trials if trial["status"] != "failed"}
+
+    older = sorted((trial for trial in previous if trial["fingerprint"] != fingerprint and trial["status"] == "complete"),
+                   key=lambda trial: trial["rmse"])
+    candidates = [(trial["number"], trial["params"]) for trial in older[:WARM_START_TRIALS]]
+    candidates += [(number, sample_params(kind, seed, number)) for number in range(n_trials)]
+    queue = []
+    for number, params in candidates:
+        if params_key(params) not in ran:
+            ran.add(params_key(params))
+            queue.append((number, params))
+    return {"disaster_type": disaster_type, "kind": kind, "directory": directory, "fingerprint": fingerprint,
+            "trials_file": trials_file, "trials": trials, "queue": queue}
+
+
+def search(disaster_types=None, n_trials=40, workers=None, cache_dir=ingest.CACHE_DIR, tuning_dir=TUNING_DIR, seed=42):
+    """
+    Runs the trials of every model in a process pool (see the module docstring).
+
+    Returns:
+    {disaster type: best trial on the current data, or None}
+    """
+    workers = workers or os.cpu_count()
+    studies = []
+    for disaster_type in disaster_types or list(MODEL_FILES):
+        if not os.path.exists(ingest.table_file(cache_dir, TABLE_NAMES[disaster_type])):
+            print(f"{disaster_type}: no training table in {cache_dir}, skipped", file=sys.stderr)
+            continue
+        if not os.path.exists(SCALER_FILES[disaster_type]):
+            # The models are fitted on scaled features (see retrain.training_encoder)
+            print(f"{disaster_type}: {SCALER_FILES[disaster_type]} not found, skipped", file=sys.stderr)
+            continue
+        directory, fingerprint = prepare_matrices(disaster_type, cache_dir, tuning_dir)
+        study = plan_trials(disaster_type, directory, fingerprint, n_trials, seed)
+        print(f"{disaster_type}: {len(study['trials'])} trials already ran, {len(study['queue'])} to run", file=sys.stderr)
+        studies.append(study)
+
+    # The models take turns, so that every one of them gets pruning thresholds early
+    pending = deque(task for task in chain.from_iterable(zip_longest(*[
+        [(study, number, params) for number, params in study["queue"]] for study in studies
+    ])) if task is not None)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    running = {}
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                study, number, params = pending.popleft()
+                task = {"disaster_type": study["disaster_type"], "kind": study["kind"], "directory": study["directory"],
+                        "fingerprint": study["fingerprint"], "number": number, "params": params,
+                        "thresholds": prune_thresholds(study["trials"]), "threads": threads}
+                running[pool.submit(run_trial, task)] = study
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                study = running.pop(future)
+                record = future.result()
+                # Only the main process writes the trials files
+                append_trial(study["trials_file"], record)
+                study["trials"].append(record)
+                score = f"RMSE (log) {record['rmse']:.4f}" if "rmse" in record else record.get("error")
+                print(f"{record['disaster_type']} trial {record['number']}: {record['status']}, {score}, "
+                      f"{record['seconds']}s", file=sys.stderr)
+    except KeyboardInterrupt:
+        # The finished trials are already saved, the next run resumes from them
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return {study["disaster_type"]: best_trial(study["trials"]) for study in studies}
+
+
+def apply_best(disaster_type, trial, directory):
+    """
+    Refits the model of a disaster type with the parameters of a trial and replaces its model
+    file, with the same type of estimator as the deployed model.
+    """
+    kind = estimator_kind(disaster_type)
+    if set(trial["params"]) != set(SEARCH_SPACES[kind]):
+        raise ValueError(f"The trial of {disaster_type} is not a {kind} trial, the deployed model was not replaced")
+    data = load_matrices(directory, trial["fingerprint"])
+    params = dict(trial["params"], n_estimators=trial["rounds"], random_state=RANDOM_STATE)
+    if kind == "xgboost":
+        from xgboost import XGBRegressor
+
+        model = XGBRegressor(**params)
+    else:
+        from sklearn.ensemble import RandomForestRegressor
+
+        model = RandomForestRegressor(**params)
+    save_model(model.fit(data["X_train"], data["y_train"]), MODEL_FILES[disaster_type])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the hyperparameters of the models in parallel.")
+    parser.add_argument("disaster_types", nargs="*", help="disaster types to tune (default: all)")
+    parser.add_argument("--cache-dir", default=ingest.CACHE_DIR, help="ingestion cache with the training tables")
+    parser.add_argument("--tuning-dir", default=TUNING_DIR, help="directory of the matrices and the trials")
+    parser.add_argument("--trials", type=int, default=40, help="trials per model, including the ones that already ran")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--apply", action="store_true", help="refit the models with their best parameters")
+    args = parser.parse_args(argv)
+    unknown = [disaster_type for disaster_type in args.disaster_types if disaster_type not in MODEL_FILES]
+    if unknown:
+        parser.error(f"unknown disaster types: {', '.join(unknown)} (choose from {', '.join(MODEL_FILES)})")
+
+    best = search(args.disaster_types, args.trials, args.workers, args.cache_dir, args.tuning_dir, args.seed)
+    summary = {}
+    for disaster_type, trial in best.items():
+        if trial is None:
+            print(f"{disaster_type}: no complete trial", file=sys.stderr)
+            continue
+        summary[disaster_type] = {name: trial[name] for name in ("params", "rounds", "rmse", "mae", "r2", "number")}
+        if args.apply:
+            apply_best(disaster_type, trial, os.path.join(args.tuning_dir, TABLE_NAMES[disaster_type]))
+            print(f"{disaster_type}: {MODEL_FILES[disaster_type]} refitted with the best parameters", file=sys.stderr)
+    os.makedirs(args.tuning_dir, exist_ok=True)
+    with open(os.path.join(args.tuning_dir, "best_params.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()